@@ -3,8 +3,21 @@
 
 #include <uapi/linux/stat.h>
 #include <linux/fs.h>
+#include <linux/sched.h>
 #include <linux/uio.h>
 #include <uapi/linux/ptrace.h>
+#ifdef KEY_MNTNS
+#include <linux/nsproxy.h>
+#include <linux/ns_common.h>
+
+// struct mnt_namespace is private to fs/mount.h, only its ns member is read
+struct mnt_namespace {
+#if LINUX_VERSION_CODE < KERNEL_VERSION(5, 11, 0)
+	atomic_t count;
+#endif
+	struct ns_common ns;
+};
+#endif
 
 struct start_t {
 	struct inode *inode;
@@ -12,13 +25,94 @@ struct start_t {
 	u64 count;
 };
 
-BPF_HASH(starts, u32, struct start_t);
+#ifndef STARTS_MAP_SIZE
+#define STARTS_MAP_SIZE 10240
+#endif
+#ifndef COUNTS_MAP_SIZE
+#define COUNTS_MAP_SIZE 10240
+#endif
+
+// LRU, so entries of lost kretprobes are recycled rather than filling the map up.
+// User space also sweeps entries older than --starts-max-age.
+BPF_TABLE("lru_hash", u32, struct start_t, starts, STARTS_MAP_SIZE);
+
+// failed inserts into the maps, i.e. samples lost because a map is full
+enum drop_t {
+	DROP_COUNTS,
+	DROP_STARTS,
+	DROP_SLOW_OPS,
+	DROP_EXECS,
+	DROP_MAX,
+};
+
+BPF_PERCPU_ARRAY(drops, u64, DROP_MAX);
+
+static void count_drop(int reason)
+{
+	u64 *count = drops.lookup(&reason);
+	if (count)
+		(*count)++;
+}
+
+// An LRU insert never fails, the least recently used start is evicted instead. Starts
+// inserted by entry probes and taken by return probes are counted, user space derives
+// the evicted ones from them.
+enum start_event_t {
+	STARTS_INSERTED,
+	STARTS_TAKEN,
+	STARTS_EVENTS_MAX,
+};
+
+BPF_PERCPU_ARRAY(start_events, u64, STARTS_EVENTS_MAX);
 
-// the key for the output summary
+static void count_start_event(int event)
+{
+	u64 *count = start_events.lookup(&event);
+	if (count)
+		(*count)++;
+}
+
+// operation identifiers, in the order of the struct stats_t members
+enum nfs_op_t {
+	OP_OPEN,
+	OP_CLOSE,
+	OP_SETATTR,
+	OP_GETATTR,
+	OP_FLUSH,
+	OP_MMAP,
+	OP_FSYNC,
+	OP_LOCK,
+	OP_READ,
+	OP_WRITE,
+	OP_CREATE,
+	OP_LINK,
+	OP_UNLINK,
+	OP_SYMLINK,
+	OP_READDIR,
+	OP_LOOKUP,
+	OP_RENAME,
+	OP_ACCESS,
+	OP_LISTXATTR,
+	OP_MKDIR,
+	OP_RMDIR,
+	OP_MAX,
+};
+
+// the key for the output summary, fields user space aggregates away anyway
+// are dropped from it by the DROP_KEY_* definitions
 struct info_t {
-	u32 pid;
+#ifdef KEY_CGROUP
+	u64 cgroup;
+#endif
+#ifndef DROP_KEY_TGID
 	u32 tgid;
+#endif
+#ifndef DROP_KEY_UID
 	u32 uid;
+#endif
+#ifdef KEY_MNTNS
+	u32 mntns;
+#endif
 	char comm[TASK_COMM_LEN];
 	u32 sbdev;
 };
@@ -61,64 +155,493 @@ struct stats_t {
 	struct stat_t rmdir;
 };
 
-BPF_HASH(counts, struct info_t, struct stats_t);
+#ifdef PERCPU_COUNTS
+// per-CPU values, summed up in user space. No cross-CPU contention and no lost updates.
+#define COUNTS_TABLE(name) BPF_PERCPU_HASH(name, struct info_t, struct stats_t, COUNTS_MAP_SIZE)
+#else
+#define COUNTS_TABLE(name) BPF_HASH(name, struct info_t, struct stats_t, COUNTS_MAP_SIZE)
+#endif
+
+COUNTS_TABLE(counts);
+
+#ifdef DOUBLE_BUFFER
+// Probes update the active set of maps (counts/hists or counts_alt/hists_alt) while
+// user space flips the index and drains the inactive set.
+COUNTS_TABLE(counts_alt);
+BPF_ARRAY(counts_active, u32, 1);
+
+static u32 get_active()
+{
+	int idx = 0;
+	u32 *active = counts_active.lookup(&idx);
+	return active ? *active : 0;
+}
+#else
+static u32 get_active()
+{
+	return 0;
+}
+#endif
+
+#ifdef LATENCY_HIST
+#ifndef HIST_MAP_SIZE
+#define HIST_MAP_SIZE 65536
+#endif
+// number of log2 latency buckets (in usecs), the last one also holds all slower calls
+#define HIST_SLOTS 32
+
+struct hist_key_t {
+	struct info_t info;
+	u32 op;
+	u32 slot;
+};
+
+BPF_HISTOGRAM(hists, struct hist_key_t, HIST_MAP_SIZE);
+#ifdef DOUBLE_BUFFER
+BPF_HISTOGRAM(hists_alt, struct hist_key_t, HIST_MAP_SIZE);
+#endif
+
+static void update_hist(u32 active, struct info_t *info, int op, u64 delta)
+{
+	struct hist_key_t key = {
+		.info = *info,
+		.op = op,
+		.slot = bpf_log2l(delta / 1000),
+	};
+	if (key.slot >= HIST_SLOTS)
+		key.slot = HIST_SLOTS - 1;
+#ifdef DOUBLE_BUFFER
+	if (active) {
+		hists_alt.increment(key);
+		return;
+	}
+#endif
+	hists.increment(key);
+}
+#else
+static void update_hist(u32 active, struct info_t *info, int op, u64 delta) {}
+#endif
+
+#ifdef SLOW_OPS
+#ifndef SLOW_OPS_PAGES
+#define SLOW_OPS_PAGES 16
+#endif
+#ifndef SLOW_OPS_RATE
+#define SLOW_OPS_RATE 100
+#endif
+
+// a call slower than the latency threshold of its operation
+struct slow_op_t {
+	u64 ts;
+	u64 latency;
+	u64 ino;
+	u32 tgid;
+	u32 sbdev;
+	u32 op;
+	char comm[TASK_COMM_LEN];
+};
+
+BPF_RINGBUF_OUTPUT(slow_ops, SLOW_OPS_PAGES);
+// latency threshold (in nsecs) of every operation, 0 disables it; set by user space
+BPF_ARRAY(slow_op_thresholds, u64, OP_MAX);
+
+struct slow_ops_budget_t {
+	u64 second;
+	u64 count;
+};
+
+// events reported by the CPU in the current second, at most SLOW_OPS_RATE
+BPF_PERCPU_ARRAY(slow_ops_budget, struct slow_ops_budget_t, 1);
+
+static void report_slow_op(struct info_t *info, int op, u64 delta, struct inode *inode)
+{
+	u64 *threshold = slow_op_thresholds.lookup(&op);
+	if (!threshold || !*threshold || delta < *threshold)
+		return;
+
+	int idx = 0;
+	struct slow_ops_budget_t *budget = slow_ops_budget.lookup(&idx);
+	if (!budget)
+		return;
+	u64 now = bpf_ktime_get_ns();
+	if (budget->second != now / 1000000000) {
+		budget->second = now / 1000000000;
+		budget->count = 0;
+	}
+	if (budget->count >= SLOW_OPS_RATE) {
+		count_drop(DROP_SLOW_OPS);
+		return;
+	}
+	budget->count++;
+
+	struct slow_op_t *event = slow_ops.ringbuf_reserve(sizeof(struct slow_op_t));
+	if (!event) {
+		count_drop(DROP_SLOW_OPS);
+		return;
+	}
+	event->ts = now;
+	event->latency = delta;
+	event->ino = inode->i_ino;
+	event->tgid = bpf_get_current_pid_tgid() >> 32;
+	event->sbdev = info->sbdev;
+	event->op = op;
+	__builtin_memcpy(event->comm, info->comm, sizeof(event->comm));
+	slow_ops.ringbuf_submit(event, 0);
+}
+#else
+static void report_slow_op(struct info_t *info, int op, u64 delta, struct inode *inode) {}
+#endif
+
+enum task_event_type_t {
+	TASK_EXEC,
+	TASK_FORK,
+	TASK_EXIT,
+};
+
+// header of the events sent to user space, fork and exit events carry only this
+struct task_event_t {
+	u32 pid;
+	u32 type;
+	// parent tgid of TASK_FORK events
+	u32 ppid;
+};
+
+#ifdef EXEC_ENVS
+#ifndef EXEC_ENVS_SCAN
+#define EXEC_ENVS_SCAN 256
+#endif
+// every scanned entry walks the prefix loop, more would exceed the verifier limits
+#if EXEC_ENVS_SCAN > 512
+#error "EXEC_ENVS_SCAN is at most 512"
+#endif
+#ifndef EXEC_ENVS_MAX
+#define EXEC_ENVS_MAX 4
+#endif
+#define ENV_PREFIX_LEN 32
+#define ENV_LEN 128
+
+// a tracked env prefix, e.g. "JOBID" (the first ENV_PREFIX_LEN bytes of longer ones)
+struct env_prefix_t {
+	u32 len;
+	char prefix[ENV_PREFIX_LEN];
+};
+
+// the tracked env prefixes with their index and the bitmask of their lengths (bit i for
+// length i + 1), maintained by user space
+BPF_HASH(env_prefixes, struct env_prefix_t, u8, 256);
+BPF_ARRAY(env_prefix_lens, u32, 1);
+// bitmask of the indexes of all the tracked env prefixes, 0 with more than 32 of them
+BPF_ARRAY(env_prefix_all, u32, 1);
+
+struct pidinfo_t {
+	u32 pid;
+	u32 type;
+	u32 ppid;
+	u32 nenvs;
+	// envp was scanned to its end and all the matching entries fit in envs,
+	// user space reads /proc/<pid>/environ otherwise
+	u32 complete;
+	char envs[EXEC_ENVS_MAX][ENV_LEN];
+};
+
+// too large for the stack
+BPF_PERCPU_ARRAY(exec_scratch, struct pidinfo_t, 1);
+
+// Whether env starts with a tracked prefix. The index of the prefix is set in found
+// when env is the variable named by the prefix, not a longer one starting with it.
+static int match_env_prefix(const char *env, u32 lens, u32 *found)
+{
+	struct env_prefix_t key = {};
+	for (int i = 0; i < ENV_PREFIX_LEN; i++) {
+		if (!env[i])
+			return 0;
+		key.prefix[i] = env[i];
+		key.len = i + 1;
+		if (!(lens & (1u << i)))
+			continue;
+		u8 *idx = env_prefixes.lookup(&key);
+		if (!idx)
+			continue;
+		if (env[i + 1] == '=' && *idx < 32)
+			*found |= 1u << *idx;
+		return 1;
+	}
+	return 0;
+}
 
+static void capture_envs(struct pidinfo_t *data, const char __user *const __user *envp)
+{
+	int idx = 0;
+	u32 *lens = env_prefix_lens.lookup(&idx);
+	u32 *all = env_prefix_all.lookup(&idx);
+	u32 found = 0;
+	data->nenvs = 0;
+	data->complete = 0;
+	if (!lens || !all)
+		return;
+
+	for (int i = 0; i < EXEC_ENVS_SCAN; i++) {
+		const char *env = NULL;
+		bpf_probe_read_user(&env, sizeof(env), &envp[i]);
+		if (!env) {
+			data->complete = 1;
+			return;
+		}
+		u32 n = data->nenvs;
+		if (n >= EXEC_ENVS_MAX)
+			return;
+		int len = bpf_probe_read_user_str(data->envs[n], ENV_LEN, env);
+		if (len <= 0 || !match_env_prefix(data->envs[n], *lens, &found))
+			continue;
+		// the value may be truncated
+		if (len >= ENV_LEN)
+			return;
+		data->nenvs = n + 1;
+		// the rest of envp isn't needed once every tracked variable is found
+		if (*all && found == *all) {
+			data->complete = 1;
+			return;
+		}
+	}
+}
+#else
 struct pidinfo_t {
 	u32 pid;
+	u32 type;
+	u32 ppid;
 };
+#endif
 
+#ifdef EXEC_RINGBUF
+#ifndef EXEC_RINGBUF_PAGES
+#define EXEC_RINGBUF_PAGES 64
+#endif
+// one ring buffer shared by all CPUs, consumed in batches by user space
+BPF_RINGBUF_OUTPUT(events, EXEC_RINGBUF_PAGES);
+#else
 BPF_PERF_OUTPUT(events);
+#endif
 
-int trace_execve(struct pt_regs *ctx,
+// the syscall__ prefix has BCC read the arguments of syscall wrappers right
+int syscall__execve(struct pt_regs *ctx,
 		const char __user *filename,
 		const char __user *const __user *argv,
 		const char __user *const __user *envp)
 {
-
-	struct pidinfo_t data = {
+#ifdef EXEC_ENVS
+	int idx = 0;
+	struct pidinfo_t *data = exec_scratch.lookup(&idx);
+	if (!data)
+		return 0;
+	data->pid = bpf_get_current_pid_tgid() >> 32;
+	data->type = TASK_EXEC;
+	data->ppid = 0;
+	capture_envs(data, envp);
+#else
+	struct pidinfo_t info = {
 		.pid = bpf_get_current_pid_tgid() >> 32,
 	};
-	events.perf_submit(ctx, &data, sizeof(data));
+	struct pidinfo_t *data = &info;
+#endif
+#ifdef EXEC_RINGBUF
+	if (events.ringbuf_output(data, sizeof(*data), 0))
+		count_drop(DROP_EXECS);
+#else
+	events.perf_submit(ctx, data, sizeof(*data));
+#endif
 	return 0;
 }
 
-static struct stats_t *get_stats(u64 *start_time, u64 *byte_count)
+static void submit_task_event(void *ctx, struct task_event_t *event)
+{
+#ifdef EXEC_RINGBUF
+	if (events.ringbuf_output(event, sizeof(*event), 0))
+		count_drop(DROP_EXECS);
+#else
+	events.perf_submit(ctx, event, sizeof(*event));
+#endif
+}
+
+static struct stats_t *get_stats(u32 active, struct info_t *info, struct start_t *start)
 {
 	u32 pid = bpf_get_current_pid_tgid();
 
 	struct start_t *startp = starts.lookup(&pid);
 	if (!startp)
 		return NULL;
-	// update output variables taken in the function entrypoint
-	*start_time = startp->start;
-	if (byte_count)
-		*byte_count = startp->count;
-
-	struct info_t info = {
-		.pid = pid,
-		.tgid = bpf_get_current_pid_tgid() >> 32,
-		.uid = bpf_get_current_uid_gid(),
-		.sbdev = startp->inode->i_sb->s_dev,
-	};
-	bpf_get_current_comm(&info.comm, sizeof(info.comm));
+	// copy out the start taken in the function entrypoint
+	*start = *startp;
+
+#ifndef DROP_KEY_TGID
+	info->tgid = bpf_get_current_pid_tgid() >> 32;
+#endif
+#ifndef DROP_KEY_UID
+	info->uid = bpf_get_current_uid_gid();
+#endif
+#ifdef KEY_CGROUP
+	info->cgroup = bpf_get_current_cgroup_id();
+#endif
+#ifdef KEY_MNTNS
+	// mounts are resolved in the mount namespace of the caller
+	struct task_struct *task = (struct task_struct *)bpf_get_current_task();
+	info->mntns = task->nsproxy->mnt_ns->ns.inum;
+#endif
+	info->sbdev = startp->inode->i_sb->s_dev;
+	bpf_get_current_comm(&info->comm, sizeof(info->comm));
 
 	// delete the start from the map, no need for it
 	starts.delete(&pid);
+	count_start_event(STARTS_TAKEN);
 
 	struct stats_t zero = {};
-	return counts.lookup_or_try_init(&info, &zero);
+	struct stats_t *statsp;
+#ifdef DOUBLE_BUFFER
+	if (active)
+		statsp = counts_alt.lookup_or_try_init(info, &zero);
+	else
+#endif
+		statsp = counts.lookup_or_try_init(info, &zero);
+	if (!statsp)
+		count_drop(DROP_COUNTS);
+	return statsp;
+}
+
+static struct stat_t *get_op_stat(struct stats_t *statsp, int op)
+{
+	switch (op) {
+	case OP_OPEN:		return &statsp->open;
+	case OP_CLOSE:		return &statsp->close;
+	case OP_SETATTR:	return &statsp->setattr;
+	case OP_GETATTR:	return &statsp->getattr;
+	case OP_FLUSH:		return &statsp->flush;
+	case OP_MMAP:		return &statsp->mmap;
+	case OP_FSYNC:		return &statsp->fsync;
+	case OP_LOCK:		return &statsp->lock;
+	case OP_READ:		return &statsp->read;
+	case OP_WRITE:		return &statsp->write;
+	case OP_CREATE:		return &statsp->create;
+	case OP_LINK:		return &statsp->link;
+	case OP_UNLINK:		return &statsp->unlink;
+	case OP_SYMLINK:	return &statsp->symlink;
+	case OP_READDIR:	return &statsp->readdir;
+	case OP_LOOKUP:		return &statsp->lookup;
+	case OP_RENAME:		return &statsp->rename;
+	case OP_ACCESS:		return &statsp->access;
+	case OP_LISTXATTR:	return &statsp->listxattr;
+	case OP_MKDIR:		return &statsp->mkdir;
+	case OP_RMDIR:		return &statsp->rmdir;
+	}
+	return NULL;
 }
 
 static struct start_t *get()
 {
 	u32 pid = bpf_get_current_pid_tgid();
+	struct start_t *startp = starts.lookup(&pid);
+	if (startp)
+		return startp;
 	struct start_t zero = {};
-	return starts.lookup_or_try_init(&pid, &zero);
+	if (starts.insert(&pid, &zero) == 0)
+		count_start_event(STARTS_INSERTED);
+	startp = starts.lookup(&pid);
+	if (!startp)
+		count_drop(DROP_STARTS);
+	return startp;
+}
+
+#ifdef MOUNT_FILTER
+#ifndef MOUNT_FILTER_SIZE
+#define MOUNT_FILTER_SIZE 1024
+#endif
+// superblock devices of the traced mounts, maintained by user space
+BPF_HASH(mount_filter, u32, u8, MOUNT_FILTER_SIZE);
+
+static int should_filter_mount(struct inode *inode)
+{
+	u32 sbdev = inode->i_sb->s_dev;
+	return mount_filter.lookup(&sbdev) == NULL;
+}
+#else
+static int should_filter_mount(struct inode *inode)
+{
+	return 0;
+}
+#endif
+
+#ifdef PID_FILTER
+#ifndef PID_FILTER_SIZE
+#define PID_FILTER_SIZE 65536
+#endif
+// tgids of the processes whose environment matches the tag filter, maintained by user space
+BPF_HASH(pid_filter, u32, u8, PID_FILTER_SIZE);
+
+static int should_filter_pid()
+{
+	u32 tgid = bpf_get_current_pid_tgid() >> 32;
+	if (pid_filter.lookup(&tgid))
+		return 0;
+
+	// forked children inherit the environment of their parent until they exec
+	struct task_struct *task = (struct task_struct *)bpf_get_current_task();
+	u32 ptgid = task->real_parent->tgid;
+	u8 *matched = pid_filter.lookup(&ptgid);
+	if (!matched)
+		return 1;
+	pid_filter.update(&tgid, matched);
+	return 0;
+}
+#else
+static int should_filter_pid()
+{
+	return 0;
+}
+#endif
+
+// new processes inherit the environment of their parent until they exec
+int trace_task_fork(struct bpf_raw_tracepoint_args *ctx)
+{
+	struct task_struct *parent = (struct task_struct *)ctx->args[0];
+	struct task_struct *child = (struct task_struct *)ctx->args[1];
+	struct task_event_t event = {
+		.pid = child->tgid,
+		.type = TASK_FORK,
+		.ppid = parent->tgid,
+	};
+	// a new thread
+	if (event.pid == event.ppid)
+		return 0;
+#ifdef PID_FILTER
+	u8 *matched = pid_filter.lookup(&event.ppid);
+	if (matched)
+		pid_filter.update(&event.pid, matched);
+#endif
+	submit_task_event(ctx, &event);
+	return 0;
 }
 
-static int trace_nfs_function_entry(struct pt_regs *ctx,
-		struct inode *inode, u64 count)
+int trace_task_exit(struct bpf_raw_tracepoint_args *ctx)
 {
+	struct task_struct *task = (struct task_struct *)bpf_get_current_task();
+	// only the last thread of the process
+	if (task->signal->live.counter)
+		return 0;
+	struct task_event_t event = {
+		.pid = bpf_get_current_pid_tgid() >> 32,
+		.type = TASK_EXIT,
+	};
+#ifdef PID_FILTER
+	pid_filter.delete(&event.pid);
+#endif
+	submit_task_event(ctx, &event);
+	return 0;
+}
+
+static int trace_nfs_function_entry(struct inode *inode, u64 count)
+{
+	// filter out before anything is recorded, neither starts nor counts are touched
+	if (should_filter_pid() || should_filter_mount(inode))
+		return 0;
+
 	struct start_t *startp = get();
 	if (!startp)
 		return 0;
@@ -129,6 +652,29 @@ static int trace_nfs_function_entry(struct pt_regs *ctx,
 	return 0;
 }
 
+static int trace_nfs_function_ret(long rc, int op)
+{
+	struct info_t info = {};
+	u32 active = get_active();
+	struct start_t start;
+	struct stats_t *statsp = get_stats(active, &info, &start);
+	if (!statsp)
+		return 0;
+
+	struct stat_t *stat = get_op_stat(statsp, op);
+	if (!stat)
+		return 0;
+
+	u64 delta = bpf_ktime_get_ns() - start.start;
+	stat->count++;
+	if (rc)
+		stat->errors++;
+	stat->duration += delta;
+	update_hist(active, &info, op, delta);
+	report_slow_op(&info, op, delta, start.inode);
+	return 0;
+}
+
 static int should_filter_file(struct file *file)
 {
 	struct dentry *de = file->f_path.dentry;
@@ -145,71 +691,80 @@ static int should_filter_file(struct file *file)
 	return 0;
 }
 
-static int file_read_write(struct pt_regs *ctx, struct file *file,
-		size_t count, int is_read)
+static int file_read_write(struct file *file, size_t count, int is_read)
 {
 	if (should_filter_file(file))
 		return 0;
 
-	return trace_nfs_function_entry(ctx, file->f_inode, count);
+	return trace_nfs_function_entry(file->f_inode, count);
 }
 
-static int file_read_write_ret(struct pt_regs *ctx, int is_read)
+static int file_read_write_ret(long rc, int is_read)
 {
-	u64 start, count;
-	struct stats_t *statsp = get_stats(&start, &count);
+	struct info_t info = {};
+	u32 active = get_active();
+	struct start_t start;
+	struct stats_t *statsp = get_stats(active, &info, &start);
 	if (!statsp)
 		return 0;
 
+	u64 delta = bpf_ktime_get_ns() - start.start;
 	if (is_read) {
 		statsp->read.count++;
-		statsp->rbytes += count;
-		if (PT_REGS_RC(ctx) < 0)
+		statsp->rbytes += start.count;
+		if (rc < 0)
 			statsp->read.errors++;
-		statsp->read.duration += bpf_ktime_get_ns() - start;
+		statsp->read.duration += delta;
+		update_hist(active, &info, OP_READ, delta);
+		report_slow_op(&info, OP_READ, delta, start.inode);
 	} else {
 		statsp->write.count++;
-		statsp->wbytes += count;
-		if (PT_REGS_RC(ctx) < 0)
+		statsp->wbytes += start.count;
+		if (rc < 0)
 			statsp->write.errors++;
-		statsp->write.duration += bpf_ktime_get_ns() - start;
+		statsp->write.duration += delta;
+		update_hist(active, &info, OP_WRITE, delta);
+		report_slow_op(&info, OP_WRITE, delta, start.inode);
 	}
 
 	return 0;
 }
 
+#ifndef USE_FENTRY
+// kprobe/kretprobe handlers, attached by StatsCollector.attach
+
 int trace_nfs_file_read(struct pt_regs *ctx, struct kiocb *iocb,
 		struct iov_iter *to)
 {
-	return file_read_write(ctx, iocb->ki_filp, to->count, 1);
+	return file_read_write(iocb->ki_filp, to->count, 1);
 }
 
 int trace_nfs_file_read_ret(struct pt_regs *ctx)
 {
-	return file_read_write_ret(ctx, 1);
+	return file_read_write_ret(PT_REGS_RC(ctx), 1);
 }
 
 int trace_nfs_file_write(struct pt_regs *ctx, struct kiocb *iocb,
 		struct iov_iter *from)
 {
-	return file_read_write(ctx, iocb->ki_filp, from->count, 0);
+	return file_read_write(iocb->ki_filp, from->count, 0);
 }
 
 int trace_nfs_file_write_ret(struct pt_regs *ctx)
 {
-	return file_read_write_ret(ctx, 0);
+	return file_read_write_ret(PT_REGS_RC(ctx), 0);
 }
 
 int trace_nfs_file_splice_read(struct pt_regs *ctx, struct file *in,
 		loff_t *ppos, struct pipe_inode_info *pipe,
 		size_t len, unsigned int flags)
 {
-	return file_read_write(ctx, in, len, 1);
+	return file_read_write(in, len, 1);
 }
 
 int trace_nfs_file_splice_ret(struct pt_regs *ctx)
 {
-	return file_read_write_ret(ctx, 1);
+	return file_read_write_ret(PT_REGS_RC(ctx), 1);
 }
 
 int trace_nfs_file_open(struct pt_regs *ctx, struct inode *inode,
@@ -218,21 +773,12 @@ int trace_nfs_file_open(struct pt_regs *ctx, struct inode *inode,
 	if (should_filter_file(file))
 		return 0;
 
-	return trace_nfs_function_entry(ctx, inode, 0);
+	return trace_nfs_function_entry(inode, 0);
 }
 
 int trace_nfs_file_open_ret(struct pt_regs *ctx)
 {
-	u64 start;
-	struct stats_t *statsp = get_stats(&start, NULL);
-	if (!statsp)
-		return 0;
-
-	statsp->open.count++;
-	if (PT_REGS_RC(ctx))
-		statsp->open.errors++;
-	statsp->open.duration += bpf_ktime_get_ns() - start;
-	return 0;
+	return trace_nfs_function_ret(PT_REGS_RC(ctx), OP_OPEN);
 }
 
 int trace_nfs_getattr(struct pt_regs *ctx,
@@ -244,21 +790,12 @@ struct user_namespace *mnt_userns,
 		const struct path *path, struct kstat *stat, u32 request_mask,
 		unsigned int query_flags)
 {
-	return trace_nfs_function_entry(ctx, path->dentry->d_inode, 0);
+	return trace_nfs_function_entry(path->dentry->d_inode, 0);
 }
 
 int trace_nfs_getattr_ret(struct pt_regs *ctx)
 {
-	u64 start;
-	struct stats_t *statsp = get_stats(&start, NULL);
-	if (!statsp)
-		return 0;
-
-	statsp->getattr.count++;
-	if (PT_REGS_RC(ctx))
-		statsp->getattr.errors++;
-	statsp->getattr.duration += bpf_ktime_get_ns() - start;
-	return 0;
+	return trace_nfs_function_ret(PT_REGS_RC(ctx), OP_GETATTR);
 }
 
 int trace_nfs_setattr(struct pt_regs *ctx,
@@ -269,21 +806,12 @@ struct user_namespace *mnt_userns,
 #endif
 		struct dentry *dentry, struct iattr *attr)
 {
-	return trace_nfs_function_entry(ctx, dentry->d_inode, 0);
+	return trace_nfs_function_entry(dentry->d_inode, 0);
 }
 
 int trace_nfs_setattr_ret(struct pt_regs *ctx)
 {
-	u64 start;
-	struct stats_t *statsp = get_stats(&start, NULL);
-	if (!statsp)
-		return 0;
-
-	statsp->setattr.count++;
-	if (PT_REGS_RC(ctx))
-		statsp->setattr.errors++;
-	statsp->setattr.duration += bpf_ktime_get_ns() - start;
-	return 0;
+	return trace_nfs_function_ret(PT_REGS_RC(ctx), OP_SETATTR);
 }
 
 int trace_nfs_file_flush(struct pt_regs *ctx,
@@ -292,21 +820,12 @@ int trace_nfs_file_flush(struct pt_regs *ctx,
 	if (should_filter_file(file))
 		return 0;
 
-	return trace_nfs_function_entry(ctx, file->f_inode, 0);
+	return trace_nfs_function_entry(file->f_inode, 0);
 }
 
 int trace_nfs_file_flush_ret(struct pt_regs *ctx)
 {
-	u64 start;
-	struct stats_t *statsp = get_stats(&start, NULL);
-	if (!statsp)
-		return 0;
-
-	statsp->flush.count++;
-	if (PT_REGS_RC(ctx))
-		statsp->flush.errors++;
-	statsp->flush.duration += bpf_ktime_get_ns() - start;
-	return 0;
+	return trace_nfs_function_ret(PT_REGS_RC(ctx), OP_FLUSH);
 }
 
 int trace_nfs_file_fsync(struct pt_regs *ctx,
@@ -315,21 +834,12 @@ int trace_nfs_file_fsync(struct pt_regs *ctx,
 	if (should_filter_file(file))
 		return 0;
 
-	return trace_nfs_function_entry(ctx, file->f_inode, 0);
+	return trace_nfs_function_entry(file->f_inode, 0);
 }
 
 int trace_nfs_file_fsync_ret(struct pt_regs *ctx)
 {
-	u64 start;
-	struct stats_t *statsp = get_stats(&start, NULL);
-	if (!statsp)
-		return 0;
-
-	statsp->fsync.count++;
-	if (PT_REGS_RC(ctx))
-		statsp->fsync.errors++;
-	statsp->fsync.duration += bpf_ktime_get_ns() - start;
-	return 0;
+	return trace_nfs_function_ret(PT_REGS_RC(ctx), OP_FSYNC);
 }
 
 int trace_nfs_lock(struct pt_regs *ctx, struct file *file,
@@ -338,21 +848,12 @@ int trace_nfs_lock(struct pt_regs *ctx, struct file *file,
 	if (should_filter_file(file))
 		return 0;
 
-	return trace_nfs_function_entry(ctx, file->f_inode, 0);
+	return trace_nfs_function_entry(file->f_inode, 0);
 }
 
 int trace_nfs_lock_ret(struct pt_regs *ctx)
 {
-	u64 start;
-	struct stats_t *statsp = get_stats(&start, NULL);
-	if (!statsp)
-		return 0;
-
-	statsp->lock.count++;
-	if (PT_REGS_RC(ctx))
-		statsp->lock.errors++;
-	statsp->lock.duration += bpf_ktime_get_ns() - start;
-	return 0;
+	return trace_nfs_function_ret(PT_REGS_RC(ctx), OP_LOCK);
 }
 
 int trace_nfs_file_mmap(struct pt_regs *ctx, struct file *file,
@@ -361,21 +862,12 @@ int trace_nfs_file_mmap(struct pt_regs *ctx, struct file *file,
 	if (should_filter_file(file))
 		return 0;
 
-	return trace_nfs_function_entry(ctx, file->f_inode, 0);
+	return trace_nfs_function_entry(file->f_inode, 0);
 }
 
 int trace_nfs_file_mmap_ret(struct pt_regs *ctx)
 {
-	u64 start;
-	struct stats_t *statsp = get_stats(&start, NULL);
-	if (!statsp)
-		return 0;
-
-	statsp->mmap.count++;
-	if (PT_REGS_RC(ctx))
-		statsp->mmap.errors++;
-	statsp->mmap.duration += bpf_ktime_get_ns() - start;
-	return 0;
+	return trace_nfs_function_ret(PT_REGS_RC(ctx), OP_MMAP);
 }
 
 int trace_nfs_file_release(struct pt_regs *ctx, struct inode *inode,
@@ -384,21 +876,12 @@ int trace_nfs_file_release(struct pt_regs *ctx, struct inode *inode,
 	if (should_filter_file(file))
 		return 0;
 
-	return trace_nfs_function_entry(ctx, file->f_inode, 0);
+	return trace_nfs_function_entry(file->f_inode, 0);
 }
 
 int trace_nfs_file_release_ret(struct pt_regs *ctx)
 {
-	u64 start;
-	struct stats_t *statsp = get_stats(&start, NULL);
-	if (!statsp)
-		return 0;
-
-	statsp->close.count++;
-	if (PT_REGS_RC(ctx))
-		statsp->close.errors++;
-	statsp->close.duration += bpf_ktime_get_ns() - start;
-	return 0;
+	return trace_nfs_function_ret(PT_REGS_RC(ctx), OP_CLOSE);
 }
 
 int trace_nfs_readdir(struct pt_regs *ctx, struct file *file,
@@ -407,21 +890,12 @@ int trace_nfs_readdir(struct pt_regs *ctx, struct file *file,
 	if (should_filter_file(file))
 		return 0;
 
-	return trace_nfs_function_entry(ctx, file->f_inode, 0);
+	return trace_nfs_function_entry(file->f_inode, 0);
 }
 
 int trace_nfs_readdir_ret(struct pt_regs *ctx)
 {
-	u64 start;
-	struct stats_t *statsp = get_stats(&start, NULL);
-	if (!statsp)
-		return 0;
-
-	statsp->readdir.count++;
-	if (PT_REGS_RC(ctx))
-		statsp->readdir.errors++;
-	statsp->readdir.duration += bpf_ktime_get_ns() - start;
-	return 0;
+	return trace_nfs_function_ret(PT_REGS_RC(ctx), OP_READDIR);
 }
 
 int trace_nfs_create(struct pt_regs *ctx,
@@ -432,60 +906,33 @@ struct user_namespace *mnt_userns,
 #endif
 		struct inode *dir, struct dentry *dentry, umode_t mode, bool excl)
 {
-	return trace_nfs_function_entry(ctx, dir, 0);
+	return trace_nfs_function_entry(dir, 0);
 }
 
 int trace_nfs_create_ret(struct pt_regs *ctx)
 {
-	u64 start;
-	struct stats_t *statsp = get_stats(&start, NULL);
-	if (!statsp)
-		return 0;
-
-	statsp->create.count++;
-	if (PT_REGS_RC(ctx))
-		statsp->create.errors++;
-	statsp->create.duration += bpf_ktime_get_ns() - start;
-	return 0;
+	return trace_nfs_function_ret(PT_REGS_RC(ctx), OP_CREATE);
 }
 
 int trace_nfs_link(struct pt_regs *ctx, struct dentry *old_dentry,
 		struct inode *dir, struct dentry *dentry)
 {
-	return trace_nfs_function_entry(ctx, dir, 0);
+	return trace_nfs_function_entry(dir, 0);
 }
 
 int trace_nfs_link_ret(struct pt_regs *ctx)
 {
-	u64 start;
-	struct stats_t *statsp = get_stats(&start, NULL);
-	if (!statsp)
-		return 0;
-
-	statsp->link.count++;
-	if (PT_REGS_RC(ctx))
-		statsp->link.errors++;
-	statsp->link.duration += bpf_ktime_get_ns() - start;
-	return 0;
+	return trace_nfs_function_ret(PT_REGS_RC(ctx), OP_LINK);
 }
 
 int trace_nfs_unlink(struct pt_regs *ctx, struct inode *dir, struct dentry *dentry)
 {
-	return trace_nfs_function_entry(ctx, dir, 0);
+	return trace_nfs_function_entry(dir, 0);
 }
 
 int trace_nfs_unlink_ret(struct pt_regs *ctx)
 {
-	u64 start;
-	struct stats_t *statsp = get_stats(&start, NULL);
-	if (!statsp)
-		return 0;
-
-	statsp->unlink.count++;
-	if (PT_REGS_RC(ctx))
-		statsp->unlink.errors++;
-	statsp->unlink.duration += bpf_ktime_get_ns() - start;
-	return 0;
+	return trace_nfs_function_ret(PT_REGS_RC(ctx), OP_UNLINK);
 }
 
 int trace_nfs_symlink(struct pt_regs *ctx,
@@ -496,41 +943,23 @@ struct user_namespace *mnt_userns,
 #endif
 		struct inode *dir, struct dentry *dentry, const char *symname)
 {
-	return trace_nfs_function_entry(ctx, dir, 0);
+	return trace_nfs_function_entry(dir, 0);
 }
 
 int trace_nfs_symlink_ret(struct pt_regs *ctx)
 {
-	u64 start;
-	struct stats_t *statsp = get_stats(&start, NULL);
-	if (!statsp)
-		return 0;
-
-	statsp->symlink.count++;
-	if (PT_REGS_RC(ctx))
-		statsp->symlink.errors++;
-	statsp->symlink.duration += bpf_ktime_get_ns() - start;
-	return 0;
+	return trace_nfs_function_ret(PT_REGS_RC(ctx), OP_SYMLINK);
 }
 
 int trace_nfs_lookup(struct pt_regs *ctx, struct inode *dir,
 		struct dentry * dentry, unsigned int flags)
 {
-	return trace_nfs_function_entry(ctx, dir, 0);
+	return trace_nfs_function_entry(dir, 0);
 }
 
 int trace_nfs_lookup_ret(struct pt_regs *ctx)
 {
-	u64 start;
-	struct stats_t *statsp = get_stats(&start, NULL);
-	if (!statsp)
-		return 0;
-
-	statsp->lookup.count++;
-	if (PT_REGS_RC(ctx))
-		statsp->lookup.errors++;
-	statsp->lookup.duration += bpf_ktime_get_ns() - start;
-	return 0;
+	return trace_nfs_function_ret(PT_REGS_RC(ctx), OP_LOOKUP);
 }
 
 int trace_nfs_rename(struct pt_regs *ctx,
@@ -542,40 +971,22 @@ struct user_namespace *mnt_userns,
 		struct inode *old_dir, struct dentry *old_dentry,
 		struct inode *new_dir, struct dentry *new_dentry, unsigned int flags)
 {
-	return trace_nfs_function_entry(ctx, old_dir, 0);
+	return trace_nfs_function_entry(old_dir, 0);
 }
 
 int trace_nfs_rename_ret(struct pt_regs *ctx)
 {
-	u64 start;
-	struct stats_t *statsp = get_stats(&start, NULL);
-	if (!statsp)
-		return 0;
-
-	statsp->rename.count++;
-	if (PT_REGS_RC(ctx))
-		statsp->rename.errors++;
-	statsp->rename.duration += bpf_ktime_get_ns() - start;
-	return 0;
+	return trace_nfs_function_ret(PT_REGS_RC(ctx), OP_RENAME);
 }
 
 int trace_nfs_do_access(struct pt_regs *ctx, struct inode *inode, const struct cred *cred, int mask)
 {
-	return trace_nfs_function_entry(ctx, inode, 0);
+	return trace_nfs_function_entry(inode, 0);
 }
 
 int trace_nfs_do_access_ret(struct pt_regs *ctx)
 {
-	u64 start;
-	struct stats_t *statsp = get_stats(&start, NULL);
-	if (!statsp)
-		return 0;
-
-	statsp->access.count++;
-	if (PT_REGS_RC(ctx))
-		statsp->access.errors++;
-	statsp->access.duration += bpf_ktime_get_ns() - start;
-	return 0;
+	return trace_nfs_function_ret(PT_REGS_RC(ctx), OP_ACCESS);
 }
 
 int trace_nfs_mkdir(struct pt_regs *ctx,
@@ -586,57 +997,345 @@ struct user_namespace *mnt_userns,
 #endif
 		struct inode *dir, struct dentry *dentry, umode_t mode)
 {
-	return trace_nfs_function_entry(ctx, dir, 0);
+	return trace_nfs_function_entry(dir, 0);
 }
 
 int trace_nfs_mkdir_ret(struct pt_regs *ctx)
 {
-	u64 start;
-	struct stats_t *statsp = get_stats(&start, NULL);
-	if (!statsp)
-		return 0;
-
-	statsp->mkdir.count++;
-	if (PT_REGS_RC(ctx))
-		statsp->mkdir.errors++;
-	statsp->mkdir.duration += bpf_ktime_get_ns() - start;
-	return 0;
+	return trace_nfs_function_ret(PT_REGS_RC(ctx), OP_MKDIR);
 }
 
 int trace_nfs_rmdir(struct pt_regs *ctx, struct inode *dir, struct dentry *dentry)
 {
-	return trace_nfs_function_entry(ctx, dir, 0);
+	return trace_nfs_function_entry(dir, 0);
 }
 
 int trace_nfs_rmdir_ret(struct pt_regs *ctx)
 {
-	u64 start;
-	struct stats_t *statsp = get_stats(&start, NULL);
-	if (!statsp)
-		return 0;
-
-	statsp->rmdir.count++;
-	if (PT_REGS_RC(ctx))
-		statsp->rmdir.errors++;
-	statsp->rmdir.duration += bpf_ktime_get_ns() - start;
-	return 0;
+	return trace_nfs_function_ret(PT_REGS_RC(ctx), OP_RMDIR);
 }
 
 int trace_nfs_listxattrs(struct pt_regs *ctx, struct dentry *dentry, char *list, size_t size)
 {
-	return trace_nfs_function_entry(ctx, dentry->d_inode, 0);
+	return trace_nfs_function_entry(dentry->d_inode, 0);
 }
 
 int trace_nfs_listxattrs_ret(struct pt_regs *ctx)
 {
-	u64 start;
-	struct stats_t *statsp = get_stats(&start, NULL);
-	if (!statsp)
+	return trace_nfs_function_ret(PT_REGS_RC(ctx), OP_LISTXATTR);
+}
+#else
+// fentry/fexit programs, attached when the program is loaded. Every program is
+// built only when its function is available (HAVE_<function>), in the module
+// given by NFS_MODULE, NFSV4_MODULE or NFSV3_MODULE ("vmlinux" when built-in).
+
+#define FENTRY(module, event, args...) MODULE_KFUNC_PROBE(module, event, args)
+#define FEXIT(module, event, args...) MODULE_KRETFUNC_PROBE(module, event, args)
+
+// fexit programs see the arguments and the return value, named ret
+#define NFS_FEXIT(module, event, op, args...)				\
+	FEXIT(module, event, args)					\
+	{								\
+		return trace_nfs_function_ret((long)ret, op);		\
+	}
+
+#if LINUX_VERSION_CODE >= KERNEL_VERSION(6,3,0)
+#define IDMAP_ARG struct mnt_idmap *idmap,
+#elif LINUX_VERSION_CODE >= KERNEL_VERSION(5,12,0)
+#define IDMAP_ARG struct user_namespace *mnt_userns,
+#else
+#define IDMAP_ARG
+#endif
+
+#ifdef HAVE_NFS_FILE_READ
+FENTRY(NFS_MODULE, nfs_file_read, struct kiocb *iocb, struct iov_iter *to)
+{
+	return file_read_write(iocb->ki_filp, to->count, 1);
+}
+
+FEXIT(NFS_MODULE, nfs_file_read, struct kiocb *iocb, struct iov_iter *to, ssize_t ret)
+{
+	return file_read_write_ret(ret, 1);
+}
+#endif
+
+#ifdef HAVE_NFS_FILE_WRITE
+FENTRY(NFS_MODULE, nfs_file_write, struct kiocb *iocb, struct iov_iter *from)
+{
+	return file_read_write(iocb->ki_filp, from->count, 0);
+}
+
+FEXIT(NFS_MODULE, nfs_file_write, struct kiocb *iocb, struct iov_iter *from, ssize_t ret)
+{
+	return file_read_write_ret(ret, 0);
+}
+#endif
+
+#ifdef HAVE_NFS_FILE_SPLICE_READ
+FENTRY(NFS_MODULE, nfs_file_splice_read, struct file *in, loff_t *ppos,
+		struct pipe_inode_info *pipe, size_t len, unsigned int flags)
+{
+	return file_read_write(in, len, 1);
+}
+
+FEXIT(NFS_MODULE, nfs_file_splice_read, struct file *in, loff_t *ppos,
+		struct pipe_inode_info *pipe, size_t len, unsigned int flags, ssize_t ret)
+{
+	return file_read_write_ret(ret, 1);
+}
+#endif
+
+#ifdef HAVE_NFS_FILE_OPEN
+FENTRY(NFS_MODULE, nfs_file_open, struct inode *inode, struct file *file)
+{
+	if (should_filter_file(file))
 		return 0;
 
-	statsp->listxattr.count++;
-	if (PT_REGS_RC(ctx))
-		statsp->listxattr.errors++;
-	statsp->listxattr.duration += bpf_ktime_get_ns() - start;
-	return 0;
+	return trace_nfs_function_entry(inode, 0);
+}
+
+NFS_FEXIT(NFS_MODULE, nfs_file_open, OP_OPEN, struct inode *inode, struct file *file, int ret)
+#endif
+
+#ifdef HAVE_NFS4_FILE_OPEN
+FENTRY(NFSV4_MODULE, nfs4_file_open, struct inode *inode, struct file *file)
+{
+	if (should_filter_file(file))
+		return 0;
+
+	return trace_nfs_function_entry(inode, 0);
+}
+
+NFS_FEXIT(NFSV4_MODULE, nfs4_file_open, OP_OPEN, struct inode *inode, struct file *file, int ret)
+#endif
+
+#ifdef HAVE_NFS_GETATTR
+FENTRY(NFS_MODULE, nfs_getattr, IDMAP_ARG const struct path *path, struct kstat *stat,
+		u32 request_mask, unsigned int query_flags)
+{
+	return trace_nfs_function_entry(path->dentry->d_inode, 0);
+}
+
+NFS_FEXIT(NFS_MODULE, nfs_getattr, OP_GETATTR, IDMAP_ARG const struct path *path,
+		struct kstat *stat, u32 request_mask, unsigned int query_flags, int ret)
+#endif
+
+#ifdef HAVE_NFS_SETATTR
+FENTRY(NFS_MODULE, nfs_setattr, IDMAP_ARG struct dentry *dentry, struct iattr *attr)
+{
+	return trace_nfs_function_entry(dentry->d_inode, 0);
+}
+
+NFS_FEXIT(NFS_MODULE, nfs_setattr, OP_SETATTR, IDMAP_ARG struct dentry *dentry,
+		struct iattr *attr, int ret)
+#endif
+
+#ifdef HAVE_NFS_FILE_FLUSH
+FENTRY(NFS_MODULE, nfs_file_flush, struct file *file, fl_owner_t id)
+{
+	if (should_filter_file(file))
+		return 0;
+
+	return trace_nfs_function_entry(file->f_inode, 0);
+}
+
+NFS_FEXIT(NFS_MODULE, nfs_file_flush, OP_FLUSH, struct file *file, fl_owner_t id, int ret)
+#endif
+
+#ifdef HAVE_NFS4_FILE_FLUSH
+FENTRY(NFSV4_MODULE, nfs4_file_flush, struct file *file, fl_owner_t id)
+{
+	if (should_filter_file(file))
+		return 0;
+
+	return trace_nfs_function_entry(file->f_inode, 0);
+}
+
+NFS_FEXIT(NFSV4_MODULE, nfs4_file_flush, OP_FLUSH, struct file *file, fl_owner_t id, int ret)
+#endif
+
+#ifdef HAVE_NFS_FILE_FSYNC
+FENTRY(NFS_MODULE, nfs_file_fsync, struct file *file, loff_t start, loff_t end, int datasync)
+{
+	if (should_filter_file(file))
+		return 0;
+
+	return trace_nfs_function_entry(file->f_inode, 0);
+}
+
+NFS_FEXIT(NFS_MODULE, nfs_file_fsync, OP_FSYNC, struct file *file, loff_t start, loff_t end,
+		int datasync, int ret)
+#endif
+
+#ifdef HAVE_NFS_LOCK
+FENTRY(NFS_MODULE, nfs_lock, struct file *file, int cmd, struct file_lock *fl)
+{
+	if (should_filter_file(file))
+		return 0;
+
+	return trace_nfs_function_entry(file->f_inode, 0);
+}
+
+NFS_FEXIT(NFS_MODULE, nfs_lock, OP_LOCK, struct file *file, int cmd, struct file_lock *fl, int ret)
+#endif
+
+#ifdef HAVE_NFS_FLOCK
+FENTRY(NFS_MODULE, nfs_flock, struct file *file, int cmd, struct file_lock *fl)
+{
+	if (should_filter_file(file))
+		return 0;
+
+	return trace_nfs_function_entry(file->f_inode, 0);
+}
+
+NFS_FEXIT(NFS_MODULE, nfs_flock, OP_LOCK, struct file *file, int cmd, struct file_lock *fl, int ret)
+#endif
+
+#ifdef HAVE_NFS_FILE_MMAP
+FENTRY(NFS_MODULE, nfs_file_mmap, struct file *file, struct vm_area_struct *vma)
+{
+	if (should_filter_file(file))
+		return 0;
+
+	return trace_nfs_function_entry(file->f_inode, 0);
+}
+
+NFS_FEXIT(NFS_MODULE, nfs_file_mmap, OP_MMAP, struct file *file, struct vm_area_struct *vma, int ret)
+#endif
+
+#ifdef HAVE_NFS_FILE_RELEASE
+FENTRY(NFS_MODULE, nfs_file_release, struct inode *inode, struct file *file)
+{
+	if (should_filter_file(file))
+		return 0;
+
+	return trace_nfs_function_entry(file->f_inode, 0);
+}
+
+NFS_FEXIT(NFS_MODULE, nfs_file_release, OP_CLOSE, struct inode *inode, struct file *file, int ret)
+#endif
+
+#ifdef HAVE_NFS_READDIR
+FENTRY(NFS_MODULE, nfs_readdir, struct file *file, struct dir_context *dctx)
+{
+	if (should_filter_file(file))
+		return 0;
+
+	return trace_nfs_function_entry(file->f_inode, 0);
+}
+
+NFS_FEXIT(NFS_MODULE, nfs_readdir, OP_READDIR, struct file *file, struct dir_context *dctx, int ret)
+#endif
+
+#ifdef HAVE_NFS_CREATE
+FENTRY(NFS_MODULE, nfs_create, IDMAP_ARG struct inode *dir, struct dentry *dentry,
+		umode_t mode, bool excl)
+{
+	return trace_nfs_function_entry(dir, 0);
 }
+
+NFS_FEXIT(NFS_MODULE, nfs_create, OP_CREATE, IDMAP_ARG struct inode *dir, struct dentry *dentry,
+		umode_t mode, bool excl, int ret)
+#endif
+
+#ifdef HAVE_NFS_LINK
+FENTRY(NFS_MODULE, nfs_link, struct dentry *old_dentry, struct inode *dir, struct dentry *dentry)
+{
+	return trace_nfs_function_entry(dir, 0);
+}
+
+NFS_FEXIT(NFS_MODULE, nfs_link, OP_LINK, struct dentry *old_dentry, struct inode *dir,
+		struct dentry *dentry, int ret)
+#endif
+
+#ifdef HAVE_NFS_UNLINK
+FENTRY(NFS_MODULE, nfs_unlink, struct inode *dir, struct dentry *dentry)
+{
+	return trace_nfs_function_entry(dir, 0);
+}
+
+NFS_FEXIT(NFS_MODULE, nfs_unlink, OP_UNLINK, struct inode *dir, struct dentry *dentry, int ret)
+#endif
+
+#ifdef HAVE_NFS_SYMLINK
+FENTRY(NFS_MODULE, nfs_symlink, IDMAP_ARG struct inode *dir, struct dentry *dentry,
+		const char *symname)
+{
+	return trace_nfs_function_entry(dir, 0);
+}
+
+NFS_FEXIT(NFS_MODULE, nfs_symlink, OP_SYMLINK, IDMAP_ARG struct inode *dir, struct dentry *dentry,
+		const char *symname, int ret)
+#endif
+
+#ifdef HAVE_NFS_LOOKUP
+FENTRY(NFS_MODULE, nfs_lookup, struct inode *dir, struct dentry *dentry, unsigned int flags)
+{
+	return trace_nfs_function_entry(dir, 0);
+}
+
+NFS_FEXIT(NFS_MODULE, nfs_lookup, OP_LOOKUP, struct inode *dir, struct dentry *dentry,
+		unsigned int flags, struct dentry *ret)
+#endif
+
+#ifdef HAVE_NFS_RENAME
+FENTRY(NFS_MODULE, nfs_rename, IDMAP_ARG struct inode *old_dir, struct dentry *old_dentry,
+		struct inode *new_dir, struct dentry *new_dentry, unsigned int flags)
+{
+	return trace_nfs_function_entry(old_dir, 0);
+}
+
+NFS_FEXIT(NFS_MODULE, nfs_rename, OP_RENAME, IDMAP_ARG struct inode *old_dir,
+		struct dentry *old_dentry, struct inode *new_dir, struct dentry *new_dentry,
+		unsigned int flags, int ret)
+#endif
+
+#ifdef HAVE_NFS_DO_ACCESS
+FENTRY(NFS_MODULE, nfs_do_access, struct inode *inode, const struct cred *cred, int mask)
+{
+	return trace_nfs_function_entry(inode, 0);
+}
+
+NFS_FEXIT(NFS_MODULE, nfs_do_access, OP_ACCESS, struct inode *inode, const struct cred *cred,
+		int mask, int ret)
+#endif
+
+#ifdef HAVE_NFS_MKDIR
+FENTRY(NFS_MODULE, nfs_mkdir, IDMAP_ARG struct inode *dir, struct dentry *dentry, umode_t mode)
+{
+	return trace_nfs_function_entry(dir, 0);
+}
+
+NFS_FEXIT(NFS_MODULE, nfs_mkdir, OP_MKDIR, IDMAP_ARG struct inode *dir, struct dentry *dentry,
+		umode_t mode, int ret)
+#endif
+
+#ifdef HAVE_NFS_RMDIR
+FENTRY(NFS_MODULE, nfs_rmdir, struct inode *dir, struct dentry *dentry)
+{
+	return trace_nfs_function_entry(dir, 0);
+}
+
+NFS_FEXIT(NFS_MODULE, nfs_rmdir, OP_RMDIR, struct inode *dir, struct dentry *dentry, int ret)
+#endif
+
+#ifdef HAVE_NFS4_LISTXATTR
+FENTRY(NFSV4_MODULE, nfs4_listxattr, struct dentry *dentry, char *list, size_t size)
+{
+	return trace_nfs_function_entry(dentry->d_inode, 0);
+}
+
+NFS_FEXIT(NFSV4_MODULE, nfs4_listxattr, OP_LISTXATTR, struct dentry *dentry, char *list,
+		size_t size, ssize_t ret)
+#endif
+
+#ifdef HAVE_NFS3_LISTXATTR
+FENTRY(NFSV3_MODULE, nfs3_listxattr, struct dentry *dentry, char *list, size_t size)
+{
+	return trace_nfs_function_entry(dentry->d_inode, 0);
+}
+
+NFS_FEXIT(NFSV3_MODULE, nfs3_listxattr, OP_LISTXATTR, struct dentry *dentry, char *list,
+		size_t size, ssize_t ret)
+#endif
+#endif
@@ -92,6 +92,15 @@ arrow_schema = pa.schema(
     ]
 )
 
+# Optional columns written when the collector runs with --latency-hist.
+latency_hist_fields = [
+    (f"{op}_LATENCY", pa.list_(pa.uint64()))
+    for op in (
+        "OPEN", "CLOSE", "READ", "WRITE", "GETATTR", "SETATTR", "FLUSH", "FSYNC", "LOCK", "MMAP", "READDIR",
+        "CREATE", "LINK", "UNLINK", "SYMLINK", "LOOKUP", "RENAME", "ACCESS", "MKDIR", "RMDIR", "LISTXATTR",
+    )
+]
+
 
 def main():
     # Set up argument parser
@@ -113,6 +122,9 @@ def main():
     parser.add_argument(
         "--db-ssl-verify", type=bool, default=True, help="Verify HTTPS connection."
     )
+    parser.add_argument(
+        "--latency-hist", action="store_true", help="Add latency histogram columns."
+    )
 
     # Parse arguments
     args = parser.parse_args()
@@ -139,7 +151,10 @@ def main():
             print(f"Schema {db_schema} created.")
         table = schema.table(db_table, fail_if_missing=False)
         if table is None:
-            schema.create_table(db_table, columns=arrow_schema)
+            columns = arrow_schema
+            if args.latency_hist:
+                columns = pa.schema(list(arrow_schema) + [pa.field(*f) for f in latency_hist_fields])
+            schema.create_table(db_table, columns=columns)
             print(f"Table {db_table} created.")
 
 
@@ -0,0 +1,125 @@
+"""
+Measure the overhead of the vnfs-collector probes on a synthetic NFS workload.
+
+Usage (as root, on a host with an NFS mount):
+python3 probe_overhead.py \
+  --path /mnt/nfs/scratch \
+  --workers 16 \
+  --duration 10 \
+  --variant "--probe-mode=kprobe" \
+  --variant "--probe-mode=fentry"
+
+Every variant is a string of collector options the BPF program is built with.
+The workload runs once without any probes attached (baseline) and once per variant.
+For each run the script reports the workload throughput, the probe mode, the total
+probe run time per workload operation and, for each attached BPF program, the number
+of runs and the average run time (from kernel.bpf_stats_enabled).
+"""
+
+import os
+import time
+import shlex
+import argparse
+import multiprocessing
+from pathlib import Path
+
+from vnfs_collector.main import conf_parser, load_bpf
+from vnfs_collector.nfsops import StatsCollector, PidEnvMap, MountsMap
+
+BPF_STATS = Path("/proc/sys/kernel/bpf_stats_enabled")
+
+
+def worker(files, deadline):
+    """Metadata and small-read heavy loop: stat + open/read/close per file."""
+    ops = 0
+    while time.monotonic() < deadline:
+        for path in files:
+            os.stat(path)
+            with open(path, "rb") as f:
+                f.read(4096)
+            ops += 1
+    return ops
+
+
+def run_workload(files, workers, duration):
+    deadline = time.monotonic() + duration
+    chunks = [files[i::workers] for i in range(workers)]
+    with multiprocessing.Pool(workers) as pool:
+        ops = sum(pool.starmap(worker, [(chunk, deadline) for chunk in chunks]))
+    return ops / duration
+
+
+def prog_stats(bpf):
+    """Return {program name: (run count, run time ns)} of all loaded programs."""
+    stats = {}
+    for name, fn in bpf.funcs.items():
+        info = {}
+        for line in Path(f"/proc/self/fdinfo/{fn.fd}").read_text().splitlines():
+            key, _, value = line.partition(":")
+            info[key.strip()] = value.strip()
+        stats[name.decode() if isinstance(name, bytes) else name] = (
+            int(info.get("run_cnt", 0)), int(info.get("run_time_ns", 0))
+        )
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure vnfs-collector probe overhead.")
+    parser.add_argument("--path", required=True, help="Directory on an NFS mount for the workload files.")
+    parser.add_argument("--files", type=int, default=64, help="Number of workload files.")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Number of workload processes.")
+    parser.add_argument("--duration", type=int, default=10, help="Duration of every run, in seconds.")
+    parser.add_argument(
+        "--variant", action="append", default=None,
+        help="Collector options to build the BPF program with, e.g. '--percpu-counts=true'. "
+             "Can be given multiple times."
+    )
+    args = parser.parse_args()
+    variants = args.variant or [""]
+
+    workdir = Path(args.path) / f"probe-overhead-{os.getpid()}"
+    workdir.mkdir(parents=True)
+    files = []
+    for i in range(args.files):
+        path = workdir / f"file-{i}"
+        path.write_bytes(os.urandom(4096))
+        files.append(path)
+
+    stats_enabled = BPF_STATS.read_text().strip()
+    BPF_STATS.write_text("1")
+    try:
+        baseline = run_workload(files, args.workers, args.duration)
+        print(f"baseline: {baseline:.0f} ops/s")
+        for variant in variants:
+            collector_args = conf_parser.parse_args(shlex.split(variant))
+            bpf, probe_mode = load_bpf(collector_args)
+            collector = StatsCollector(
+                _args=collector_args, bpf=bpf, pid_env_map=PidEnvMap(), mounts_map=MountsMap(),
+                probe_mode=probe_mode,
+            )
+            collector.attach()
+            try:
+                throughput = run_workload(files, args.workers, args.duration)
+                stats = prog_stats(bpf)
+            finally:
+                bpf.cleanup()
+
+            total_ops = throughput * args.duration
+            probe_time = sum(run_time for _, run_time in stats.values())
+            print(
+                f"\nvariant {variant or '(defaults)'!r} ({probe_mode}): {throughput:.0f} ops/s"
+                f" ({(baseline - throughput) / baseline * 100:.1f}% overhead),"
+                f" {probe_time / max(total_ops, 1):.0f} probe ns/op"
+            )
+            for name, (count, run_time) in sorted(stats.items(), key=lambda s: -s[1][0]):
+                if count:
+                    print(f"  {name:<40} {count:>12} runs {run_time / count:>10.0f} ns/run")
+    finally:
+        BPF_STATS.write_text(stats_enabled)
+        for path in files:
+            path.unlink()
+        workdir.rmdir()
+
+
+if __name__ == "__main__":
+    main()
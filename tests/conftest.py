@@ -5,6 +5,9 @@ import json
 from pathlib import Path
 import importlib
 
+import ctypes
+
+import numpy as np
 import pytest
 import yaml
 import pandas as pd
@@ -20,6 +23,122 @@ module = importlib.util.module_from_spec(spec)
 sys.modules["bcc"] = module
 spec.loader.exec_module(module)
 
+def info_t_ctype(dtype):
+    """ctypes flavour of an `struct info_t` dtype as generated by BCC."""
+    ctypes_of = {"<u8": ctypes.c_uint64, "<u4": ctypes.c_uint32, "|S16": ctypes.c_char * 16}
+    return type("InfoT", (ctypes.Structure,), {
+        "_fields_": [(name, ctypes_of[dtype[name].str]) for name in dtype.names],
+    })
+
+
+def make_counts_entries(n, seed=0, cpus=None, key_dtype=None):
+    """
+    Generate `n` random `counts` map entries as (key, value) ctypes structures,
+    the same way BCC tables yield them.
+    With `cpus` every value is an array of per-CPU values, like in BCC per-CPU tables.
+    `key_dtype` is the `info_t` layout, all key fields by default.
+    """
+    from vnfs_collector.nfsops import INFO_T_DTYPE, STATS_T_DTYPE
+
+    key_dtype = key_dtype or INFO_T_DTYPE
+    rng = np.random.default_rng(seed)
+    keys = np.zeros(n, dtype=key_dtype)
+    if "tgid" in key_dtype.names:
+        keys["tgid"] = rng.integers(1, 64, n)
+    if "uid" in key_dtype.names:
+        keys["uid"] = rng.integers(0, 4, n)
+    if "cgroup" in key_dtype.names:
+        keys["cgroup"] = rng.choice([1001, 1002], n)
+    if "mntns" in key_dtype.names:
+        keys["mntns"] = rng.choice([4026531841, 4026531842], n)
+    keys["comm"] = rng.choice([b"ls", b"bash", b"python3", b"dd"], n)
+    keys["sbdev"] = rng.choice([42, 43], n)
+    shape = (n, cpus) if cpus else n
+    values = np.zeros(shape, dtype=STATS_T_DTYPE)
+    for name in STATS_T_DTYPE.names:
+        if values[name].dtype.names:
+            values[name]["count"] = rng.integers(0, 1000, shape)
+            values[name]["duration"] = rng.integers(0, 10**9, shape)
+            values[name]["errors"] = rng.integers(0, 10, shape)
+        else:
+            values[name] = rng.integers(0, 1 << 30, shape)
+
+    value_type = np.ctypeslib.as_ctypes_type(STATS_T_DTYPE)
+    if cpus:
+        value_type = value_type * cpus
+    ckeys = (info_t_ctype(key_dtype) * n).from_buffer_copy(keys.tobytes())
+    cvalues = (value_type * n).from_buffer_copy(values.tobytes())
+    return list(zip(ckeys, cvalues))
+
+
+class FakeCountsTable:
+    """Minimal stand-in for the BCC `counts` table."""
+
+    def __init__(self, entries):
+        self.entries = list(entries)
+
+    def items(self):
+        return list(self.entries)
+
+    def items_lookup_and_delete_batch(self):
+        entries, self.entries = self.entries, []
+        yield from entries
+
+    def clear(self):
+        self.entries = []
+
+
+class FakeArrayTable:
+    """Minimal stand-in for a BCC BPF_ARRAY table, of u32 values by default."""
+
+    def __init__(self, size=1, leaf=ctypes.c_uint32):
+        self.Leaf = leaf
+        self.values = [leaf(0) for _ in range(size)]
+
+    def __getitem__(self, idx):
+        return self.values[idx]
+
+    def __setitem__(self, idx, value):
+        self.values[idx] = value
+
+
+class FakeHashTable:
+    """Minimal stand-in for a BCC u32 -> u8 BPF_HASH table."""
+    Key = ctypes.c_uint32
+    Leaf = ctypes.c_uint8
+
+    def __init__(self, entries=None):
+        self.entries = dict(entries or {})
+
+    def keys(self):
+        return [self.Key(key) for key in self.entries]
+
+    def items(self):
+        return [(self.Key(key), value) for key, value in self.entries.items()]
+
+    def __setitem__(self, key, value):
+        self.entries[key.value] = value.value
+
+    def __delitem__(self, key):
+        del self.entries[key.value]
+
+    def pop(self, key, default=None):
+        return self.entries.pop(key.value, default)
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class FakePercpuArrayTable:
+    """Minimal stand-in for a BCC u64 BPF_PERCPU_ARRAY table."""
+
+    def __init__(self, values):
+        self.values = values  # per index list of per-CPU values
+
+    def sum(self, idx):
+        return ctypes.c_uint64(sum(self.values[idx]))
+
+
 @pytest.fixture(scope="session")
 def data():
     from vnfs_collector.nfsops import hashabledict
@@ -7,12 +7,17 @@ __version__ = "0.0.1"
 
 
 class BPF:
+    KPROBE = 2
+
     def __init__(self, text=None):
         self.text = text
 
     def load(self, *args, **kwargs):
         pass
 
+    def load_func(self, *args, **kwargs):
+        pass
+
     def attach_kprobe(self, *args, **kwargs):
         pass
 
@@ -28,11 +33,29 @@ class BPF:
     def attach_kretprobe(self, *args, **kwargs):
         pass
 
+    def detach_kretprobe(self, *args, **kwargs):
+        pass
+
+    def attach_raw_tracepoint(self, *args, **kwargs):
+        pass
+
     def get_kprobe_functions(self, *args, **kwargs):
         pass
 
     def kernel_struct_has_field(self, *args, **kwargs):
         pass
 
+    @staticmethod
+    def support_kfunc():
+        return False
+
+    @staticmethod
+    def support_raw_tracepoint():
+        return False
+
+    @staticmethod
+    def ksymname(name):
+        return -1
+
     def get_table(self, *args, **kwargs):
         pass
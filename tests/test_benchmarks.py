@@ -0,0 +1,129 @@
+"""
+Micro benchmarks for the user space collection pipeline.
+Run with `pytest tests/test_benchmarks.py -s` to see the timings.
+"""
+import json
+import time
+
+import numpy as np
+import pandas as pd
+import pytest
+import pandas.testing as pdt
+
+from vnfs_collector.nfsops import (
+    INFO_T_DTYPE,
+    STATS_T_DTYPE,
+    STATKEYS,
+    STATKEYS_FIELDS,
+    HISTKEYS,
+    HIST_SLOTS,
+    decode_counts,
+    group_stats,
+    nstosec,
+)
+from tests.conftest import ROOT, make_counts_entries
+
+
+def decode_counts_per_row(entries):
+    """Reference dict-per-row decoding, as collect_stats used to do it."""
+    statistics = []
+    for k, v in entries:
+        output = {"PID": k.tgid, "UID": k.uid, "COMM": k.comm.decode("utf-8", "replace")}
+        for key, (member, field) in STATKEYS_FIELDS.items():
+            value = getattr(v, member) if field is None else getattr(getattr(v, member), field)
+            output[key] = nstosec(value) if field == "duration" else value
+        statistics.append(output)
+    return pd.DataFrame(statistics)
+
+
+def decode_counts_vectorized(entries):
+    keys, values = bytearray(), bytearray()
+    for k, v in entries:
+        keys += k
+        values += v
+    return pd.DataFrame(
+        decode_counts(
+            np.frombuffer(bytes(keys), dtype=INFO_T_DTYPE),
+            np.frombuffer(bytes(values), dtype=STATS_T_DTYPE),
+        )
+    )
+
+
+def timeit(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - start
+
+
+@pytest.mark.parametrize("size", [1_000, 10_000, 100_000])
+def test_decode_counts_benchmark(size):
+    entries = make_counts_entries(size)
+
+    expected, per_row = timeit(decode_counts_per_row, entries)
+    result, vectorized = timeit(decode_counts_vectorized, entries)
+
+    print(
+        f"\ndecode {size} keys: dict-per-row {per_row * 1000:.1f}ms,"
+        f" vectorized {vectorized * 1000:.1f}ms ({per_row / vectorized:.1f}x)"
+    )
+    assert list(result.columns) == ["PID", "UID", "COMM"] + list(STATKEYS)
+    pdt.assert_frame_equal(result, expected, check_dtype=False)
+
+
+def group_stats_groupby(data, group_fields):
+    """Reference DataFrame.groupby aggregation, as group_stats used to do it."""
+    agg_funcs = {col: "sum" for col in STATKEYS if col in data.columns}
+    agg_funcs.update({
+        col: lambda hists: np.sum(np.stack(hists.to_numpy()), axis=0) for col in HISTKEYS if col in data.columns
+    })
+    agg_funcs.update({col: "last" for col in data.columns if col not in agg_funcs and col not in group_fields})
+    return data.groupby(group_fields).agg(agg_funcs).reset_index()
+
+
+def scaled_data(size, hists=False, seed=0):
+    """tests/data/data.json scaled up to `size` rows with random pids, commands, mounts and tag sets."""
+    with (ROOT / "data" / "data.json").open() as f:
+        rows = pd.DataFrame(json.load(f))
+    rng = np.random.default_rng(seed)
+    df = rows.iloc[rng.integers(0, len(rows), size)].reset_index(drop=True)
+    df["PID"] = rng.integers(1, 2000, size)
+    df["COMM"] = rng.choice(["ls", "bash", "python3", "dd", "cp", "tar"], size)
+    df["MOUNT"] = rng.choice(["/mnt", "/mnt/a", "/mnt/b"], size)
+    # collect_stats groups by the interned tag set id, the tags are looked up after grouping
+    df["TAG_ID"] = rng.integers(0, 3, size)
+    df = df.drop(columns="TAGS")
+    for key in STATKEYS:
+        if key.endswith("_DURATION"):
+            df[key] = rng.random(size)
+        else:
+            df[key] = rng.integers(0, 1000, size)
+    if hists:
+        for key in HISTKEYS:
+            column = np.empty(size, dtype=object)
+            column[:] = list(rng.integers(0, 100, (size, HIST_SLOTS), dtype=np.uint64))
+            df[key] = column
+    return df
+
+
+@pytest.mark.parametrize(
+    "size, group_fields, hists",
+    [
+        (100_000, ["MOUNT", "COMM", "TAG_ID"], False),
+        (100_000, ["MOUNT", "PID", "TAG_ID"], False),
+        (5_000, ["MOUNT", "PID", "TAG_ID"], True),
+    ],
+)
+def test_group_stats_benchmark(size, group_fields, hists):
+    data = scaled_data(size, hists)
+
+    expected, groupby = timeit(group_stats_groupby, data, group_fields)
+    result, engine = timeit(group_stats, data, group_fields)
+
+    print(
+        f"\ngroup {size} rows by {group_fields}{' with histograms' if hists else ''} into {len(result)} groups:"
+        f" groupby {groupby * 1000:.1f}ms, numpy {engine * 1000:.1f}ms ({groupby / engine:.1f}x)"
+    )
+    if hists:
+        for key in HISTKEYS:
+            assert all((r == e).all() for r, e in zip(result.pop(key), expected.pop(key)))
+    pdt.assert_frame_equal(result, expected)
@@ -1,9 +1,25 @@
+import asyncio
+import argparse
+import threading
 from pathlib import Path
+from types import SimpleNamespace
+
+import pandas as pd
 import pyarrow as pa
 
 import pytest
 from unittest.mock import patch, AsyncMock, MagicMock
-from vnfs_collector.main import _exec
+from vnfs_collector.main import (
+    _exec,
+    consume_samples,
+    conf_parser,
+    bpf_defines,
+    load_bpf,
+    parse_slow_ops,
+    parse_queue_policies,
+)
+from vnfs_collector.drivers import VdbDriver
+from vnfs_collector.nfsops import Sample, SampleQueue
 
 ROOT = Path(__file__).parent.resolve()
 
@@ -17,7 +33,7 @@ mock_schema = pa.schema(
 
 @pytest.mark.asyncio
 @patch(
-    "vnfs_collector.main.await_until_event_or_timeout", AsyncMock(return_value=True)
+    "vnfs_collector.main.await_until_event_or_get", AsyncMock(return_value=None)
 )
 @patch("vnfs_collector.main.StatsCollector", MagicMock())
 class TestMainSuite:
@@ -188,3 +204,147 @@ class TestMainSuite:
         if from_config:
             unknown_option = unknown_option.lstrip("-").replace("-", "_")
         assert f"Unknown option '{unknown_option}"  in err
+
+
+@pytest.mark.asyncio
+async def test_blocked_driver_does_not_delay_others(data):
+    # a VDB insert stalled on the database endpoint
+    released = threading.Event()
+    vdb = VdbDriver(common_args=argparse.Namespace(envs=[], envs_from_vdb_schema=False))
+    vdb.envs_from_vdb_schema = False
+    vdb.db_endpoint, vdb.db_access_key, vdb.db_secret_key, vdb.db_ssl_verify = "http://db", "a", "s", True
+    vdb.db_bucket, vdb.db_schema, vdb.db_table = "bucket", "schema", "table"
+    vdb.arrow_schema = pa.schema([pa.field("PID", pa.int64())])
+    other = SimpleNamespace(name="screen", obj=MagicMock(
+        store_events=AsyncMock(), store_metrics=AsyncMock(), store_sample=AsyncMock()
+    ))
+    drivers = [SimpleNamespace(name="vdb", obj=vdb), other]
+    queues = {driver.name: SampleQueue(2, "drop-oldest") for driver in drivers}
+    sample = Sample(data, {}, pd.DataFrame(), 5)
+
+    with patch("vastdb.connect") as connect:
+        table = connect.return_value.transaction.return_value.__enter__.return_value.bucket.return_value \
+            .schema.return_value.table.return_value
+        table.insert.side_effect = lambda rows: released.wait(10)
+        consumers = [asyncio.ensure_future(consume_samples(driver, queues[driver.name])) for driver in drivers]
+        try:
+            for _ in range(2):
+                for queue in queues.values():
+                    queue.put(sample)
+                # the other driver stores every sample while the VDB insert is stalled
+                for _ in range(100):
+                    await asyncio.sleep(0.01)
+                    if not len(queues["screen"]):
+                        break
+            assert other.obj.store_sample.await_count == 2
+            assert table.insert.call_count == 1
+            assert not released.is_set()
+        finally:
+            released.set()
+            for consumer in consumers:
+                consumer.cancel()
+            await asyncio.gather(*consumers, return_exceptions=True)
+
+
+def test_exec_envs_scan_define():
+    # environments of HPC and Kubernetes jobs have well over 32 entries
+    args = conf_parser.parse_args(["--envs=JOBID", "--exec-envs=true"])
+    assert bpf_defines(args)["EXEC_ENVS_SCAN"] == 256
+    args = conf_parser.parse_args(["--envs=JOBID", "--exec-envs=true", "--exec-envs-scan=400"])
+    assert bpf_defines(args)["EXEC_ENVS_SCAN"] == 400
+    # capped to stay within the verifier limits
+    args = conf_parser.parse_args(["--envs=JOBID", "--exec-envs=true", "--exec-envs-scan=4096"])
+    assert bpf_defines(args)["EXEC_ENVS_SCAN"] == 512
+    assert "EXEC_ENVS_SCAN" not in bpf_defines(conf_parser.parse_args(["--envs=JOBID"]))
+
+
+@pytest.mark.parametrize(
+    "probe_mode, support_kfunc, load_error, expected",
+    [
+        ("auto", True, None, "fentry"),
+        ("auto", False, None, "kprobe"),
+        ("auto", True, RuntimeError("failed to load"), "kprobe"),
+        ("kprobe", True, None, "kprobe"),
+        ("fentry", False, None, RuntimeError),
+        ("fentry", True, RuntimeError("failed to load"), RuntimeError),
+    ],
+)
+def test_load_bpf(tmp_path, probe_mode, support_kfunc, load_error, expected):
+    args = conf_parser.parse_args([f"--probe-mode={probe_mode}", f"--state-dir={tmp_path}"])
+
+    def fake_bpf(text):
+        if "#define USE_FENTRY 1" in text and load_error:
+            raise load_error
+        return SimpleNamespace(text=text)
+
+    fake_bpf.support_kfunc = lambda: support_kfunc
+    symbols = {"nfs_file_read": "nfs", "nfs4_file_open": "nfsv4"}
+    with patch("vnfs_collector.main.BPF", fake_bpf), patch("vnfs_collector.main.nfs_symbols", return_value=symbols):
+        if expected is RuntimeError:
+            with pytest.raises(RuntimeError):
+                load_bpf(args)
+            return
+        bpf, mode = load_bpf(args)
+    assert mode == expected
+    assert ("#define USE_FENTRY 1" in bpf.text) == (expected == "fentry")
+    assert ("#define NFSV4_MODULE nfsv4" in bpf.text) == (expected == "fentry")
+
+
+def test_load_bpf_remembers_fentry_failure(tmp_path):
+    args = conf_parser.parse_args([f"--state-dir={tmp_path}"])
+    compiled = []
+
+    def fake_bpf(text):
+        compiled.append("#define USE_FENTRY 1" in text)
+        if compiled[-1]:
+            raise RuntimeError("failed to load")
+        return SimpleNamespace(text=text)
+
+    fake_bpf.support_kfunc = lambda: True
+    with patch("vnfs_collector.main.BPF", fake_bpf), \
+            patch("vnfs_collector.main.nfs_symbols", return_value={"nfs_file_read": "nfs"}):
+        assert load_bpf(args)[1] == "kprobe"
+        assert compiled == [True, False]
+        # the failed fentry/fexit build isn't compiled again
+        assert load_bpf(args)[1] == "kprobe"
+        assert compiled == [True, False, False]
+        # unless the program changes
+        args.latency_hist = True
+        load_bpf(args)
+        assert compiled == [True, False, False, True, False]
+
+
+@pytest.mark.parametrize(
+    "slow_ops, expected",
+    [
+        (["fsync=1000", "GETATTR=0.5"], {"fsync": 1000.0, "getattr": 0.5}),
+        ({"read": 20}, {"read": 20.0}),
+        (["fsync"], ValueError),
+        (["fsyn=10"], ValueError),
+    ],
+)
+def test_parse_slow_ops(slow_ops, expected):
+    if expected is ValueError:
+        with pytest.raises(ValueError):
+            parse_slow_ops(slow_ops)
+    else:
+        assert parse_slow_ops(slow_ops) == expected
+
+
+@pytest.mark.parametrize(
+    "queue_policy, expected",
+    [
+        (["drop-oldest"], {"kafka": "drop-oldest", "vdb": "drop-oldest"}),
+        (["drop-newest", "vdb=coalesce"], {"kafka": "drop-newest", "vdb": "coalesce"}),
+        (["vdb=Coalesce"], {"kafka": "drop-oldest", "vdb": "coalesce"}),
+        ({"kafka": "coalesce"}, {"kafka": "coalesce", "vdb": "drop-oldest"}),
+        (["drop-all"], ValueError),
+        (["screen=coalesce"], ValueError),
+    ],
+)
+def test_parse_queue_policies(queue_policy, expected):
+    if expected is ValueError:
+        with pytest.raises(ValueError):
+            parse_queue_policies(queue_policy, ["kafka", "vdb"])
+    else:
+        assert parse_queue_policies(queue_policy, ["kafka", "vdb"]) == expected
@@ -1,16 +1,59 @@
+import time
+import asyncio
+import threading
+import select
+import ctypes
 import datetime
+from types import SimpleNamespace
 
+import numpy as np
 import pandas as pd
 import pytest
 from unittest.mock import patch, MagicMock
 from vnfs_collector.nfsops import (
     group_stats,
-    filter_stats,
     anonymize_stats,
+    decode_counts,
+    decode_hists,
+    nstosec,
+    kernel_devt,
     MountInfo,
     MountsMap,
+    MountWatcher,
+    SlowOpsTracer,
+    RingBuffers,
+    SLOW_OP_T_DTYPE,
+    PIDINFO_T_DTYPE,
+    TASK_EXEC,
+    TASK_FORK,
+    TASK_EXIT,
+    PidEnvMap,
+    TagRegistry,
+    hashabledict,
+    CgroupsMap,
+    CgroupInfo,
+    EnvTracer,
+    StatsCollector,
+    StatsSampler,
+    SampleQueue,
+    Sample,
+    STATKEYS,
+    HISTKEYS,
+    HIST_KEY_T_DTYPE,
+    HIST_SLOTS,
+    OPS,
+    INFO_T_DTYPE,
+    info_t_dtype,
+    key_fields,
+    load_map_sizes,
+    nfs_symbols,
+    fentry_defines,
+    NFS_PROBES,
+)
+from vnfs_collector.main import conf_parser, parse_slow_ops
+from tests.conftest import (
+    ROOT, FakeArrayTable, FakeCountsTable, FakeHashTable, FakePercpuArrayTable, make_counts_entries
 )
-from tests.conftest import ROOT
 
 import pandas.testing as pdt
 
@@ -64,33 +107,39 @@ def test_group_stats_by_pid(data):
     assert second_row.READDIR_DURATION == 0.000201484
 
 
-def test_filter_stats_any(data):
+def matching_rows(data, filter_tags, filter_condition):
+    registry = TagRegistry()
+    ids = data["TAGS"].map(registry.intern)
+    return data[ids.isin(registry.matching(filter_tags, filter_condition))]
+
+
+def test_tag_filter_any(data):
     """Test at least one of the tags is present in the row"""
-    filtered = filter_stats(data, filter_tags=["FOO"], filter_condition="any")
+    filtered = matching_rows(data, filter_tags=["FOO"], filter_condition="any")
     assert len(filtered) == 4
     pdt.assert_frame_equal(data, filtered)
 
-    filtered = filter_stats(data, filter_tags=["JOB"], filter_condition="any")
+    filtered = matching_rows(data, filter_tags=["JOB"], filter_condition="any")
     assert len(filtered) == 2
 
-    filtered = filter_stats(data, filter_tags=["TAR"], filter_condition="any")
+    filtered = matching_rows(data, filter_tags=["TAR"], filter_condition="any")
     assert len(filtered) == 1
 
 
-def test_filter_stats_all(data):
+def test_tag_filter_all(data):
     """Test all the tags are present in the row"""
-    filtered = filter_stats(data, filter_tags=["FOO"], filter_condition="all")
+    filtered = matching_rows(data, filter_tags=["FOO"], filter_condition="all")
     assert len(filtered) == 4
     pdt.assert_frame_equal(data, filtered)
 
-    filtered = filter_stats(data, filter_tags=["FOO", "JOB"], filter_condition="all")
+    filtered = matching_rows(data, filter_tags=["FOO", "JOB"], filter_condition="all")
     assert len(filtered) == 2
 
-    filtered = filter_stats(data, filter_tags=["FOO", "TAR"], filter_condition="all")
+    filtered = matching_rows(data, filter_tags=["FOO", "TAR"], filter_condition="all")
     assert len(filtered) == 1
 
     # No rows with such combination of tags
-    filtered = filter_stats(data, filter_tags=["TAR", "JOB"], filter_condition="all")
+    filtered = matching_rows(data, filter_tags=["TAR", "JOB"], filter_condition="all")
     assert len(filtered) == 0
 
 
@@ -113,67 +162,26 @@ def test_remote_path(addr, remote_path):
     assert mount_info.remote_path == remote_path
 
 
-mountpoint_to_dev = {
-    '/mnt/test1': 123456,
-    '/mnt/test2': 654321
-}
-
-def fake_os_stat(mountpoint):
-    """Define fake_os_stat to return different st_dev values based on mountpoint"""
-    st_dev = mountpoint_to_dev.get(mountpoint, 0)  # Default to 0 if not found
-    return MagicMock(st_dev=st_dev)
-
-
-fake_disk_partitions = [
-    MagicMock(fstype='nfs', mountpoint='/mnt/test1', device='172.17.0.1:/mnt/test1'),
-    MagicMock(fstype='nfs', mountpoint='/mnt/test2', device='172.17.0.2:/mnt/test2'),
-]
-
-
-@patch('psutil.disk_partitions', MagicMock(return_value=fake_disk_partitions))
-@patch('os.stat', side_effect=lambda mountpoint: fake_os_stat(mountpoint))
-def test_refresh_map(mock_stat):
-    mounts_map = MountsMap()
-    mounts_map.refresh_map()
-
-    devt1 = mounts_map.devt_to_str(123456)
-    devt2 = mounts_map.devt_to_str(654321)
-
-    assert devt1 in mounts_map.map
-    assert devt2 in mounts_map.map
-
-    assert mounts_map.map[devt1].mountpoint == '/mnt/test1'
-    assert mounts_map.map[devt1].device == '172.17.0.1:/mnt/test1'
-
-    assert mounts_map.map[devt2].mountpoint == '/mnt/test2'
-    assert mounts_map.map[devt2].device == '172.17.0.2:/mnt/test2'
-
-
-@patch('psutil.disk_partitions', MagicMock(return_value=fake_disk_partitions))
-@patch('os.stat', side_effect=lambda mountpoint: fake_os_stat(mountpoint))
-def test_get_mountpoint(mock_stat):
-
+@patch.object(MountsMap, "get_mountinfo", MagicMock(return_value=f"{ROOT}/data/mounts_self"))
+def test_get_mountpoint():
     mounts_map = MountsMap()
-    devt1 = mounts_map.devt_to_str(123456)
-    devt2 = mounts_map.devt_to_str(654321)
 
-    mount_info1 = mounts_map.get_mountpoint(123456)
-    mount_info2 = mounts_map.get_mountpoint(654321)
+    mount_info1 = mounts_map.get_mountpoint(321)
+    mount_info2 = mounts_map.get_mountpoint(69)
 
     assert isinstance(mount_info1, MountInfo)
-    assert mount_info1.mountpoint == '/mnt/test1'
-    assert mount_info1.device == '172.17.0.1:/mnt/test1'
+    assert mount_info1.mountpoint == "/mnt/test"
+    assert mount_info1.device == "172.17.0.3:/"
 
     assert isinstance(mount_info2, MountInfo)
-    assert mount_info2.mountpoint == '/mnt/test2'
-    assert mount_info2.device == '172.17.0.2:/mnt/test2'
+    assert mount_info2.mountpoint == "/mnt/test2"
+    assert mount_info2.device == "172.17.0.2:/"
 
 
 @patch.object(MountsMap, "get_mountinfo", MagicMock(return_value=f"{ROOT}/data/mounts_self"))
-@patch.object(MountsMap, "refresh_map", MagicMock())
 def test_refresh_map_mountinfo():
     mounts_map = MountsMap()
-    mounts_map.refresh_map_mountinfo()
+    mounts_map.rebuild()
     map = mounts_map.map
     assert len(map) == 2
     assert "0:321" in map
@@ -184,19 +192,40 @@ def test_refresh_map_mountinfo():
     assert map["0:69"].device == "172.17.0.2:/"
 
 
-@patch('psutil.disk_partitions')
-@patch('os.stat', side_effect=lambda mountpoint: fake_os_stat(mountpoint))
-def test_get_mountpoint_with_missing_device(mock_stat, mock_disk_partitions):
-    mock_disk_partitions.return_value = []
+@patch.object(MountsMap, "get_mountinfo", MagicMock(return_value=f"{ROOT}/data/mounts_self"))
+def test_get_mountpoint_with_missing_device():
+    mounts_map = MountsMap()
+    with patch.object(mounts_map, "parse_mountinfo", wraps=mounts_map.parse_mountinfo) as parse_mountinfo:
+        assert mounts_map.get_mountpoint(123456, "162148") is None
+        # unresolved devts are not looked up again until the negative cache entry expires
+        assert mounts_map.get_mountpoint(123456, "162148") is None
+        parse_mountinfo.assert_called_once_with("162148")
+        mounts_map.unresolved[mounts_map.devt_to_str(123456)] = 0
+        assert mounts_map.get_mountpoint(123456, "162148") is None
+        assert parse_mountinfo.call_count == 2
+
 
+@patch.object(MountsMap, "get_mountinfo", MagicMock(return_value=f"{ROOT}/data/mounts_self"))
+def test_mounts_map_refresh():
     mounts_map = MountsMap()
-    devt = mounts_map.devt_to_str(123456)
-    mount_info = mounts_map.get_mountpoint(123456)
+    mounts_map.map["0:420"] = MountInfo("/mnt/mydir", "172.17.0.4:/remote")
+    mounts_map.unresolved["0:421"] = time.monotonic() + 60
+    mounts_map.poller = MagicMock()
 
-    assert mount_info is None
+    # the index is only rebuilt when the mount table changed
+    mounts_map.poller.poll.return_value = []
+    assert set(mounts_map.refresh()) == {"0:321", "0:69"}
+    assert "0:420" in mounts_map.map and "0:421" in mounts_map.unresolved
+
+    mounts_map.poller.poll.return_value = [(3, select.POLLPRI)]
+    assert set(mounts_map.refresh()) == {"0:321", "0:69"}
+    assert set(mounts_map.map) == {"0:321", "0:69"}
+    assert not mounts_map.unresolved
+    mounts_map.poller.poll.assert_called_with(0)
 
 
 def _mountinfo_side_effect(pid):
+    pid = str(pid)
     if pid == "self":
         return f"{ROOT}/data/mounts_self"
     elif pid == "162148":
@@ -207,7 +236,6 @@ def _mountinfo_side_effect(pid):
 
 
 @patch.object(MountsMap, "get_mountinfo", side_effect=_mountinfo_side_effect)
-@patch.object(MountsMap, "refresh_map",  MagicMock())
 def test_get_mount_info_from_different_mountinfo_files(*_):
     mounts_map = MountsMap()
     mount_info = mounts_map.get_mountpoint(321, "self")
@@ -219,7 +247,12 @@ def test_get_mount_info_from_different_mountinfo_files(*_):
     mount_info = mounts_map.get_mountpoint(420, "self")
     assert mount_info is None
     assert set(mounts_map.map) == {'0:321', '0:69'}
+    # negative cache entry
+    mount_info = mounts_map.get_mountpoint(420, "162148")
+    assert mount_info is None
 
+    # the negative cache entry expired
+    mounts_map.unresolved.clear()
     mount_info = mounts_map.get_mountpoint(420, "162148")
     assert mount_info.remote_path == "/remote"
     assert mount_info.mountpoint == "/mnt/mydir"
@@ -237,6 +270,7 @@ def test_get_mount_info_from_different_mountinfo_files(*_):
     mount_info = mounts_map.get_mountpoint(421, "self")
     assert mount_info is None
     assert set(mounts_map.map) == {'0:321', '0:69'}
+    assert set(mounts_map.unresolved) == {'0:421'}
     mount_info = mounts_map.get_mountpoint(420, "162149")
     assert mount_info.remote_path == "/remote"
     assert mount_info.mountpoint == "/mnt/mydir2"
@@ -265,3 +299,912 @@ def test_anonymize_valid_fields(data):
             name="TAGS",
         ),
     )
+
+
+def make_collector(tables, mounts_map=None, **options):
+    """StatsCollector with default options and the full `info_t` key reading from fake BPF tables."""
+    args = conf_parser.parse_args(["--squash-pid=false"])
+    for option, value in options.items():
+        setattr(args, option, value)
+    if mounts_map is None:
+        mounts_map = MagicMock()
+        mounts_map.get_mountpoint.return_value = MountInfo("/mnt", "172.17.0.2:/export")
+    collector = StatsCollector(_args=args, bpf=MagicMock(), pid_env_map=PidEnvMap(), mounts_map=mounts_map)
+    tables.setdefault("drops", FakePercpuArrayTable([[0], [0]]))
+    tables.setdefault("starts", FakeHashTable())
+    tables.setdefault("start_events", FakePercpuArrayTable([[0], [0]]))
+    collector.b.get_table.side_effect = tables.__getitem__
+    return collector
+
+
+def test_decode_counts():
+    entries = make_counts_entries(50)
+    collector = make_collector({"counts": FakeCountsTable(entries)})
+    keys, values = collector.read_counts()
+    columns = decode_counts(keys, values)
+
+    assert list(columns) == ["PID", "UID", "COMM"] + list(STATKEYS)
+    for i, (k, v) in enumerate(entries):
+        assert columns["PID"][i] == k.tgid
+        assert columns["UID"][i] == k.uid
+        assert columns["COMM"][i] == k.comm.decode()
+        assert columns["OPEN_COUNT"][i] == v.open.count
+        assert columns["LOOKUP_ERRORS"][i] == v.lookup.errors
+        assert columns["RMDIR_DURATION"][i] == nstosec(v.rmdir.duration)
+        assert columns["READ_BYTES"][i] == v.rbytes
+        assert columns["WRITE_BYTES"][i] == v.wbytes
+
+
+def test_collect_stats():
+    entries = make_counts_entries(200)
+    table = FakeCountsTable(entries)
+    mounts_map = MagicMock()
+    mounts_map.get_mountpoint.return_value = MountInfo("/mnt", "172.17.0.2:/export")
+    collector = make_collector({"counts": table}, mounts_map=mounts_map)
+
+    df = collector.collect_stats(interval=5, squash_pid=False)
+    # Grouped by MOUNT, PID and TAGS
+    assert len(df) == len({k.tgid for k, _ in entries})
+    assert df.OPEN_COUNT.sum() == sum(v.open.count for _, v in entries)
+    assert df.WRITE_BYTES.sum() == sum(v.wbytes for _, v in entries)
+    assert set(df.MOUNT) == {"/mnt"}
+    assert set(df.REMOTE_PATH) == {"/export"}
+    # mounts are resolved once per devt
+    assert mounts_map.get_mountpoint.call_count == len({k.sbdev for k, _ in entries})
+    # map is drained
+    assert table.entries == []
+    assert collector.collect_stats(interval=5).empty
+
+
+def test_decode_hists():
+    entries = make_counts_entries(3)
+    collector = make_collector({"counts": FakeCountsTable(entries)})
+    keys, _ = collector.read_counts()
+
+    hist_keys = np.zeros(4, dtype=HIST_KEY_T_DTYPE)
+    hist_keys["info"] = keys[[0, 0, 2, 2]]
+    hist_keys["op"] = [OPS.index("getattr"), OPS.index("getattr"), OPS.index("getattr"), OPS.index("read")]
+    hist_keys["slot"] = [3, 10, 3, HIST_SLOTS - 1]
+    # entry of a key that is missing from `counts` is dropped
+    hist_keys[3]["info"]["tgid"] += 1000
+    columns = decode_hists(keys, hist_keys, np.array([5, 1, 7, 2], dtype=np.uint64))
+
+    assert list(columns) == list(HISTKEYS)
+    getattr_hists = columns["GETATTR_LATENCY"]
+    assert getattr_hists[0][3] == 5 and getattr_hists[0][10] == 1 and getattr_hists[0].sum() == 6
+    assert getattr_hists[1].sum() == 0
+    assert getattr_hists[2][3] == 7 and getattr_hists[2].sum() == 7
+    assert all(h.sum() == 0 for h in columns["READ_LATENCY"])
+
+
+def test_group_stats_sums_hists(data):
+    data = data.copy()
+    data["GETATTR_LATENCY"] = [np.arange(HIST_SLOTS, dtype=np.uint64) * i for i in range(len(data))]
+    grouped = group_stats(data, ["MOUNT", "PID"])
+    # pids are [1, 1, 2, 2]
+    assert list(grouped.GETATTR_LATENCY[0]) == list(np.arange(HIST_SLOTS) * 1)
+    assert list(grouped.GETATTR_LATENCY[1]) == list(np.arange(HIST_SLOTS) * 5)
+
+
+def test_collect_stats_latency_hist():
+    entries = make_counts_entries(10)
+    hists = FakeCountsTable([])
+    collector = make_collector({"counts": FakeCountsTable(entries), "hists": hists}, latency_hist=True)
+    df = collector.collect_stats(interval=5, squash_pid=True)
+    assert set(HISTKEYS).issubset(df.columns)
+    assert all(len(h) == HIST_SLOTS for h in df.READ_LATENCY)
+
+
+def test_collect_stats_ops():
+    entries = make_counts_entries(10)
+    collector = make_collector(
+        {"counts": FakeCountsTable(entries), "hists": FakeCountsTable([])}, latency_hist=True, ops=["read", "lookup"]
+    )
+    df = collector.collect_stats(interval=5, squash_pid=True)
+    stats = [c for c in df.columns if c in STATKEYS or c in HISTKEYS]
+    assert stats == [
+        "READ_COUNT", "READ_ERRORS", "READ_DURATION", "READ_BYTES",
+        "LOOKUP_COUNT", "LOOKUP_ERRORS", "LOOKUP_DURATION",
+        "READ_LATENCY", "LOOKUP_LATENCY",
+    ]
+    assert df.READ_COUNT.sum() == sum(v.read.count for _, v in entries)
+
+    with patch("vnfs_collector.nfsops.nfs_symbols", return_value={"nfs_file_splice_read": "nfs"}):
+        collector.attach()
+    events = {c.kwargs["event"] for c in collector.b.attach_kprobe.call_args_list}
+    assert events == {"nfs_file_read", "nfs_file_splice_read", "nfs_lookup"}
+
+
+def test_collect_stats_percpu():
+    entries = make_counts_entries(20, cpus=4)
+    tables = {"counts": FakeCountsTable(entries)}
+    collector = make_collector(tables, percpu_counts=True)
+    keys, values = collector.read_counts()
+    assert len(values) == 20
+    for i, (_, v) in enumerate(entries):
+        assert values[i]["read"]["count"] == sum(cpu.read.count for cpu in v)
+        assert values[i]["wbytes"] == sum(cpu.wbytes for cpu in v)
+        assert values[i]["rmdir"]["errors"] == sum(cpu.rmdir.errors for cpu in v)
+
+    tables["counts"] = FakeCountsTable(entries)
+    df = collector.collect_stats(interval=5, squash_pid=True)
+    assert df.OPEN_COUNT.sum() == sum(cpu.open.count for _, v in entries for cpu in v)
+
+
+def test_collect_stats_double_buffer(monkeypatch):
+    monkeypatch.setattr("vnfs_collector.nfsops.SWAP_GRACE_PERIOD", 0)
+    first, second = make_counts_entries(10, seed=1), make_counts_entries(10, seed=2)
+    tables = {
+        "counts": FakeCountsTable(first),
+        "counts_alt": FakeCountsTable(second),
+        "counts_active": FakeArrayTable(),
+    }
+    collector = make_collector(tables, double_buffer=True)
+
+    # probes move on to counts_alt and counts is drained
+    df = collector.collect_stats(interval=5, squash_pid=True)
+    assert tables["counts_active"][0].value == 1
+    assert df.OPEN_COUNT.sum() == sum(v.open.count for _, v in first)
+    assert tables["counts"].entries == []
+    assert len(tables["counts_alt"].entries) == 10
+
+    # and back
+    df = collector.collect_stats(interval=5, squash_pid=True)
+    assert tables["counts_active"][0].value == 0
+    assert df.OPEN_COUNT.sum() == sum(v.open.count for _, v in second)
+    assert tables["counts_alt"].entries == []
+
+
+@pytest.mark.parametrize(
+    "patterns, expected",
+    [
+        (["/mnt/test"], True),
+        (["/mnt/*"], True),
+        (["/mnt/other", "172.17.0.2:/exp*"], True),
+        (["*:/export"], True),
+        (["/export"], True),
+        (["/mnt/test/*"], False),
+        (["10.0.0.1:*"], False),
+        ([], False),
+    ],
+)
+def test_mount_info_matches(patterns, expected):
+    assert MountInfo("/mnt/test", "172.17.0.2:/export").matches(patterns) is expected
+
+
+@patch.object(MountsMap, "get_mountinfo", MagicMock(return_value=f"{ROOT}/data/mounts_self"))
+def test_update_mount_filter():
+    table = FakeHashTable({kernel_devt("0:999"): 1})
+    collector = make_collector(
+        {"mount_filter": table}, mounts_map=MountsMap(), mount_filter=["/mnt/test2", "172.17.0.9:*"]
+    )
+    collector.update_mount_filter()
+    # only /mnt/test2 (0:69) matches, the stale device is removed
+    assert table.entries == {kernel_devt("0:69"): 1}
+
+    collector.mount_filter = ["/mnt/*"]
+    collector.update_mount_filter()
+    assert table.entries == {kernel_devt("0:69"): 1, kernel_devt("0:321"): 1}
+    assert kernel_devt("0:321") == 321 and kernel_devt("1:2") == (1 << 20) + 2
+
+
+@patch.object(MountsMap, "get_mountinfo", MagicMock(return_value=f"{ROOT}/data/mounts_self"))
+def test_update_mount_filter_concurrent():
+    class SlowHashTable(FakeHashTable):
+        def keys(self):
+            keys = super().keys()
+            # both threads read the table before either syncs it
+            time.sleep(0.05)
+            return keys
+
+    table = SlowHashTable({kernel_devt("0:999"): 1})
+    collector = make_collector({"mount_filter": table}, mounts_map=MountsMap(), mount_filter=["/mnt/test2"])
+    errors = []
+
+    def update():
+        try:
+            collector.update_mount_filter()
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=update) for _ in range(2)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert errors == []
+    assert table.entries == {kernel_devt("0:69"): 1}
+
+
+def make_env_tracer(tables, **options):
+    args = conf_parser.parse_args([])
+    for option, value in options.items():
+        setattr(args, option, value)
+    tracer = EnvTracer(_args=args, bpf=MagicMock(), pid_env_map=PidEnvMap())
+    tracer.b.get_table.side_effect = tables.__getitem__
+    return tracer
+
+
+@pytest.mark.parametrize(
+    "tag_filter, expected",
+    [
+        ("any", {100: 1, 101: 1}),
+        ("all", {101: 1}),
+    ],
+)
+def test_seed_pid_filter(tag_filter, expected):
+    environs = {
+        100: {"JOBID": "1"},
+        101: {"JOBID": "2", "USER": "me"},
+        102: {},
+    }
+    table = FakeHashTable({102: 1})
+    tracer = make_env_tracer({"pid_filter": table}, envs=["JOBID", "USER"], tag_filter=tag_filter)
+    with patch("psutil.pids", return_value=list(environs)), \
+            patch("vnfs_collector.nfsops.get_pid_envs", side_effect=lambda pid, envs: environs[pid]):
+        tracer.seed_pid_filter()
+    assert table.entries == expected
+    assert tracer.pid_env_map.get(101) == {"JOBID": "2", "USER": "me"}
+
+
+@pytest.mark.parametrize("ringbuf", [True, False])
+def test_process_events(ringbuf):
+    drops = FakePercpuArrayTable([[0], [0], [0], [2, 3]])
+    tracer = make_env_tracer({"drops": drops}, envs=["JOBID"])
+    if ringbuf:
+        tracer.ring_buffers = MagicMock()
+    pids = [100, 101, 100, 100, 102]
+    for pid in pids:
+        buf = (ctypes.c_uint32 * 3)(pid, TASK_EXEC, 0)
+        tracer.queue_event(0, ctypes.addressof(buf), ctypes.sizeof(buf))
+    if not ringbuf:
+        tracer.lost_events(5)
+
+    # every tgid of the batch is read once
+    with patch("vnfs_collector.nfsops.get_pid_envs", return_value={"JOBID": "1"}) as get_pid_envs:
+        tracer.process_events()
+    assert [c.args[0] for c in get_pid_envs.call_args_list] == [100, 101, 102]
+    assert tracer.pid_env_map.get(101) == {"JOBID": "1"}
+    assert not tracer.pending
+
+    tracer.update_metrics()
+    assert tracer.metrics == {"EXEC_EVENTS": 5, "EXEC_DROPS": 5, "EXEC_PROC_READS": 3}
+    tracer.update_metrics()
+    assert tracer.metrics == {"EXEC_EVENTS": 0, "EXEC_DROPS": 0, "EXEC_PROC_READS": 0}
+
+
+def test_exec_envs():
+    class EnvPrefix(ctypes.Structure):
+        _fields_ = [("len", ctypes.c_uint32), ("prefix", ctypes.c_char * 32)]
+
+    prefixes = MagicMock(Key=EnvPrefix, Leaf=ctypes.c_uint8)
+    lens, all_prefixes = FakeArrayTable(), FakeArrayTable()
+    tables = {"env_prefixes": prefixes, "env_prefix_lens": lens, "env_prefix_all": all_prefixes}
+    tracer = make_env_tracer(tables, envs=["JOB", "SLURM_JOB_ID"], exec_envs=True)
+    tracer.update_env_prefixes()
+    keys = {(c.args[0].len, c.args[0].prefix, c.args[1].value) for c in prefixes.__setitem__.call_args_list}
+    assert keys == {(3, b"JOB", 0), (12, b"SLURM_JOB_ID", 1)}
+    assert lens[0].value == 1 << 2 | 1 << 11
+    # the kernel stops scanning once the prefixes of both indexes are found
+    assert all_prefixes[0].value == 0b11
+
+    events = np.zeros(3, dtype=PIDINFO_T_DTYPE)
+    events["pid"] = [100, 101, 102]
+    events["complete"] = [1, 0, 1]
+    events["nenvs"] = [2, 0, 0]
+    events["envs"][0][:2] = [b"JOB=1", b"JOBNAME=build"]
+    for event in events:
+        buf = ctypes.create_string_buffer(event.tobytes())
+        tracer.queue_event(0, ctypes.addressof(buf), len(buf))
+
+    with patch("vnfs_collector.nfsops.get_pid_envs", return_value={"JOB": "2"}) as get_pid_envs:
+        tracer.process_events()
+    # only the incomplete capture is read from /proc
+    get_pid_envs.assert_called_once_with(101, ["JOB", "SLURM_JOB_ID"])
+    assert tracer.pid_env_map.get(100) == {"JOB": "1", "JOBNAME": "build"}
+    assert tracer.pid_env_map.get(101) == {"JOB": "2"}
+    assert tracer.pid_env_map.get(102) == {}
+
+
+def test_exec_envs_large_environment():
+    tracer = make_env_tracer({}, envs=["JOBID"], exec_envs=True)
+    tracer.env_prefixes = ["JOBID"]
+    # the tracked variable is past the 32nd entry of the environment
+    environ = [f"VAR{i}=value" for i in range(40)]
+    environ.insert(35, "JOBID=42")
+
+    # the kernel scan found it and stopped, the capture is complete
+    event = np.zeros(1, dtype=PIDINFO_T_DTYPE)[0]
+    event["pid"], event["complete"], event["nenvs"] = 100, 1, 1
+    event["envs"][0] = environ[35].encode()
+    buf = ctypes.create_string_buffer(event.tobytes())
+    tracer.queue_event(0, ctypes.addressof(buf), len(buf))
+    with patch("vnfs_collector.nfsops.get_pid_envs") as get_pid_envs:
+        tracer.process_events()
+    get_pid_envs.assert_not_called()
+    assert tracer.pid_env_map.get(100) == {"JOBID": "42"}
+
+
+def test_fork_exit_events():
+    tracer = make_env_tracer({}, envs=["JOBID"])
+    tracer.track_tasks = True
+    tracer.pid_env_map.insert(100, {"JOBID": "1"})
+    events = [
+        (101, TASK_FORK, 100),
+        (102, TASK_FORK, 100),
+        (102, TASK_EXEC, 0),
+        (103, TASK_FORK, 999),
+        (100, TASK_EXIT, 0),
+    ]
+    for event in events:
+        buf = (ctypes.c_uint32 * 3)(*event)
+        tracer.queue_event(0, ctypes.addressof(buf), ctypes.sizeof(buf))
+    with patch("vnfs_collector.nfsops.get_pid_envs", return_value={"JOBID": "2"}) as get_pid_envs, \
+            patch.object(tracer.pid_env_map, "vaccum") as vaccum:
+        tracer.pid_env_map.vaccum_interval = 0
+        tracer.process_events()
+    # only the exec'ed child is read, the forked one inherits the parent envs
+    get_pid_envs.assert_called_once_with(102, ["JOBID"])
+    vaccum.assert_not_called()
+    pidmap = tracer.pid_env_map
+    assert pidmap.pidmap == {"100": {"JOBID": "1"}, "101": {"JOBID": "1"}, "102": {"JOBID": "2"}}
+
+    # the exited process is evicted after its stats were collected
+    exited = pidmap.exited_pids()
+    assert exited == {"100"}
+    pidmap.exit(101)
+    pidmap.evict(exited)
+    assert set(pidmap.pidmap) == {"101", "102"}
+    # a reused pid is not evicted
+    pidmap.insert(101, {"JOBID": "3"})
+    pidmap.evict({"101"})
+    assert pidmap.get(101) == {"JOBID": "3"}
+
+
+def test_ring_buffers_start_once():
+    bpf = MagicMock()
+    ring_buffers = RingBuffers(bpf)
+    batch = MagicMock()
+    ring_buffers.open("events", MagicMock(), batch)
+    ring_buffers.open("slow_ops", MagicMock())
+    assert ring_buffers.batch_callbacks == [batch]
+    with patch("vnfs_collector.nfsops.Thread") as thread:
+        ring_buffers.start()
+        ring_buffers.start()
+    thread.assert_called_once()
+
+
+def test_ring_buffers_poll_survives_errors():
+    class StopPoll(BaseException):
+        pass
+
+    bpf = MagicMock()
+    bpf.ring_buffer_poll.side_effect = [None, None, StopPoll()]
+    ring_buffers = RingBuffers(bpf)
+    batch = MagicMock(side_effect=[KeyError("101"), None])
+    ring_buffers.open("events", MagicMock(), batch)
+    with patch("vnfs_collector.nfsops.logger.error") as m_logger, pytest.raises(StopPoll):
+        ring_buffers.poll()
+    assert batch.call_count == 2
+    m_logger.assert_called_once()
+
+
+def test_update_pid_filter_on_exec():
+    table = FakeHashTable()
+    tracer = make_env_tracer({"pid_filter": table}, envs=["JOBID"], tag_filter="any")
+    tracer.update_pid_filter(100, {"JOBID": "1"})
+    assert table.entries == {100: 1}
+    # exec'ed without the tracked env
+    tracer.update_pid_filter(100, {})
+    assert table.entries == {}
+
+
+@pytest.mark.parametrize(
+    "options, fields",
+    [
+        ([], ["uid", "comm", "sbdev"]),
+        (["--envs=JOBID"], ["tgid", "uid", "comm", "sbdev"]),
+        (["--squash-pid=false"], ["tgid", "uid", "comm", "sbdev"]),
+        (["--squash-pid=false", "--squash-uid=true"], ["tgid", "comm", "sbdev"]),
+        (["--squash-uid=true"], ["comm", "sbdev"]),
+        (["--squash-uid=true", "--cgroup=true"], ["cgroup", "comm", "sbdev"]),
+        (["--mount-ns=true"], ["uid", "mntns", "comm", "sbdev"]),
+    ],
+)
+def test_key_fields(options, fields):
+    assert key_fields(conf_parser.parse_args(options)) == fields
+
+
+def test_info_t_dtype():
+    # mirrors struct info_t in nfsops.c
+    assert INFO_T_DTYPE.itemsize == 28
+    assert info_t_dtype(["uid", "comm", "sbdev"]).itemsize == 24
+    dtype = info_t_dtype(["comm", "sbdev"])
+    assert dtype.names == ("comm", "sbdev")
+    assert dtype.itemsize == 20
+    assert info_t_dtype(["cgroup", "tgid", "uid", "mntns", "comm", "sbdev"]).itemsize == 40
+
+
+def test_collect_stats_squashed_key():
+    tables = {}
+    collector = make_collector(tables, squash_pid=True, squash_uid=True)
+    assert collector.info_t_dtype.names == ("comm", "sbdev")
+    entries = make_counts_entries(30, key_dtype=collector.info_t_dtype)
+    tables["counts"] = FakeCountsTable(entries)
+
+    df = collector.collect_stats(interval=5, squash_pid=True)
+    assert set(df.PID) == {0}
+    assert set(df.UID) == {0}
+    assert all(tags == {} for tags in df.TAGS)
+    assert sorted(df.COMM) == sorted({k.comm.decode() for k, _ in entries})
+    assert df.OPEN_COUNT.sum() == sum(v.open.count for _, v in entries)
+
+
+def test_collect_stats_cgroup_key(tmp_path):
+    tables = {}
+    collector = make_collector(tables, squash_pid=True, squash_uid=True, cgroup=True)
+    assert collector.info_t_dtype.names == ("cgroup", "comm", "sbdev")
+    collector.cgroups_map = CgroupsMap(root=str(tmp_path))
+    uid = "8d1f6c1e-3b1a-4b8e-9a57-0c6f2a1d9e11"
+    collector.cgroups_map.map = {
+        1001: CgroupInfo(f"/kubepods.slice/kubepods-pod{uid.replace('-', '_')}.slice/cri-containerd-{'a' * 64}.scope",
+                         {uid: ("default", "web-0")}),
+        1002: CgroupInfo("/system.slice/backup.service"),
+    }
+    entries = make_counts_entries(30, key_dtype=collector.info_t_dtype)
+    tables["counts"] = FakeCountsTable(entries)
+
+    df = collector.collect_stats(interval=5, squash_pid=True)
+    # the stats of every cgroup are kept apart
+    assert len(df) == len({(k.cgroup, k.comm) for k, _ in entries})
+    pod = df[df.CGROUP.str.startswith("/kubepods")]
+    assert set(pod.NAMESPACE) == {"default"} and set(pod.POD) == {"web-0"} and set(pod.CONTAINER) == {"a" * 64}
+    service = df[df.CGROUP == "/system.slice/backup.service"]
+    assert set(service.POD) == {""} and set(service.CONTAINER) == {""}
+    assert df.OPEN_COUNT.sum() == sum(v.open.count for _, v in entries)
+
+
+def test_cgroups_map(tmp_path):
+    root = tmp_path / "cgroup"
+    uid = "8d1f6c1e-3b1a-4b8e-9a57-0c6f2a1d9e11"
+    container = root / "kubepods" / "burstable" / f"pod{uid}" / ("b" * 64)
+    container.mkdir(parents=True)
+    pods = tmp_path / "pods"
+    (pods / f"jobs_train-1_{uid}").mkdir(parents=True)
+    cgroups = CgroupsMap(root=str(root), pods_dir=str(pods))
+
+    info, = cgroups.get_cgroups([container.stat().st_ino])
+    assert info.path == f"/kubepods/burstable/pod{uid}/{'b' * 64}"
+    assert (info.namespace, info.pod, info.container) == ("jobs", "train-1", "b" * 64)
+    assert cgroups.get_cgroups([root.stat().st_ino])[0].path == "/"
+
+    # the hierarchy is walked again only for new ids
+    service = root / "system.slice" / "sshd.service"
+    service.mkdir(parents=True)
+    with patch.object(cgroups, "walk", wraps=cgroups.walk) as walk:
+        assert cgroups.get_cgroups([service.stat().st_ino, 12345])[1] is None
+        assert cgroups.get_cgroups([service.stat().st_ino, 12345])[0].path == "/system.slice/sshd.service"
+    walk.assert_called_once()
+
+
+@pytest.mark.parametrize("squash_pid", [True, False])
+def test_collect_stats_tags(squash_pid):
+    entries = make_counts_entries(100)
+    collector = make_collector({"counts": FakeCountsTable(entries)}, envs=["JOB", "TAR"])
+    environs = {tgid: {"JOB": str(tgid % 3)} if tgid % 2 else {} for tgid in range(64)}
+    for tgid, envs in environs.items():
+        collector.pid_env_map.insert(tgid, envs)
+
+    df = collector.collect_stats(interval=5, squash_pid=squash_pid, filter_tags=["JOB"], filter_condition="any")
+    assert "TAG_ID" not in df.columns
+    # in place of TAG_ID, after the other group fields
+    assert list(df.columns).index("TAGS") == 2
+    assert all(isinstance(tags, hashabledict) for tags in df.TAGS)
+    tagged = [(k, v) for k, v in entries if environs[k.tgid]]
+    assert df.OPEN_COUNT.sum() == sum(v.open.count for _, v in tagged)
+    assert set(map(frozenset, map(dict.items, df.TAGS))) == {frozenset(environs[k.tgid].items()) for k, _ in tagged}
+    if squash_pid:
+        assert len(df) == len({(k.comm, environs[k.tgid]["JOB"]) for k, _ in tagged})
+    else:
+        assert sorted(df.PID) == sorted({k.tgid for k, _ in tagged})
+        assert all(tags == environs[pid] for pid, tags in zip(df.PID, df.TAGS))
+
+
+def test_tag_registry():
+    registry = TagRegistry(max_size=3)
+    assert registry.intern({}) == 0
+    assert registry.intern({"JOB": "1", "TAR": "x"}) == 1
+    assert registry.intern({"TAR": "x", "JOB": "1"}) == 1
+    assert registry.intern({"JOB": "2"}) == 2
+    ids = registry.tag_ids(np.array([7, 5, 7, 9]), {5: {"JOB": "2"}, 7: {}, 9: {"JOB": "3"}}.get)
+    assert ids.tolist() == [0, 2, 0, 3]
+    assert registry.matching(["JOB"], "any") == [1, 2, 3]
+    assert registry.matching(["JOB", "TAR"], "all") == [1]
+    assert list(registry.lookup(ids)) == [{}, {"JOB": "2"}, {}, {"JOB": "3"}]
+    registry.reset_if_full()
+    assert registry.tags == [{}]
+
+
+def test_collect_stats_mount_ns():
+    tables = {}
+    mounts_map = MagicMock()
+    mounts_map.get_ns_mountpoint.side_effect = lambda sbdev, mntns, pid: MountInfo(f"/mnt/{mntns}/{sbdev}", "h:/e")
+    collector = make_collector(tables, mounts_map=mounts_map, mount_ns=True)
+    assert collector.info_t_dtype.names == ("tgid", "uid", "mntns", "comm", "sbdev")
+    entries = make_counts_entries(40, key_dtype=collector.info_t_dtype)
+    tables["counts"] = FakeCountsTable(entries)
+
+    df = collector.collect_stats(interval=5)
+    # every devt is resolved once per namespace
+    pairs = {(k.sbdev, k.mntns) for k, _ in entries}
+    assert {c.args[:2] for c in mounts_map.get_ns_mountpoint.call_args_list} == pairs
+    assert mounts_map.get_ns_mountpoint.call_count == len(pairs)
+    mounts_map.refresh_namespaces.assert_called_once()
+    assert set(df.MOUNT) == {f"/mnt/{mntns}/{sbdev}" for sbdev, mntns in pairs}
+
+
+@patch.object(MountsMap, "get_mountinfo", side_effect=_mountinfo_side_effect)
+def test_mount_namespaces(*_):
+    namespaces = {"self": 1, "162148": 2, "162149": 3}
+    with patch("vnfs_collector.nfsops.mount_ns", side_effect=lambda pid="self": namespaces[str(pid)]), \
+            patch("psutil.pids", return_value=[162148, 162149]):
+        mounts_map = MountsMap()
+        # our own namespace is the main index
+        assert mounts_map.get_ns_mountpoint(321, 1).mountpoint == "/mnt/test"
+        # the same devt is mounted elsewhere in other namespaces
+        assert mounts_map.get_ns_mountpoint(420, 2, 162148).mountpoint == "/mnt/mydir"
+        # no pid known, found by its namespace
+        assert mounts_map.get_ns_mountpoint(420, 3).mountpoint == "/mnt/mydir2"
+        assert mounts_map.get_ns_mountpoint(321, 3) is None
+        assert set(mounts_map.namespaces) == {2, 3}
+
+        # no process left in the namespace
+        assert mounts_map.get_ns_mountpoint(420, 4) is None
+        assert 4 in mounts_map.unresolved_ns
+
+    # only the namespaces whose mount table changed are read again
+    namespace = mounts_map.namespaces[2]
+    mounts_map.ns_poller = MagicMock()
+    mounts_map.ns_poller.poll.return_value = [(namespace.mountinfo.fileno(), select.POLLPRI)]
+    namespace.mounts = {}
+    mounts_map.refresh_namespaces()
+    assert namespace.mounts["0:420"].mountpoint == "/mnt/mydir"
+
+    # namespaces not looked up for a while are closed
+    mounts_map.ns_poller.poll.return_value = []
+    namespace.seen = 0
+    mounts_map.refresh_namespaces()
+    assert set(mounts_map.namespaces) == {3}
+    assert namespace.mountinfo.closed
+
+
+def test_mount_namespace_reader_gone():
+    def mountinfo(pid):
+        if str(pid) == "162148":
+            # exited after its namespace was looked up
+            return f"{ROOT}/data/mounts_gone"
+        return _mountinfo_side_effect(pid)
+
+    namespaces = {"self": 1, "162148": 2, "162149": 2}
+    with patch.object(MountsMap, "get_mountinfo", side_effect=mountinfo), \
+            patch("vnfs_collector.nfsops.mount_ns", side_effect=lambda pid="self": namespaces[str(pid)]), \
+            patch("psutil.pids", return_value=[162148, 162149]):
+        mounts_map = MountsMap()
+        # read through the other process of the namespace
+        assert mounts_map.get_ns_mountpoint(420, 2, 162148).mountpoint == "/mnt/mydir2"
+        assert 2 not in mounts_map.unresolved_ns
+        # the same without a known pid
+        mounts_map.close_namespace(2)
+        assert mounts_map.get_ns_mountpoint(420, 2).mountpoint == "/mnt/mydir2"
+
+
+def test_check_maps(tmp_path):
+    drops = FakePercpuArrayTable([[0, 0], [0, 0]])
+    now = time.monotonic_ns()
+    start_events = FakePercpuArrayTable([[1, 1], [0]])
+    tables = {
+        "drops": drops,
+        "starts": FakeHashTable({1: SimpleNamespace(start=now), 2: SimpleNamespace(start=now)}),
+        "start_events": start_events,
+    }
+    collector = make_collector(
+        tables, counts_map_size=100, starts_map_size=10, map_autosize=True, state_dir=str(tmp_path)
+    )
+    collector.check_maps(50)
+    assert collector.metrics == {
+        "COUNTS_ENTRIES": 50, "COUNTS_FILL": 0.5, "COUNTS_DROPS": 0,
+        "STARTS_ENTRIES": 2, "STARTS_FILL": 0.2, "STARTS_DROPS": 0, "STARTS_EVICTED": 0,
+    }
+
+    # drops are reported per interval
+    drops.values[0] = [3, 4]
+    collector.check_maps(100)
+    assert collector.metrics["COUNTS_DROPS"] == 7
+    collector.check_maps(100)
+    assert collector.metrics["COUNTS_DROPS"] == 0
+    assert not (tmp_path / "map_sizes.json").exists()
+
+    # full for AUTOSIZE_INTERVALS intervals in a row
+    collector.check_maps(90)
+    assert collector.grown == {"counts"}
+    args = conf_parser.parse_args([f"--state-dir={tmp_path}", "--counts-map-size=100"])
+    load_map_sizes(args)
+    assert args.counts_map_size == 200
+    assert args.starts_map_size == 10240
+
+    # 10 more calls started and 4 completed, the map still holds 2 calls in flight: 6 were evicted
+    start_events.values = [[5, 7], [4]]
+    collector.check_maps(10)
+    assert collector.metrics["STARTS_DROPS"] == 6
+    collector.check_maps(10)
+    assert collector.metrics["STARTS_DROPS"] == 0
+
+
+def test_load_map_sizes_never_shrinks(tmp_path):
+    (tmp_path / "map_sizes.json").write_text('{"counts": 2048, "starts": 20480}')
+    args = conf_parser.parse_args([f"--state-dir={tmp_path}", "--counts-map-size=4096"])
+    load_map_sizes(args)
+    assert args.counts_map_size == 4096
+    assert args.starts_map_size == 20480
+
+
+def test_sweep_starts():
+    now = time.monotonic_ns()
+    starts = FakeHashTable({
+        1: SimpleNamespace(start=now - 700 * 10**9),  # lost kretprobe
+        2: SimpleNamespace(start=now - 10**9),
+        3: SimpleNamespace(start=0),                  # being initialized
+    })
+    collector = make_collector({"starts": starts}, starts_max_age=600)
+    assert collector.sweep_starts() == (2, 1)
+    assert sorted(starts.entries) == [2, 3]
+
+    collector.starts_max_age = 0
+    assert collector.sweep_starts() == (2, 0)
+
+
+def test_nfs_symbols(tmp_path):
+    kallsyms = tmp_path / "kallsyms"
+    kallsyms.write_text(
+        "ffffffffc0a01000 t nfs_file_read\t[nfs]\n"
+        "ffffffffc0a02000 T nfs_getattr\t[nfs]\n"
+        "ffffffffc0b01000 t nfs4_file_open\t[nfsv4]\n"
+        "ffffffff81001000 T nfs_lookup\n"
+        "ffffffff81002000 T vfs_read\n"
+    )
+    assert nfs_symbols(str(kallsyms), ops=["open"]) == {"nfs4_file_open": "nfsv4"}
+    symbols = nfs_symbols(str(kallsyms))
+    assert symbols == {
+        "nfs_file_read": "nfs", "nfs_getattr": "nfs", "nfs4_file_open": "nfsv4", "nfs_lookup": "vmlinux",
+    }
+    assert fentry_defines(symbols) == {
+        "USE_FENTRY": 1,
+        "HAVE_NFS_FILE_READ": 1,
+        "HAVE_NFS_GETATTR": 1,
+        "HAVE_NFS4_FILE_OPEN": 1,
+        "HAVE_NFS_LOOKUP": 1,
+        "NFS_MODULE": "vmlinux",
+        "NFSV4_MODULE": "nfsv4",
+    }
+
+
+def test_attach_kprobes():
+    collector = make_collector({})
+    with patch("vnfs_collector.nfsops.nfs_symbols", return_value={"nfs_file_read": "nfs", "nfs4_file_open": "nfsv4"}):
+        collector.attach()
+    kprobes = {c.kwargs["event"]: c.kwargs["fn_name"] for c in collector.b.attach_kprobe.call_args_list}
+    kretprobes = {c.kwargs["event"]: c.kwargs["fn_name"] for c in collector.b.attach_kretprobe.call_args_list}
+    required = {probe[0] for probe in NFS_PROBES if probe[4]}
+    assert set(kprobes) == set(kretprobes) == required | {"nfs4_file_open"}
+    assert kretprobes["nfs_getattr"] == "trace_nfs_getattr_ret"
+    assert kprobes["nfs4_file_open"] == "trace_nfs_file_open"
+
+
+def test_attach_kprobes_retry():
+    collector = make_collector({})
+
+    def attach_kretprobe(event, fn_name):
+        if event == "nfs_lookup":
+            raise Exception(f"Failed to attach {event}")
+
+    collector.b.attach_kretprobe.side_effect = attach_kretprobe
+    with patch("vnfs_collector.nfsops.nfs_symbols", return_value={}):
+        with pytest.raises(Exception, match="Failed to attach nfs_lookup"):
+            collector.attach()
+        collector.b.detach_kprobe.assert_called_once_with(event="nfs_lookup")
+        assert "nfs_file_read" in collector.attached
+        assert "nfs_lookup" not in collector.attached
+
+        # the retry attaches only the probes not attached yet
+        attached = set(collector.attached)
+        collector.b.attach_kprobe.reset_mock()
+        collector.b.attach_kretprobe.side_effect = None
+        collector.attach()
+    events = {c.kwargs["event"] for c in collector.b.attach_kprobe.call_args_list}
+    assert "nfs_lookup" in events
+    assert not events & attached
+    assert set(collector.timings) == {"load", "attach"}
+    assert collector.startup_timings(1.5).startswith("compile 1.50s, load ")
+
+
+def test_attach_fentry():
+    collector = make_collector({})
+    collector.probe_mode = "fentry"
+    collector.attach()
+    collector.b.attach_kprobe.assert_not_called()
+    collector.b.attach_kretprobe.assert_not_called()
+
+
+def test_mount_watcher():
+    mounts_map = MagicMock()
+    collector = make_collector({}, mounts_map=mounts_map)
+    watcher = MountWatcher(collector=collector, mounts_map=mounts_map)
+    nfs_mount = {"0:53": MountInfo("/mnt", "172.17.0.2:/export")}
+    required = {probe[0] for probe in NFS_PROBES if probe[4]}
+
+    with patch("vnfs_collector.nfsops.nfs_symbols", return_value={}):
+        # no NFS mounts, nothing is attached
+        mounts_map.refresh.return_value = {}
+        watcher.check()
+        collector.b.attach_kprobe.assert_not_called()
+        assert not collector.active
+
+        # attach failures are retried on the next check
+        mounts_map.refresh.return_value = nfs_mount
+        collector.b.attach_kprobe.side_effect = Exception("Failed to attach")
+        with patch("vnfs_collector.nfsops.logger.error") as m_logger:
+            watcher.check()
+        assert m_logger.call_args[0][0].startswith("Attaching StatsCollector failed")
+        assert not collector.active
+        collector.b.attach_kprobe.side_effect = None
+        watcher.check()
+        assert collector.active
+        assert collector.attached == required
+
+        # the last NFS mount went away
+        mounts_map.refresh.return_value = {}
+        with patch.object(collector, "detach", side_effect=Exception("busy")), \
+                patch("vnfs_collector.nfsops.logger.error") as m_logger:
+            watcher.check()
+        m_logger.assert_called_once_with("Detaching StatsCollector failed: busy")
+        watcher.check()
+        assert not collector.active
+        assert not collector.attached
+        assert {c.kwargs["event"] for c in collector.b.detach_kretprobe.call_args_list} == required
+
+
+@pytest.mark.asyncio
+async def test_stats_sampler():
+    args = conf_parser.parse_args(["--interval=1"])
+    args.interval = 0.05
+    collector = MagicMock(metrics={"COUNTS_ENTRIES": 1})
+
+    def slow_collect(**kwargs):
+        # a collection blocking for longer than the interval
+        time.sleep(0.2)
+        return pd.DataFrame({"PID": [1]})
+
+    collector.collect_stats.side_effect = slow_collect
+    sampler = StatsSampler(_args=args, collector=collector, loop=asyncio.get_running_loop())
+    sampler.start()
+    try:
+        # the event loop keeps running while the collection blocks the sampler thread
+        ticks = 0
+        get = asyncio.ensure_future(sampler.samples.get())
+        while not get.done():
+            await asyncio.sleep(0.01)
+            ticks += 1
+        assert ticks >= 10
+        sample = get.result()
+        assert list(sample.data.PID) == [1]
+        assert sample.events.empty
+        assert sample.metrics["COUNTS_ENTRIES"] == 1
+        assert sample.metrics["COLLECT_SECONDS"] >= 0.2
+        assert collector.collect_stats.call_args.kwargs["interval"] == 0.05
+
+        # collection errors are logged and cost their interval only
+        collector.collect_stats.side_effect = [RuntimeError("map lookup failed"), pd.DataFrame({"PID": [2]})]
+        with patch("vnfs_collector.nfsops.logger.error") as m_logger:
+            sample = await asyncio.wait_for(sampler.samples.get(), 5)
+            while list(sample.data.PID) != [2]:
+                sample = await asyncio.wait_for(sampler.samples.get(), 5)
+        assert "map lookup failed" in m_logger.call_args[0][0]
+    finally:
+        sampler.stop()
+    sampler.t.join(5)
+    assert not sampler.t.is_alive()
+
+
+def make_sample(i, mount="/mnt"):
+    data = pd.DataFrame({
+        "MOUNT": [mount], "COMM": ["dd"], "TAGS": [hashabledict({"JOBID": "1"})],
+        "READ_COUNT": [i], "TIMESTAMP": [i], "TIMEDELTA": [5], "PID": [i],
+    })
+    metrics = {"COUNTS_ENTRIES": i, "COUNTS_FILL": i / 10, "QUEUE_DROPS": {"vdb": 1}}
+    return Sample(data, metrics, pd.DataFrame(), 5)
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "policy, expected",
+    [
+        ("drop-oldest", [2, 3]),
+        ("drop-newest", [0, 1]),
+        ("coalesce", [0, 6]),
+    ],
+)
+async def test_sample_queue(policy, expected):
+    queue = SampleQueue(2, policy, squash_pid=True)
+    for i in range(4):
+        queue.put(make_sample(i))
+    assert len(queue) == 2
+    assert queue.take_drops() == 2
+    assert queue.take_drops() == 0
+    assert [(await queue.get()).data.READ_COUNT.sum() for _ in range(2)] == expected
+
+    # consumers wait for the next sample
+    get = asyncio.ensure_future(queue.get())
+    await asyncio.sleep(0)
+    assert not get.done()
+    queue.put(make_sample(7))
+    assert (await get).data.READ_COUNT.sum() == 7
+
+
+@pytest.mark.asyncio
+async def test_sample_queue_coalesce():
+    queue = SampleQueue(1, "coalesce", squash_pid=True)
+    queue.put(make_sample(1))
+    queue.put(make_sample(2, mount="/mnt2"))
+    queue.put(make_sample(4))
+    sample = await queue.get()
+    # stats of the same mount, command and tags are summed over the intervals of all samples
+    assert list(sample.data.MOUNT) == ["/mnt", "/mnt2"]
+    assert list(sample.data.READ_COUNT) == [5, 2]
+    assert list(sample.data.TIMEDELTA) == [15, 15]
+    assert list(sample.data.TIMESTAMP) == [1, 1]
+    assert sample.interval == 15
+    # counting self-metrics are summed, levels are the newest
+    assert sample.metrics == {"COUNTS_ENTRIES": 7, "COUNTS_FILL": 0.4, "QUEUE_DROPS": {"vdb": 3}}
+
+
+def test_slow_ops_tracer():
+    mounts_map = MagicMock()
+    mounts_map.get_mountpoint.return_value = MountInfo("/mnt", "172.17.0.2:/export")
+    args = conf_parser.parse_args(["--slow-ops=fsync=5000,getattr=100"])
+    args.slow_ops = parse_slow_ops(args.slow_ops)
+    thresholds = FakeArrayTable(len(OPS), leaf=ctypes.c_uint64)
+    drops = FakePercpuArrayTable([[0], [0], [3, 4]])
+    tables = {"slow_op_thresholds": thresholds, "drops": drops}
+    bpf = MagicMock()
+    bpf.get_table.side_effect = tables.__getitem__
+    tracer = SlowOpsTracer(_args=args, bpf=bpf, mounts_map=mounts_map, ring_buffers=MagicMock())
+
+    tracer.update_thresholds()
+    assert thresholds[OPS.index("fsync")].value == 5 * 10**9
+    assert thresholds[OPS.index("getattr")].value == 100 * 10**6
+    assert thresholds[OPS.index("read")].value == 0
+
+    events = np.zeros(2, dtype=SLOW_OP_T_DTYPE)
+    events["ts"] = time.monotonic_ns()
+    events["latency"] = [6 * 10**9, 2 * 10**8]
+    events["ino"] = [1234, 5678]
+    events["tgid"] = [10, 20]
+    events["op"] = [OPS.index("fsync"), OPS.index("getattr")]
+    events["comm"] = [b"dd", b"ls"]
+    for event in events:
+        buf = ctypes.create_string_buffer(event.tobytes())
+        tracer.handle_event(None, ctypes.addressof(buf), len(buf))
+
+    df = tracer.drain(anon_fields=["COMM", "UID"])
+    assert list(df.OP) == ["FSYNC", "GETATTR"]
+    assert list(df.LATENCY) == [6.0, 0.2]
+    assert list(df.PID) == [10, 20]
+    assert list(df.INODE) == [1234, 5678]
+    assert list(df.COMM) == ["--", "--"]
+    assert list(df.MOUNT) == ["/mnt", "/mnt"]
+    assert abs(df.TIMESTAMP[0] - pd.Timestamp.now(tz="UTC")) < pd.Timedelta(seconds=5)
+    assert tracer.metrics == {"SLOW_OPS_EVENTS": 2, "SLOW_OPS_DROPS": 7}
+
+    # events are reported once
+    assert tracer.drain().empty
+    assert tracer.metrics == {"SLOW_OPS_EVENTS": 0, "SLOW_OPS_DROPS": 0}
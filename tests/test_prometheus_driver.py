@@ -68,3 +68,67 @@ async def test_collect_metrics(data):
         # Verify that metrics were collected
         assert len(metrics) > 0
         assert mock_create_gauge.call_count == 260
+
+
+@pytest.mark.asyncio
+@patch("prometheus_client.start_http_server", MagicMock())
+@patch("prometheus_client.REGISTRY.unregister", MagicMock())
+async def test_collect_metrics_selected_ops(data):
+    from vnfs_collector.nfsops import STATKEYS, op_columns
+
+    driver = PrometheusDriver(common_args=argparse.Namespace(envs=[]))
+    await driver.setup()
+    # columns of operations left out of --ops are not collected
+    dropped = [c for c in STATKEYS if c not in op_columns(STATKEYS, ["read", "write"])]
+    driver.local_buffer.append(data.drop(columns=dropped))
+
+    names = {m.name for m in driver.collect()}
+    assert names == {"vnfs_" + c for c in op_columns(STATKEYS, ["read", "write"])}
+
+
+@pytest.mark.asyncio
+@patch("prometheus_client.start_http_server", MagicMock())
+@patch("prometheus_client.REGISTRY.unregister", MagicMock())
+async def test_collect_latency_histograms(data):
+    import numpy as np
+    from vnfs_collector.nfsops import HIST_SLOTS
+
+    driver = PrometheusDriver(common_args=argparse.Namespace(envs=[]))
+    await driver.setup()
+    data = data.copy()
+    hist = np.zeros(HIST_SLOTS, dtype=np.uint64)
+    hist[[3, 5, HIST_SLOTS - 1]] = [2, 1, 1]
+    data["GETATTR_LATENCY"] = [hist] * len(data)
+    driver.local_buffer.append(data)
+
+    histograms = [m for m in driver.collect() if m.type == "histogram"]
+    assert len(histograms) == len(data)
+    samples = {s.name: s for s in histograms[0].samples if s.labels.get("le") in ("+Inf", None)}
+    assert samples["vnfs_GETATTR_LATENCY_SECONDS_bucket"].value == 4
+    assert samples["vnfs_GETATTR_LATENCY_SECONDS_count"].value == 4
+    assert samples["vnfs_GETATTR_LATENCY_SECONDS_sum"].value == data.GETATTR_DURATION.iloc[0]
+
+
+@pytest.mark.asyncio
+@patch("prometheus_client.start_http_server", MagicMock())
+@patch("prometheus_client.REGISTRY.unregister", MagicMock())
+async def test_collect_self_metrics():
+    driver = PrometheusDriver(common_args=argparse.Namespace(envs=[]))
+    await driver.setup()
+    await driver.store_metrics({"COUNTS_DROPS": 7, "COUNTS_FILL": 0.5})
+
+    metrics = {m.name: m.samples[0].value for m in driver.collect()}
+    assert metrics == {"vnfs_collector_COUNTS_DROPS": 7, "vnfs_collector_COUNTS_FILL": 0.5}
+
+
+@pytest.mark.asyncio
+@patch("prometheus_client.start_http_server", MagicMock())
+@patch("prometheus_client.REGISTRY.unregister", MagicMock())
+async def test_collect_driver_self_metrics():
+    driver = PrometheusDriver(common_args=argparse.Namespace(envs=[]))
+    await driver.setup()
+    await driver.store_metrics({"QUEUE_DEPTH": {"kafka": 3, "screen": 0}})
+
+    (gauge,) = driver.collect()
+    assert gauge.name == "vnfs_collector_QUEUE_DEPTH"
+    assert {s.labels["DRIVER"]: s.value for s in gauge.samples} == {"kafka": 3, "screen": 0}
@@ -10,6 +10,7 @@ from vnfs_collector.utils import (
     unix_serializer,
     maybe_list_parse,
     await_until_event_or_timeout,
+    await_until_event_or_get,
     get_val_or_raise,
     flatten_keys,
 )
@@ -62,6 +63,13 @@ def test_unix_serializer_with_bytes():
     assert result == "some bytes"
 
 
+def test_serializers_with_ndarray():
+    import numpy as np
+
+    assert iso_serializer(np.array([1, 2, 3])) == [1, 2, 3]
+    assert unix_serializer(np.array([1, 2, 3])) == [1, 2, 3]
+
+
 def test_unix_serializer_with_unsupported_type():
     with pytest.raises(TypeError):
         unix_serializer(123)
@@ -192,6 +200,20 @@ async def test_await_until_event_or_timeout_with_timeout():
     assert canceled is False
 
 
+@pytest.mark.asyncio
+async def test_await_until_event_or_get():
+    stop_event = asyncio.Event()
+    queue = asyncio.Queue()
+    asyncio.get_running_loop().call_later(0.01, queue.put_nowait, "sample")
+    assert await await_until_event_or_get(queue, stop_event) == "sample"
+
+    asyncio.get_running_loop().call_later(0.01, stop_event.set)
+    assert await await_until_event_or_get(queue, stop_event) is None
+    # no item is lost to a canceled get
+    queue.put_nowait("next")
+    assert await await_until_event_or_get(queue, asyncio.Event()) == "next"
+
+
 def test_empty_dict():
     """Test flatten_keys with an empty dictionary."""
     assert flatten_keys({}) == []
@@ -25,6 +25,14 @@ class DriverBase(abc.ABC):
     async def store_sample(self, data):
         pass
 
+    async def store_events(self, events):
+        """Store the slow NFS calls reported in the last interval (see --slow-ops). Ignored by default."""
+        pass
+
+    async def store_metrics(self, metrics):
+        """Store the collector self-metrics of the last interval (see SELFKEYS). Ignored by default."""
+        pass
+
     async def setup(self, args=(), namespace=None):
         self.logger.info("Setting up driver.")
         if namespace:
@@ -63,3 +63,8 @@ class FileDriver(DriverBase):
     async def store_sample(self, data):
         for _, entry in data.iterrows():
             self.samples_logger.debug(json.dumps(entry.to_dict(), default=iso_serializer))
+
+    async def store_events(self, events):
+        # slow call events share the samples file, told apart by their EVENT field
+        for _, entry in events.iterrows():
+            self.samples_logger.debug(json.dumps({"EVENT": "SLOW_OP", **entry.to_dict()}, default=iso_serializer))
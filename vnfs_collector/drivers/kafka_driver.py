@@ -8,6 +8,7 @@ import argparse
 import os
 from vnfs_collector.utils import unix_serializer, maybe_list_parse
 from vnfs_collector.drivers.base import DriverBase, InvalidArgument
+from vnfs_collector.nfsops import CGROUP_COLUMNS
 
 
 class KafkaDriver(DriverBase):
@@ -180,6 +181,10 @@ class KafkaDriver(DriverBase):
                 ("MOUNT", entry.MOUNT.encode()),
                 ("REMOTE_PATH", entry.REMOTE_PATH.encode()),
             ]
+            # pod and container attribution with --cgroup
+            for column in CGROUP_COLUMNS:
+                if column in entry:
+                    headers.append((column, entry[column].encode()))
             key = f"{entry.HOSTNAME}:{entry.COMM}:{entry.UID}:{entry.PID}".encode()
             # Add environment variables to headers if provided
             if self.common_args.envs:
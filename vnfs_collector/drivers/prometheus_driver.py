@@ -14,10 +14,10 @@ try:
     from prometheus_client.registry import Collector
 except:
     from prometheus_client.registry import CollectorRegistry as Collector
-from prometheus_client.core import GaugeMetricFamily
+from prometheus_client.core import GaugeMetricFamily, HistogramMetricFamily
 
 from vnfs_collector.drivers.base import DriverBase
-from vnfs_collector.nfsops import STATKEYS
+from vnfs_collector.nfsops import STATKEYS, HISTKEYS, SELFKEYS, CGROUP_COLUMNS, hist_upper_bounds
 
 
 class PrometheusDriver(DriverBase, Collector):
@@ -51,6 +51,7 @@ class PrometheusDriver(DriverBase, Collector):
         self.prom_exporter_port = args.prom_exporter_port
         self.buffer_size = args.buffer_size
         self.local_buffer = deque(maxlen=self.buffer_size)
+        self.metrics = {}
 
         prom.REGISTRY.unregister(prom.PROCESS_COLLECTOR)
         prom.REGISTRY.unregister(prom.PLATFORM_COLLECTOR)
@@ -77,14 +78,36 @@ class PrometheusDriver(DriverBase, Collector):
                 "Prometheus is taking samples too slowly."
             )
 
+    async def store_metrics(self, metrics):
+        with self.lock:
+            self.metrics = dict(metrics)
+
     def _create_gauge(self, name, help_text, labels, value):
         gauge = GaugeMetricFamily(name, help_text, labels=labels.keys())
         gauge.add_metric(labels.values(), value)
         return gauge
 
+    def _create_histogram(self, name, help_text, labels, hist, sum_value):
+        # Prometheus buckets are cumulative. The last log2 bucket is open ended.
+        cumulative = hist.cumsum()
+        buckets = [(str(le), int(c)) for le, c in zip(hist_upper_bounds()[:-1], cumulative[:-1])]
+        buckets.append(("+Inf", int(cumulative[-1])))
+        histogram = HistogramMetricFamily(name, help_text, labels=labels.keys())
+        histogram.add_metric(labels.values(), buckets, sum_value)
+        return histogram
+
     def collect(self):
         # Make sure only 1 prometheus request can be processed at time.
         with self.lock:
+            for m, value in self.metrics.items():
+                if isinstance(value, dict):
+                    # per driver metrics, eg the queue depth of every driver
+                    gauge = GaugeMetricFamily("vnfs_collector_" + m, "vnfs_collector_" + SELFKEYS[m], labels=["DRIVER"])
+                    for driver, driver_value in value.items():
+                        gauge.add_metric([driver], driver_value)
+                    yield gauge
+                else:
+                    yield self._create_gauge("vnfs_collector_" + m, "vnfs_collector_" + SELFKEYS[m], {}, value)
             samples_count = len(self.local_buffer)
             if samples_count == 0:
                 return
@@ -99,6 +122,10 @@ class PrometheusDriver(DriverBase, Collector):
                         "MOUNT": entry.MOUNT,
                         "REMOTE_PATH": entry.REMOTE_PATH,
                     }
+                    # pod and container attribution with --cgroup
+                    for column in CGROUP_COLUMNS:
+                        if column in entry:
+                            labels_kwargs[column] = entry[column]
                     if self.common_args.envs:
                         for env in self.common_args.envs:
                             try:
@@ -106,4 +133,12 @@ class PrometheusDriver(DriverBase, Collector):
                             except:
                                 labels_kwargs.update({env: ""})
                     for s in STATKEYS.keys():
-                        yield self._create_gauge("vnfs_" + s, "vnfs_" + STATKEYS[s], labels_kwargs, entry[s])
+                        # only the columns of the traced operations (--ops) are present
+                        if s in entry:
+                            yield self._create_gauge("vnfs_" + s, "vnfs_" + STATKEYS[s], labels_kwargs, entry[s])
+                    for h in HISTKEYS.keys():
+                        if h in entry:
+                            duration = entry[h.replace("_LATENCY", "_DURATION")]
+                            yield self._create_histogram(
+                                "vnfs_" + h + "_SECONDS", "vnfs_" + HISTKEYS[h], labels_kwargs, entry[h], duration
+                            )
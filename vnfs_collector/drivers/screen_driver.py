@@ -20,9 +20,13 @@ class ScreenDriver(DriverBase):
         self.table_format = args.table_format
         self.logger.info(f"{self} has been initialized.")
 
-    async def store_sample(self, data):
+    def format(self, data):
         if self.table_format:
-            output = data.T.to_string(index=True, header=False)
-        else:
-            output = "\n".join(json.dumps(d.to_dict(), default=iso_serializer) for _, d in data.iterrows())
-        self.logger.info(f">>>\n{output}")
+            return data.T.to_string(index=True, header=False)
+        return "\n".join(json.dumps(d.to_dict(), default=iso_serializer) for _, d in data.iterrows())
+
+    async def store_sample(self, data):
+        self.logger.info(f">>>\n{self.format(data)}")
+
+    async def store_events(self, events):
+        self.logger.info(f">>> slow ops\n{self.format(events)}")
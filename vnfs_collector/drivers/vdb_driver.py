@@ -1,6 +1,7 @@
 # SPDX-License-Identifier: Apache-2.0
 # Copyright (c) 2025 Vast Data Ltd.
 
+import asyncio
 import argparse
 from datetime import datetime, timedelta
 
@@ -9,6 +10,7 @@ from vastdb.errors import NotFound
 import pyarrow as pa
 
 from vnfs_collector.drivers.base import DriverBase
+from vnfs_collector.nfsops import STATKEYS, HISTKEYS
 from vnfs_collector.utils import InvalidArgument
 
 ENV_VAR_PREFIX = "ENV_"
@@ -121,9 +123,25 @@ class VdbDriver(DriverBase):
         self._refresh_vdb_schema()
         self.logger.info(f"{self} has been initialized.")
 
+    def _insert(self, rows):
+        """Insert the rows into the database table. Blocks until the insert is acknowledged."""
+        session = vastdb.connect(
+            endpoint=self.db_endpoint,
+            access=self.db_access_key,
+            secret=self.db_secret_key,
+            ssl_verify=self.db_ssl_verify,
+        )
+        try:
+            with session.transaction() as tx:
+                table = tx.bucket(self.db_bucket).schema(self.db_schema).table(self.db_table)
+                table.insert(rows=pa.Table.from_pydict(rows, schema=self.arrow_schema))
+        finally:
+            del session
+
     async def store_sample(self, data, fail_on_error=False):
+        # vastdb calls block, they run in a thread so a stalled endpoint doesn't block the event loop
         if self.should_read_envs:
-            self._refresh_vdb_schema()
+            await asyncio.to_thread(self._refresh_vdb_schema)
 
         rows = {}
         tags = data.TAGS.to_list()
@@ -131,25 +149,24 @@ class VdbDriver(DriverBase):
             if col.name.startswith(ENV_VAR_PREFIX):
                 original_name = col.name[len(ENV_VAR_PREFIX):]
                 rows[col.name] = [t.get(original_name, "") for t in tags]
+            elif col.name in HISTKEYS or col.name in STATKEYS:
+                # Histogram columns are only present when latency histograms are enabled,
+                # statistics and histogram columns of operations left out of --ops never are.
+                if col.name not in data:
+                    rows[col.name] = [None] * len(data)
+                elif col.name in HISTKEYS:
+                    rows[col.name] = [h.tolist() for h in data[col.name]]
+                else:
+                    rows[col.name] = data[col.name].to_list()
             else:
                 rows[col.name] = data[col.name].to_list()
 
-        session = vastdb.connect(
-            endpoint=self.db_endpoint,
-            access=self.db_access_key,
-            secret=self.db_secret_key,
-            ssl_verify=self.db_ssl_verify,
-        )
-        with session.transaction() as tx:
-            table = tx.bucket(self.db_bucket).schema(self.db_schema).table(self.db_table)
-            try:
-                table.insert(rows=pa.Table.from_pydict(rows, schema=self.arrow_schema))
-            except (ValueError, NotFound) as exc:
-                if self.envs_from_vdb_schema and not fail_on_error:
-                    self.read_db_schema_ts = datetime(1970, 1, 1)
-                    self._refresh_vdb_schema()
-                    await self.store_sample(data, fail_on_error=True)
-                else:
-                    raise exc
-            finally:
-                del session
+        try:
+            await asyncio.to_thread(self._insert, rows)
+        except (ValueError, NotFound) as exc:
+            if self.envs_from_vdb_schema and not fail_on_error:
+                self.read_db_schema_ts = datetime(1970, 1, 1)
+                await asyncio.to_thread(self._refresh_vdb_schema)
+                await self.store_sample(data, fail_on_error=True)
+            else:
+                raise exc
@@ -3,6 +3,10 @@
 
 import os
 import sys
+import json
+import time
+import hashlib
+import platform
 import urllib3
 import logging
 import argparse
@@ -21,19 +25,28 @@ from vnfs_collector.logger import COLORS
 from vnfs_collector.utils import (
     InvalidArgument,
     set_signal_handler,
-    await_until_event_or_timeout,
+    await_until_event_or_get,
     parse_args_options_from_namespace,
     maybe_list_parse,
     maybe_bool_parse,
     flatten_keys,
 )
-from vnfs_collector.nfsops import StatsCollector, PidEnvMap, MountsMap, EnvTracer, logger
+from vnfs_collector.nfsops import (
+    StatsCollector, StatsSampler, SampleQueue, PidEnvMap, MountsMap, CgroupsMap, MountWatcher, EnvTracer, SlowOpsTracer, RingBuffers,
+    key_fields,
+    load_map_sizes, nfs_symbols, fentry_defines, ringbuf_supported, logger, OPS, CGROUP_COLUMNS, QUEUE_POLICIES,
+)
 
 urllib3.disable_warnings()
 
 BASE_PATH = Path(__file__).parents[1]
 ENTRYPOINT_GROUP = "drivers"
-ANON_FIELDS = {"COMM", "MOUNT", "PID", "UID", "TAGS", "REMOTE_PATH"}
+ANON_FIELDS = {"COMM", "MOUNT", "PID", "UID", "TAGS", "REMOTE_PATH", *CGROUP_COLUMNS}
+# fentry/fexit programs which failed to load, by kernel release and program source hash
+FENTRY_FAILURES_STATE = "fentry_failures.json"
+# every scanned entry costs the verifier a walk of the prefix loop, ~800 instructions,
+# this keeps the worst case well inside its limit of 1M processed instructions
+EXEC_ENVS_SCAN_MAX = 512
 
 
 entry_points = metadata.entry_points()
@@ -142,7 +155,8 @@ conf_parser.add_argument(
 )
 conf_parser.add_argument(
     "-v", "--vaccum", default=600, type=int,
-    help="Pid env map vaccum interval, in seconds."
+    help="Pid env map vaccum interval, in seconds. "
+         "The pid env map is only vaccumed when process exit events are not traced or were lost."
 )
 conf_parser.add_argument(
     "-e", "--envs", type=maybe_list_parse,
@@ -156,6 +170,11 @@ conf_parser.add_argument(
     "--squash-pid", type=maybe_bool_parse, default=True,
     help="Squash PIDs during statistics aggregation. This will group statistics by command, mount, and tags."
 )
+conf_parser.add_argument(
+    "--squash-uid", type=maybe_bool_parse, default=False,
+    help="Squash UIDs during statistics aggregation. UID is left out of the in-kernel aggregation key "
+         "and reported as 0."
+)
 conf_parser.add_argument(
     "--tag-filter", type=str, choices=("all", "any"), default=None,
     help="Specify how to filter statistics based on tags.\n"
@@ -180,12 +199,278 @@ conf_parser.add_argument(
     help="Specify how often to re-read the VDB schema, in seconds. "
          "If not provided, the default is 5 minutes (300 seconds)."
 )
+conf_parser.add_argument(
+    "--latency-hist", type=maybe_bool_parse, default=False,
+    help="Keep in-kernel log2 latency histograms per operation. "
+         "Adds a <OP>_LATENCY histogram column for every operation."
+)
+conf_parser.add_argument(
+    "--percpu-counts", type=maybe_bool_parse, default=False,
+    help="Aggregate statistics in a per-CPU BPF map and sum the per-CPU values in user space. "
+         "Avoids cross-CPU contention and lost updates on hosts with many cores."
+)
+conf_parser.add_argument(
+    "--double-buffer", type=maybe_bool_parse, default=False,
+    help="Keep two sets of statistics maps and swap them on every interval, so the collector "
+         "drains a map no probe updates anymore. Gives consistent per-interval snapshots."
+)
+conf_parser.add_argument(
+    "--mount-filter", type=maybe_list_parse,
+    help="Comma separated list of mountpoint or remote path glob patterns, eg '/mnt/data*,*:/export'. "
+         "Only NFS mounts matching any of the patterns are traced, other mounts are filtered in the kernel."
+)
+conf_parser.add_argument(
+    "--ops", type=maybe_list_parse,
+    help="Comma separated list of NFS operations to trace, eg 'read,write,open,close'. "
+         "Only the probes of these operations are attached and only their columns are reported. "
+         "All operations are traced by default."
+)
+conf_parser.add_argument(
+    "--cgroup", type=maybe_bool_parse, default=False,
+    help="Aggregate the statistics by cgroup and attribute them to Kubernetes pods and containers "
+         "(CGROUP, NAMESPACE, POD and CONTAINER columns). Requires cgroup v2 and kernel 4.18+."
+)
+conf_parser.add_argument(
+    "--mount-ns", type=maybe_bool_parse, default=False,
+    help="Resolve mounts in the mount namespace of the calling process, for clients running in containers. "
+         "The mounts of every namespace are read once and again only when its mount table changes."
+)
+conf_parser.add_argument(
+    "--exec-envs", type=maybe_bool_parse, default=False,
+    help="Capture the tracked environment variables in the kernel when a process is exec'ed, "
+         "rather than reading /proc/<pid>/environ afterwards. Requires kernel 5.5+."
+)
+conf_parser.add_argument(
+    "--exec-envs-scan", type=int, default=256,
+    help="Maximum number of environment entries scanned by the kernel with --exec-envs, at most "
+         f"{EXEC_ENVS_SCAN_MAX}. The scan stops once all the tracked variables are found, processes "
+         "with more entries are read from /proc."
+)
+conf_parser.add_argument(
+    "--slow-ops", type=maybe_list_parse,
+    help="Comma separated list of <operation>=<msecs> latency thresholds, eg 'fsync=1000,getattr=100'. "
+         "Every call slower than the threshold of its operation is reported as a separate event "
+         "with its pid, command, mount and inode. Requires kernel 5.8+."
+)
+conf_parser.add_argument(
+    "--slow-ops-rate", type=int, default=100,
+    help="Maximum number of slow call events reported per second by every CPU, further ones are dropped."
+)
+conf_parser.add_argument(
+    "--counts-map-size", type=int, default=10240,
+    help="Maximum number of entries in the in-kernel statistics map."
+)
+conf_parser.add_argument(
+    "--starts-map-size", type=int, default=10240,
+    help="Maximum number of entries in the in-kernel map of NFS calls in flight."
+)
+conf_parser.add_argument(
+    "--starts-max-age", type=int, default=600,
+    help="Evict NFS calls in flight for longer than this many seconds from the in-kernel map, "
+         "they are left over by missed return probes. 0 disables the eviction."
+)
+conf_parser.add_argument(
+    "--map-autosize", type=maybe_bool_parse, default=False,
+    help="Grow the in-kernel maps on the next start when they keep filling above --map-autosize-threshold "
+         "or dropping samples. The grown sizes are kept in --state-dir."
+)
+conf_parser.add_argument(
+    "--map-autosize-threshold", type=float, default=0.8,
+    help="Fill ratio of a map above which it is grown with --map-autosize."
+)
+conf_parser.add_argument(
+    "--state-dir", default="/var/lib/vnfs-collector",
+    help="Directory the collector keeps its state across restarts in."
+)
+conf_parser.add_argument(
+    "--probe-mode", choices=("auto", "kprobe", "fentry"), default="auto",
+    help="How NFS functions are traced.\n"
+         "- `fentry`: fentry/fexit programs (BTF trampolines), cheaper than kprobes.\n"
+         "- `kprobe`: kprobes/kretprobes.\n"
+         "- `auto`: fentry/fexit when the kernel supports them, kprobes otherwise.\n"
+)
+conf_parser.add_argument(
+    "--queue-size", type=int, default=10,
+    help="Maximum number of samples queued for every driver. Every driver stores its samples "
+         "in its own task, a driver falling behind only fills its own queue."
+)
+conf_parser.add_argument(
+    "--queue-policy", type=maybe_list_parse, default="drop-oldest",
+    help="What to do with a new sample when the queue of a driver is full, for all drivers or as a "
+         "comma separated list of <driver>=<policy>, eg 'drop-oldest,vdb=coalesce'.\n"
+         "- `drop-oldest`: drop the oldest queued sample.\n"
+         "- `drop-newest`: drop the new sample.\n"
+         "- `coalesce`: sum the new sample into the newest queued one.\n"
+)
 conf_parser.add_argument(
     "-C", "--cfg", default=None,
     help="Config yaml. When provided it takes precedence over command line arguments."
 )
 
 
+def parse_slow_ops(slow_ops):
+    """
+    Parse the --slow-ops latency thresholds, a list of '<operation>=<msecs>' or
+    a {operation: msecs} mapping (YAML), into a {operation: msecs} dict.
+    """
+    if isinstance(slow_ops, list):
+        slow_ops = dict(item.partition("=")[::2] for item in slow_ops)
+    thresholds = {}
+    for op, msecs in slow_ops.items():
+        op = op.strip().lower()
+        if op not in OPS:
+            raise ValueError(f"Invalid slow-ops operation specified: {op}")
+        try:
+            thresholds[op] = float(msecs)
+        except (TypeError, ValueError):
+            raise ValueError(f"Invalid slow-ops threshold for {op}: {msecs!r}")
+    return thresholds
+
+
+def parse_queue_policies(queue_policy, drivers):
+    """
+    Parse the --queue-policy option, a policy for all drivers, a list of '<policy>' and
+    '<driver>=<policy>' items or a {driver: policy} mapping (YAML), into a {driver: policy} dict.
+    """
+    if isinstance(queue_policy, str):
+        queue_policy = [queue_policy]
+    if isinstance(queue_policy, list):
+        default = [item.strip() for item in queue_policy if "=" not in item]
+        queue_policy = dict(item.partition("=")[::2] for item in queue_policy if "=" in item)
+        queue_policy.update({driver: default[-1] for driver in drivers if default and driver not in queue_policy})
+    policies = {}
+    for driver, policy in queue_policy.items():
+        driver, policy = driver.strip(), str(policy).strip().lower()
+        if driver not in drivers:
+            raise ValueError(f"Invalid queue-policy driver specified: {driver}")
+        if policy not in QUEUE_POLICIES:
+            raise ValueError(f"Invalid queue-policy for {driver}: {policy!r}")
+        policies[driver] = policy
+    return {driver: policies.get(driver, QUEUE_POLICIES[0]) for driver in drivers}
+
+
+async def consume_samples(driver, queue):
+    """Store the samples of the queue of a driver, as they come."""
+    while True:
+        sample = await queue.get()
+        try:
+            if not sample.events.empty:
+                await driver.obj.store_events(events=sample.events)
+            await driver.obj.store_metrics(metrics=sample.metrics)
+            if not sample.data.empty:
+                await driver.obj.store_sample(data=sample.data)
+        except Exception as e:
+            # the sample is lost to this driver only
+            logger.error(f"Driver {driver.name} failed to store the sample: {e}")
+
+
+def bpf_defines(args):
+    """Preprocessor definitions the BPF program is built with, derived from the configuration."""
+    defines = {}
+    fields = key_fields(args)
+    if "tgid" not in fields:
+        defines["DROP_KEY_TGID"] = 1
+    if "uid" not in fields:
+        defines["DROP_KEY_UID"] = 1
+    if "cgroup" in fields:
+        defines["KEY_CGROUP"] = 1
+    if "mntns" in fields:
+        defines["KEY_MNTNS"] = 1
+    if args.latency_hist:
+        defines["LATENCY_HIST"] = 1
+    if args.percpu_counts:
+        defines["PERCPU_COUNTS"] = 1
+    if args.double_buffer:
+        defines["DOUBLE_BUFFER"] = 1
+    if args.mount_filter:
+        defines["MOUNT_FILTER"] = 1
+    if args.tag_filter:
+        defines["PID_FILTER"] = 1
+    if (args.envs or args.envs_from_vdb_schema) and ringbuf_supported():
+        defines["EXEC_RINGBUF"] = 1
+    if (args.envs or args.envs_from_vdb_schema) and args.exec_envs:
+        defines["EXEC_ENVS"] = 1
+        defines["EXEC_ENVS_SCAN"] = min(args.exec_envs_scan, EXEC_ENVS_SCAN_MAX)
+    if args.slow_ops:
+        defines["SLOW_OPS"] = 1
+        defines["SLOW_OPS_RATE"] = args.slow_ops_rate
+    defines["COUNTS_MAP_SIZE"] = args.counts_map_size
+    defines["STARTS_MAP_SIZE"] = args.starts_map_size
+    return defines
+
+
+def bpf_program(args, fentry_symbols=None):
+    """
+    Read the BPF program text and prepend the definitions for the given configuration.
+    With `fentry_symbols` ({function: module}) the program is built with fentry/fexit
+    programs for these functions instead of kprobe handlers.
+    """
+    with BASE_PATH.joinpath("nfsops.c").open() as f:
+        bpf_text = f.read()
+    defines = bpf_defines(args)
+    if fentry_symbols:
+        defines.update(fentry_defines(fentry_symbols))
+    return "".join(f"#define {k} {v}\n" for k, v in defines.items()) + bpf_text
+
+
+def program_key(bpf_text):
+    """Key of a BPF program build: the kernel release and the hash of the program source."""
+    return f"{platform.release()}-{hashlib.sha256(bpf_text.encode()).hexdigest()[:16]}"
+
+
+def load_fentry_failures(args):
+    try:
+        return json.loads(Path(args.state_dir, FENTRY_FAILURES_STATE).read_text())
+    except (OSError, ValueError):
+        return {}
+
+
+def save_fentry_failure(args, key, error):
+    """Remember that the fentry/fexit program failed to load, so the known-failing compile is skipped."""
+    failures = load_fentry_failures(args)
+    failures[key] = error
+    state = Path(args.state_dir, FENTRY_FAILURES_STATE)
+    try:
+        state.parent.mkdir(parents=True, exist_ok=True)
+        state.write_text(json.dumps(failures))
+    except OSError as e:
+        logger.error(f"Failed to save the fentry/fexit load failure: {e}")
+
+
+def load_bpf(args):
+    """
+    Build and load the BPF program. fentry/fexit programs are used when --probe-mode
+    allows it and the kernel supports them, kprobes otherwise. BCC compiles the program
+    against the kernel headers on every call, it has no way to load a prebuilt object.
+    Returns the BPF object and the probe mode it was built with.
+    """
+    if args.probe_mode != "kprobe":
+        symbols = nfs_symbols(ops=args.ops) if BPF.support_kfunc() else None
+        if symbols is None:
+            reason = "the kernel does not support fentry/fexit"
+        elif not symbols:
+            reason = "the nfs module is not loaded"
+        else:
+            bpf_text = bpf_program(args, fentry_symbols=symbols)
+            key = program_key(bpf_text)
+            error = load_fentry_failures(args).get(key)
+            if error and args.probe_mode == "auto":
+                # skip the known-failing compile, the kprobe program is still compiled on every start
+                reason = f"loading fentry/fexit programs failed in a previous run: {error}"
+            else:
+                try:
+                    return BPF(text=bpf_text), "fentry"
+                except Exception as e:
+                    if args.probe_mode == "fentry":
+                        raise
+                    reason = f"loading fentry/fexit programs failed: {e}"
+                    save_fentry_failure(args, key, str(e))
+        if args.probe_mode == "fentry":
+            raise RuntimeError(f"Cannot use fentry/fexit probes, {reason}.")
+        logger.warning(f"Falling back to kprobes, {reason}.")
+    return BPF(text=bpf_program(args)), "kprobe"
+
+
 async def _exec():
     """
     Main execution function to set up and run the BPF program and drivers.
@@ -220,11 +505,31 @@ async def _exec():
     if args.envs_from_vdb_schema and args.envs:
         conf_parser.error("--envs-from-vdb-schema and --envs are mutually exclusive.")
 
+    if args.ops:
+        args.ops = [op.lower() for op in args.ops]
+        invalid_ops = set(args.ops).difference(OPS)
+        if invalid_ops:
+            conf_parser.error(f"Invalid operations specified: {', '.join(invalid_ops)}")
+
+    if args.slow_ops:
+        try:
+            args.slow_ops = parse_slow_ops(args.slow_ops)
+        except ValueError as e:
+            conf_parser.error(str(e))
+
+    try:
+        args.queue_policy = parse_queue_policies(args.queue_policy, drivers)
+    except ValueError as e:
+        conf_parser.error(str(e))
+
     if args.anon_fields:
         invalid_fields = set(args.anon_fields).difference(ANON_FIELDS)
         if invalid_fields:
             conf_parser.error(f"Invalid anonymized fields specified: {', '.join(invalid_fields)}")
 
+    if args.map_autosize:
+        load_map_sizes(args)
+
     logger.info(f"BPF version: {__version__}")
     try:
         collector_version = BASE_PATH.joinpath("version.txt").read_text().strip('\n')
@@ -238,10 +543,27 @@ async def _exec():
         ("envs", args.envs),
         ("ebpf", args.ebpf),
         ("squash-pid", args.squash_pid),
+        ("squash-uid", args.squash_uid),
         ("tag-filter", args.tag_filter),
         ("anon-fields", args.anon_fields),
         ("config", args.cfg),
         ("envs-from-vdb-schema", args.envs_from_vdb_schema),
+        ("latency-hist", args.latency_hist),
+        ("percpu-counts", args.percpu_counts),
+        ("double-buffer", args.double_buffer),
+        ("mount-filter", args.mount_filter),
+        ("ops", args.ops),
+        ("cgroup", args.cgroup),
+        ("mount-ns", args.mount_ns),
+        ("exec-envs", args.exec_envs),
+        ("exec-envs-scan", args.exec_envs_scan),
+        ("slow-ops", args.slow_ops),
+        ("counts-map-size", args.counts_map_size),
+        ("starts-map-size", args.starts_map_size),
+        ("map-autosize", args.map_autosize),
+        ("probe-mode", args.probe_mode),
+        ("queue-size", args.queue_size),
+        ("queue-policy", args.queue_policy),
     ]
     if args.envs_from_vdb_schema:
         display_options.append(("vdb-schema-refresh-interval", args.vdb_schema_refresh_interval))
@@ -251,8 +573,7 @@ async def _exec():
         f"{', '.join(f'{k}={v}' for k, v in display_options)}"
     )
     # read BPF program text
-    with BASE_PATH.joinpath("nfsops.c").open() as f:
-        bpf_text = f.read()
+    bpf_text = bpf_program(args)
     debug = args.debug
     if debug:
         logging.basicConfig(level=logging.DEBUG)
@@ -261,11 +582,24 @@ async def _exec():
     if args.ebpf:
         exit()
 
+    # probe needed modules (nfsv4 autoloads nfs), fentry/fexit programs need them at load time.
+    # kernel headers are only needed when they aren't installed.
+    if not Path("/lib/modules", platform.release(), "build").exists():
+        os.system(f"modprobe kheaders  > {os.devnull} 2>&1")
+    os.system(f"modprobe nfsv4 > {os.devnull} 2>&1")
+
     # initialize BPF
-    bpf = BPF(text=bpf_text)
+    start = time.monotonic()
+    bpf, probe_mode = load_bpf(args)
+    compile_time = time.monotonic() - start
+    logger.info(f"BPF program loaded, using {probe_mode} probes.")
     pidEnvMap = PidEnvMap(vaccum_interval=args.vaccum)
     mountsMap = MountsMap(vaccum_interval=args.vaccum)
-    collector = StatsCollector(_args=args, bpf=bpf, pid_env_map=pidEnvMap, mounts_map=mountsMap)
+    cgroupsMap = CgroupsMap() if args.cgroup else None
+    collector = StatsCollector(
+        _args=args, bpf=bpf, pid_env_map=pidEnvMap, mounts_map=mountsMap, probe_mode=probe_mode,
+        cgroups_map=cgroupsMap,
+    )
     mgr = NamedExtensionManager(
         namespace=ENTRYPOINT_GROUP,
         invoke_on_load=True,
@@ -294,46 +628,62 @@ async def _exec():
         exit_error = e
         on_exit()
 
+    envTracer = slowOpsTracer = sampler = None
     if not stop_event.is_set():
+        ringBuffers = RingBuffers(bpf)
         # if no envs are given, no need to track
         if args.envs_from_vdb_schema or args.envs:
-            envTracer = EnvTracer(_args=args, bpf=bpf, pid_env_map=pidEnvMap)
+            envTracer = EnvTracer(_args=args, bpf=bpf, pid_env_map=pidEnvMap, ring_buffers=ringBuffers)
             envTracer.attach()
             envTracer.start()
 
-        # probe needed modules (nfsv4 autoloads nfs)
-        os.system(f"modprobe kheaders  > {os.devnull} 2>&1")
-        os.system(f"modprobe nfsv4 > {os.devnull} 2>&1")
-
-        while True:
-            try:
-                collector.attach()
-                break
-            except Exception as e:
-                if "Failed to attach" in str(e):
-                    logger.error(f"{e}. Do you have any mounts?")
-                    await asyncio.sleep(10)
-                    continue
-                raise
-
-        logger.info("All good! StatsCollector has been attached.")
-
-    while not stop_event.is_set():
-        canceled = await await_until_event_or_timeout(timeout=args.interval, stop_event=stop_event)
-        if canceled:
-            break
-
-        data = collector.collect_stats(
-            interval=args.interval,
-            squash_pid=args.squash_pid,
-            filter_tags=args.envs,
-            filter_condition=args.tag_filter,
-            anon_fields=args.anon_fields,
+        if args.slow_ops:
+            slowOpsTracer = SlowOpsTracer(_args=args, bpf=bpf, mounts_map=mountsMap, ring_buffers=ringBuffers)
+            slowOpsTracer.start()
+
+        # probes are attached while NFS mounts exist only
+        mountWatcher = MountWatcher(collector=collector, mounts_map=mountsMap)
+        mountWatcher.check()
+        if collector.active:
+            logger.info("All good! StatsCollector has been attached.")
+            logger.info(f"Startup timings: {collector.startup_timings(compile_time)}")
+        else:
+            logger.info("No NFS mounts yet, StatsCollector will be attached when one appears.")
+        mountWatcher.start()
+
+        # collection runs in its own thread, the loop only hands its samples to the drivers
+        sampler = StatsSampler(
+            _args=args, collector=collector, loop=asyncio.get_event_loop(),
+            env_tracer=envTracer, slow_ops_tracer=slowOpsTracer,
         )
-        if data.empty:
-            continue
-        await asyncio.gather(*mgr.map_method("store_sample", data=data))
+        sampler.start()
+
+    # every driver consumes its own queue, a slow driver doesn't delay the samples of the others
+    queues = {
+        ext.name: SampleQueue(args.queue_size, args.queue_policy[ext.name], squash_pid=args.squash_pid)
+        for ext in mgr.extensions
+    }
+    consumers = [asyncio.ensure_future(consume_samples(ext, queues[ext.name])) for ext in mgr.extensions]
+    while sampler and not stop_event.is_set():
+        sample = await await_until_event_or_get(sampler.samples, stop_event=stop_event)
+        if sample is None:
+            break
 
+        sample.metrics["QUEUE_DEPTH"] = {name: len(queue) for name, queue in queues.items()}
+        sample.metrics["QUEUE_DROPS"] = {name: queue.take_drops() for name, queue in queues.items()}
+        for name, queue in queues.items():
+            if sample.metrics["QUEUE_DROPS"][name]:
+                logger.warning(
+                    f"{sample.metrics['QUEUE_DROPS'][name]} samples "
+                    f"{'coalesced' if queue.policy == 'coalesce' else 'dropped'}, driver {name} is falling behind."
+                )
+            queue.put(sample)
+
+    for consumer in consumers:
+        consumer.cancel()
+    await asyncio.gather(*consumers, return_exceptions=True)
+    if sampler:
+        sampler.stop()
     await asyncio.gather(*mgr.map_method("teardown"))
     if exit_error:
         logger.error(str(exit_error))
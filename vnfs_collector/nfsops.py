@@ -10,13 +10,20 @@
 # uses in-kernel eBPF maps to store per process summaries for efficiency.
 
 import os
+import ctypes
 import re
+import json
+import time
+import select
+import asyncio
 import argparse
+from fnmatch import fnmatch
 
 import numpy
 import psutil
 import socket
-from threading import Thread
+from threading import Thread, Lock, Event
+from collections import namedtuple, deque
 from datetime import datetime
 from pathlib import Path
 from bcc import BPF
@@ -44,6 +51,50 @@ class hashabledict(dict):
         return f"{self.__class__.__name__}({dict(self)})"
 
 
+class TagRegistry:
+    """
+    Registry of interned tag sets. Every distinct tag set gets a small integer id, so
+    statistics are filtered and grouped by TAG_ID and the tag dicts are only put back
+    into the TAGS column for the drivers. Ids are only valid until the next `reset`.
+    """
+    def __init__(self, max_size=65536):
+        self.max_size = max_size
+        self.reset()
+
+    def reset(self):
+        # id 0 is the empty tag set
+        self.tags = [hashabledict()]
+        self.ids = {self.tags[0]: 0}
+
+    def reset_if_full(self):
+        if len(self.tags) > self.max_size:
+            self.reset()
+
+    def intern(self, tags: dict) -> int:
+        tags = hashabledict(tags)
+        tag_id = self.ids.get(tags)
+        if tag_id is None:
+            tag_id = self.ids[tags] = len(self.tags)
+            self.tags.append(tags)
+        return tag_id
+
+    def tag_ids(self, tgids: numpy.ndarray, get_tags) -> numpy.ndarray:
+        """TAG_ID column of the tgids, the tags of every distinct tgid are looked up with `get_tags` once."""
+        unique, inverse = numpy.unique(tgids, return_inverse=True)
+        ids = numpy.array([self.intern(get_tags(tgid)) for tgid in unique.tolist()], dtype=numpy.int64)
+        return ids[inverse]
+
+    def matching(self, filter_tags: list, filter_condition: str) -> list:
+        """Ids of the tag sets passing the filter condition."""
+        return [tag_id for tag_id, tags in enumerate(self.tags) if match_tags(tags, filter_tags, filter_condition)]
+
+    def lookup(self, tag_ids) -> numpy.ndarray:
+        """TAGS column of the tag ids."""
+        tags = numpy.empty(len(self.tags), dtype=object)
+        tags[:] = self.tags
+        return tags[numpy.asarray(tag_ids, dtype=numpy.int64)]
+
+
 STATKEYS = {
         "OPEN_COUNT":       "Number of NFS OPEN calls",
         "OPEN_ERRORS":      "Number of NFS OPEN errors",
@@ -112,14 +163,415 @@ STATKEYS = {
         "LISTXATTR_DURATION": "Total NFS LISTXATTR duration (in seconds)",
 }
 
+HISTKEYS = {
+        "OPEN_LATENCY":      "NFS OPEN latency histogram (log2 usecs buckets)",
+        "CLOSE_LATENCY":     "NFS CLOSE latency histogram (log2 usecs buckets)",
+        "READ_LATENCY":      "NFS READ latency histogram (log2 usecs buckets)",
+        "WRITE_LATENCY":     "NFS WRITE latency histogram (log2 usecs buckets)",
+        "GETATTR_LATENCY":   "NFS GETATTR latency histogram (log2 usecs buckets)",
+        "SETATTR_LATENCY":   "NFS SETATTR latency histogram (log2 usecs buckets)",
+        "FLUSH_LATENCY":     "NFS FLUSH latency histogram (log2 usecs buckets)",
+        "FSYNC_LATENCY":     "NFS FSYNC latency histogram (log2 usecs buckets)",
+        "LOCK_LATENCY":      "NFS LOCK latency histogram (log2 usecs buckets)",
+        "MMAP_LATENCY":      "NFS MMAP latency histogram (log2 usecs buckets)",
+        "READDIR_LATENCY":   "NFS READDIR latency histogram (log2 usecs buckets)",
+        "CREATE_LATENCY":    "NFS CREATE latency histogram (log2 usecs buckets)",
+        "LINK_LATENCY":      "NFS LINK latency histogram (log2 usecs buckets)",
+        "UNLINK_LATENCY":    "NFS UNLINK latency histogram (log2 usecs buckets)",
+        "SYMLINK_LATENCY":   "NFS SYMLINK latency histogram (log2 usecs buckets)",
+        "LOOKUP_LATENCY":    "NFS LOOKUP latency histogram (log2 usecs buckets)",
+        "RENAME_LATENCY":    "NFS RENAME latency histogram (log2 usecs buckets)",
+        "ACCESS_LATENCY":    "NFS ACCESS latency histogram (log2 usecs buckets)",
+        "MKDIR_LATENCY":     "NFS MKDIR latency histogram (log2 usecs buckets)",
+        "RMDIR_LATENCY":     "NFS RMDIR latency histogram (log2 usecs buckets)",
+        "LISTXATTR_LATENCY": "NFS LISTXATTR latency histogram (log2 usecs buckets)",
+}
+
+# Traced NFS kernel functions: (function, operation, kprobe handler, kretprobe handler, required).
+# Optional functions exist on some kernels and NFS versions only.
+NFS_PROBES = [
+    # file operations
+    ("nfs_file_read",        "read",      "trace_nfs_file_read",        "trace_nfs_file_read_ret",     True),
+    ("nfs_file_write",       "write",     "trace_nfs_file_write",       "trace_nfs_file_write_ret",    True),
+    ("nfs_file_splice_read", "read",      "trace_nfs_file_splice_read", "trace_nfs_file_splice_ret",   False),  # 4.18.x
+    ("nfs_file_open",        "open",      "trace_nfs_file_open",        "trace_nfs_file_open_ret",     True),
+    ("nfs_getattr",          "getattr",   "trace_nfs_getattr",          "trace_nfs_getattr_ret",       True),
+    ("nfs_setattr",          "setattr",   "trace_nfs_setattr",          "trace_nfs_setattr_ret",       True),
+    ("nfs_file_flush",       "flush",     "trace_nfs_file_flush",       "trace_nfs_file_flush_ret",    True),
+    ("nfs_file_fsync",       "fsync",     "trace_nfs_file_fsync",       "trace_nfs_file_fsync_ret",    True),
+    # (XXX: should we track unlocks as well)
+    ("nfs_lock",             "lock",      "trace_nfs_lock",             "trace_nfs_lock_ret",          True),
+    ("nfs_flock",            "lock",      "trace_nfs_lock",             "trace_nfs_lock_ret",          True),
+    ("nfs_file_mmap",        "mmap",      "trace_nfs_file_mmap",        "trace_nfs_file_mmap_ret",     True),
+    ("nfs_file_release",     "close",     "trace_nfs_file_release",     "trace_nfs_file_release_ret",  True),
+    # directory operations
+    ("nfs_readdir",          "readdir",   "trace_nfs_readdir",          "trace_nfs_readdir_ret",       True),
+    ("nfs_create",           "create",    "trace_nfs_create",           "trace_nfs_create_ret",        True),
+    ("nfs_link",             "link",      "trace_nfs_link",             "trace_nfs_link_ret",          True),
+    ("nfs_unlink",           "unlink",    "trace_nfs_unlink",           "trace_nfs_unlink_ret",        True),
+    ("nfs_symlink",          "symlink",   "trace_nfs_symlink",          "trace_nfs_symlink_ret",       True),
+    ("nfs_lookup",           "lookup",    "trace_nfs_lookup",           "trace_nfs_lookup_ret",        True),
+    ("nfs_rename",           "rename",    "trace_nfs_rename",           "trace_nfs_rename_ret",        True),
+    ("nfs_do_access",        "access",    "trace_nfs_do_access",        "trace_nfs_do_access_ret",     True),
+    ("nfs_mkdir",            "mkdir",     "trace_nfs_mkdir",            "trace_nfs_mkdir_ret",         True),
+    ("nfs_rmdir",            "rmdir",     "trace_nfs_rmdir",            "trace_nfs_rmdir_ret",         True),
+    # nfs4/nfs3 operations
+    ("nfs4_file_open",       "open",      "trace_nfs_file_open",        "trace_nfs_file_open_ret",     False),
+    ("nfs4_file_flush",      "flush",     "trace_nfs_file_flush",       "trace_nfs_file_flush_ret",    False),
+    ("nfs4_listxattr",       "listxattr", "trace_nfs_listxattrs",       "trace_nfs_listxattrs_ret",    False),
+    ("nfs3_listxattr",       "listxattr", "trace_nfs_listxattrs",       "trace_nfs_listxattrs_ret",    False),
+]
+
+
+def nfs_symbols(kallsyms="/proc/kallsyms", ops=None):
+    """
+    Return {function: module} of the traced NFS functions in the running kernel,
+    only the functions of `ops` when given.
+    """
+    functions = {probe[0] for probe in NFS_PROBES if ops is None or probe[1] in ops}
+    symbols = {}
+    with open(kallsyms) as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) > 2 and parts[2] in functions and parts[2] not in symbols:
+                # module symbols carry a "[module]" column, built-in ones don't
+                symbols[parts[2]] = parts[3].strip("[]") if len(parts) > 3 else "vmlinux"
+    return symbols
+
+
+def fentry_defines(symbols: dict) -> dict:
+    """Preprocessor definitions for the fentry/fexit programs of the available NFS functions."""
+    defines = {"USE_FENTRY": 1}
+    for function, module in symbols.items():
+        defines[f"HAVE_{function.upper()}"] = 1
+        if function.startswith("nfs4_"):
+            defines["NFSV4_MODULE"] = module
+        elif function.startswith("nfs3_"):
+            defines["NFSV3_MODULE"] = module
+        else:
+            defines["NFS_MODULE"] = module
+    return defines
+
+
+def ringbuf_supported():
+    """Whether the kernel has BPF ring buffers (5.8+, or backported)."""
+    return BPF.ksymname("bpf_ringbuf_output") != -1
+
+
+# Collector self-metrics, reported every interval.
+SELFKEYS = {
+        "COUNTS_ENTRIES":   "Number of counts map entries collected in the interval",
+        "COUNTS_FILL":      "Fill ratio of the counts map",
+        "COUNTS_DROPS":     "Number of NFS calls not counted in the interval because the counts map was full",
+        "STARTS_ENTRIES":   "Number of starts map entries (NFS calls in flight)",
+        "STARTS_FILL":      "Fill ratio of the starts map",
+        "STARTS_DROPS":     "Number of NFS calls not timed in the interval because they were evicted from the full starts map",
+        "STARTS_EVICTED":   "Number of starts map entries older than --starts-max-age evicted in the interval",
+        "SLOW_OPS_EVENTS":  "Number of slow NFS calls reported in the interval",
+        "SLOW_OPS_DROPS":   "Number of slow NFS calls not reported in the interval because of the rate limit",
+        "EXEC_EVENTS":      "Number of process exec, fork and exit events received in the interval",
+        "EXEC_DROPS":       "Number of process exec, fork and exit events lost in the interval",
+        "EXEC_PROC_READS":  "Number of /proc/<pid>/environ reads for exec events in the interval",
+        "COLLECT_SECONDS":  "Time spent collecting and aggregating the stats of the interval, in seconds",
+        "QUEUE_DEPTH":      "Number of samples waiting in the queue of every driver",
+        "QUEUE_DROPS":      "Number of samples dropped or coalesced in the interval because the queue of a driver was full",
+}
+# Self-metrics counting the events of the interval, summed when the samples of two intervals are coalesced.
+# The others are levels, the newer one is kept.
+DELTA_SELFKEYS = {
+    "COUNTS_ENTRIES", "COUNTS_DROPS", "STARTS_DROPS", "STARTS_EVICTED", "SLOW_OPS_EVENTS", "SLOW_OPS_DROPS",
+    "EXEC_EVENTS", "EXEC_DROPS", "EXEC_PROC_READS", "COLLECT_SECONDS", "QUEUE_DROPS",
+}
+
+# Overflow policies of the driver queues, see SampleQueue.
+QUEUE_POLICIES = ("drop-oldest", "drop-newest", "coalesce")
+
+# Operations in the order of `enum nfs_op_t` in nfsops.c.
+OPS = [
+    "open", "close", "setattr", "getattr", "flush", "mmap", "fsync", "lock", "read", "write", "create",
+    "link", "unlink", "symlink", "readdir", "lookup", "rename", "access", "listxattr", "mkdir", "rmdir",
+]
+# Number of log2 latency buckets, see HIST_SLOTS in nfsops.c.
+# Bucket `i` holds calls that took less than 2^i usecs, the last one also holds all slower calls.
+HIST_SLOTS = 32
+# Maps the probes update for every value of `counts_active` when built with DOUBLE_BUFFER.
+COUNTS_TABLES = ("counts", "counts_alt")
+HISTS_TABLES = ("hists", "hists_alt")
+# Time for in-flight probes to complete their update after the active maps are swapped.
+SWAP_GRACE_PERIOD = 0.01
+# Maps with failed inserts tracked by the `drops` map, in the order of `enum drop_t` in nfsops.c.
+DROP_MAPS = ["counts", "starts"]
+# Index of DROP_SLOW_OPS in `enum drop_t`, slow calls dropped by the rate limit or a full ring buffer.
+SLOW_OPS_DROP = len(DROP_MAPS)
+# Index of DROP_EXECS in `enum drop_t`, exec events lost because the ring buffer was full.
+EXECS_DROP = SLOW_OPS_DROP + 1
+# Indexes of `enum start_event_t` in nfsops.c, starts inserted by entry probes and taken by return probes.
+STARTS_INSERTED, STARTS_TAKEN = range(2)
+# Map sizes grown by --map-autosize, applied on the next start.
+MAP_SIZES_STATE = "map_sizes.json"
+# Columns of the cgroup attribution, see CgroupsMap.
+CGROUP_COLUMNS = ["CGROUP", "NAMESPACE", "POD", "CONTAINER"]
+# Kubelet keeps the logs of every pod of the node in <namespace>_<name>_<uid> directories.
+PODS_LOG_DIR = "/var/log/pods"
+# Number of intervals in a row a map has to be filled above the threshold to be grown.
+AUTOSIZE_INTERVALS = 3
+
+
+def column_op(column):
+    """Operation of a STATKEYS or HISTKEYS column, e.g. "read" for READ_BYTES."""
+    return column.rpartition("_")[0].lower()
+
+
+def op_columns(columns, ops=None):
+    """The columns of the given operations, all columns when ops is None."""
+    return [column for column in columns if ops is None or column_op(column) in ops]
+
+
+def hist_upper_bounds():
+    """Upper bound (in seconds) of every latency histogram bucket."""
+    return [2 ** slot / 1000000 for slot in range(HIST_SLOTS)]
+
+
 def nstosec(val_in_ns):
     return float(val_in_ns) / 1000000000
 
 
+# NumPy mirrors of the BPF map structs in nfsops.c. Field order, sizes and
+# padding must match the C definitions byte for byte.
+STAT_T_DTYPE = numpy.dtype([         # struct stat_t (packed)
+    ("count", "<u8"),
+    ("duration", "<u8"),
+    ("errors", "<u4"),
+])
+STATS_T_DTYPE = numpy.dtype([        # struct stats_t
+    ("open", STAT_T_DTYPE),
+    ("close", STAT_T_DTYPE),
+    ("setattr", STAT_T_DTYPE),
+    ("getattr", STAT_T_DTYPE),
+    ("flush", STAT_T_DTYPE),
+    ("mmap", STAT_T_DTYPE),
+    ("fsync", STAT_T_DTYPE),
+    ("lock", STAT_T_DTYPE),
+    ("read", STAT_T_DTYPE),
+    ("rbytes", "<u8"),
+    ("write", STAT_T_DTYPE),
+    ("wbytes", "<u8"),
+    ("create", STAT_T_DTYPE),
+    ("link", STAT_T_DTYPE),
+    ("unlink", STAT_T_DTYPE),
+    ("symlink", STAT_T_DTYPE),
+    ("readdir", STAT_T_DTYPE),
+    ("lookup", STAT_T_DTYPE),
+    ("rename", STAT_T_DTYPE),
+    ("access", STAT_T_DTYPE),
+    ("listxattr", STAT_T_DTYPE),
+    ("mkdir", STAT_T_DTYPE),
+    ("rmdir", STAT_T_DTYPE),
+], align=True)
+INFO_T_FIELDS = [                    # struct info_t
+    ("cgroup", "<u8"),               # added with KEY_CGROUP
+    ("tgid", "<u4"),                 # dropped with DROP_KEY_TGID
+    ("uid", "<u4"),                  # dropped with DROP_KEY_UID
+    ("mntns", "<u4"),                # added with KEY_MNTNS
+    ("comm", "S16"),                 # TASK_COMM_LEN
+    ("sbdev", "<u4"),
+]
+
+
+def key_fields(args: argparse.Namespace) -> list:
+    """
+    Fields of the `info_t` map key for the configuration.
+    Fields user space aggregates away anyway are left out of the key, which keeps
+    the number of map entries down.
+    """
+    fields = []
+    # tags are resolved per tgid, so it is needed whenever envs are tracked
+    if not args.squash_pid or args.envs or args.envs_from_vdb_schema:
+        fields.append("tgid")
+    if not args.squash_uid:
+        fields.append("uid")
+    fields += ["comm", "sbdev"]
+    # stats are attributed to pods and containers by cgroup, which can stand in for tgid
+    if args.cgroup:
+        fields.insert(0, "cgroup")
+    # mounts are resolved in the mount namespace of the caller
+    if args.mount_ns:
+        fields.insert(fields.index("comm"), "mntns")
+    return fields
+
+
+def load_map_sizes(args: argparse.Namespace):
+    """Apply the map sizes grown by --map-autosize in a previous run to the configuration."""
+    try:
+        sizes = json.loads(Path(args.state_dir, MAP_SIZES_STATE).read_text())
+    except (OSError, ValueError):
+        return
+    for name in DROP_MAPS:
+        option = f"{name}_map_size"
+        if sizes.get(name, 0) > getattr(args, option):
+            logger.info(f"Using the {name} map size of {sizes[name]} entries grown in a previous run.")
+            setattr(args, option, sizes[name])
+
+
+def info_t_dtype(fields: list) -> numpy.dtype:
+    """Dtype of `struct info_t` with the given key fields."""
+    return numpy.dtype([field for field in INFO_T_FIELDS if field[0] in fields], align=True)
+
+
+def hist_key_t_dtype(info_dtype: numpy.dtype) -> numpy.dtype:
+    """Dtype of `struct hist_key_t` for the given `info_t` dtype."""
+    return numpy.dtype([
+        ("info", info_dtype),
+        ("op", "<u4"),
+        ("slot", "<u4"),
+    ], align=True)
+
+
+# the default key, without the optional cgroup and mntns
+INFO_T_DTYPE = info_t_dtype([name for name, _ in INFO_T_FIELDS if name not in ("cgroup", "mntns")])
+HIST_KEY_T_DTYPE = hist_key_t_dtype(INFO_T_DTYPE)
+
+# Length of the tracked env prefixes and captured envs, see ENV_PREFIX_LEN and ENV_LEN in nfsops.c.
+ENV_PREFIX_LEN = 32
+ENV_LEN = 128
+# Number of captured envs, see EXEC_ENVS_MAX in nfsops.c.
+EXEC_ENVS_MAX = 4
+
+# Process events, in the order of `enum task_event_type_t` in nfsops.c.
+TASK_EXEC, TASK_FORK, TASK_EXIT = range(3)
+
+PIDINFO_T_DTYPE = numpy.dtype([      # struct pidinfo_t with EXEC_ENVS
+    ("pid", "<u4"),
+    ("type", "<u4"),
+    ("ppid", "<u4"),
+    ("nenvs", "<u4"),
+    ("complete", "<u4"),
+    ("envs", f"S{ENV_LEN}", EXEC_ENVS_MAX),
+], align=True)
+
+SLOW_OP_T_DTYPE = numpy.dtype([      # struct slow_op_t
+    ("ts", "<u8"),
+    ("latency", "<u8"),
+    ("ino", "<u8"),
+    ("tgid", "<u4"),
+    ("sbdev", "<u4"),
+    ("op", "<u4"),
+    ("comm", "S16"),                 # TASK_COMM_LEN
+], align=True)
+
+
+def _statkey_field(key):
+    """Map STATKEYS column to (stats_t member, stat_t member or None for plain counters)."""
+    op, _, kind = key.rpartition("_")
+    if kind == "BYTES":
+        return ("rbytes" if op == "READ" else "wbytes"), None
+    return op.lower(), kind.lower()
+
+
+STATKEYS_FIELDS = {key: _statkey_field(key) for key in STATKEYS}
+
+
+def decode_counts(keys: numpy.ndarray, values: numpy.ndarray, ops: list = None) -> dict:
+    """
+    Build statistics columns from the raw `counts` map entries.
+    `keys` and `values` are structured arrays of an `info_t` dtype and STATS_T_DTYPE.
+    Returns a dict of column name -> numpy array with PID, UID, COMM and the STATKEYS
+    columns of `ops` (all of them by default). Durations are converted from nanoseconds
+    to seconds. PID and UID are 0 when left out of the key.
+    """
+    zeros = numpy.zeros(len(keys), dtype=numpy.int64)
+    columns = {
+        # real pid is the thread-group id
+        "PID": keys["tgid"].astype(numpy.int64) if "tgid" in keys.dtype.names else zeros,
+        "UID": keys["uid"].astype(numpy.int64) if "uid" in keys.dtype.names else zeros,
+    }
+    # comm is a NUL terminated C string; decode each distinct value once.
+    comms, inverse = numpy.unique(keys["comm"], return_inverse=True)
+    decoded = numpy.array(
+        [c.split(b"\0", 1)[0].decode("utf-8", "replace") for c in comms], dtype=object
+    )
+    columns["COMM"] = decoded[inverse]
+    for key in op_columns(STATKEYS, ops):
+        member, field = STATKEYS_FIELDS[key]
+        column = values[member] if field is None else values[member][field]
+        if field == "duration":
+            columns[key] = column / 1e9
+        else:
+            columns[key] = column.astype(numpy.int64)
+    return columns
+
+
+def reduce_percpu(values: numpy.ndarray) -> numpy.ndarray:
+    """Sum per-CPU STATS_T_DTYPE values of shape (entries, cpus) into one value per entry."""
+    reduced = numpy.zeros(len(values), dtype=STATS_T_DTYPE)
+    for member in STATS_T_DTYPE.names:
+        if STATS_T_DTYPE[member].names:
+            for field in STAT_T_DTYPE.names:
+                reduced[member][field] = values[member][field].sum(axis=1)
+        else:
+            reduced[member] = values[member].sum(axis=1)
+    return reduced
+
+
+def decode_hists(
+    keys: numpy.ndarray, hist_keys: numpy.ndarray, hist_values: numpy.ndarray, ops: list = None
+) -> dict:
+    """
+    Build latency histogram columns from the raw `hists` map entries.
+    Every histogram entry is matched with its `counts` entry in `keys` by the `info_t` key.
+    Returns a dict of HISTKEYS column of `ops` (all of them by default) -> object array
+    holding one HIST_SLOTS long numpy array per row of `keys`.
+    """
+    n = len(keys)
+    void = numpy.dtype((numpy.void, keys.dtype.itemsize))
+    infos = numpy.concatenate([
+        numpy.ascontiguousarray(keys).view(void),
+        numpy.ascontiguousarray(hist_keys["info"]).view(void),
+    ])
+    uniques, inverse = numpy.unique(infos, return_inverse=True)
+    rows = numpy.full(len(uniques), -1)
+    rows[inverse[:n]] = numpy.arange(n)
+    hist_rows = rows[inverse[n:]]
+    # histogram samples landed after the `counts` map was drained are dropped
+    valid = (hist_rows >= 0) & (hist_keys["op"] < len(OPS)) & (hist_keys["slot"] < HIST_SLOTS)
+
+    hists = numpy.zeros((len(OPS), n, HIST_SLOTS), dtype=numpy.uint64)
+    numpy.add.at(
+        hists,
+        (hist_keys["op"][valid], hist_rows[valid], hist_keys["slot"][valid]),
+        hist_values[valid],
+    )
+    columns = {}
+    for key in op_columns(HISTKEYS, ops):
+        column = numpy.empty(n, dtype=object)
+        column[:] = list(hists[OPS.index(column_op(key))])
+        columns[key] = column
+    return columns
+
+
+def group_index(data: pd.DataFrame, group_fields: list) -> numpy.ndarray:
+    """
+    Group number of every row, groups numbered in the sorted order of their keys.
+    Every group field is factorized once, the groups are numbered on the codes.
+    """
+    codes, sizes = [], []
+    for field in group_fields:
+        field_codes, uniques = pd.factorize(data[field], sort=True)
+        codes.append(field_codes)
+        sizes.append(max(len(uniques), 1))
+    if numpy.prod(sizes, dtype=float) < 2**62:
+        keys = numpy.ravel_multi_index(codes, sizes)
+    else:
+        keys = numpy.stack(codes, axis=1)
+    _, groups = numpy.unique(keys, axis=0 if keys.ndim > 1 else None, return_inverse=True)
+    return groups.reshape(-1)
+
+
 def group_stats(data: pd.DataFrame, group_fields: list):
     """
-    Group dataframe by provided group fields.
-    Aggregates using sum for statistical columns and last for other columns.
+    Group dataframe by provided group fields, in the sorted order of the group keys.
+    Aggregates using sum for statistical columns and the value of the last row of the
+    group for other columns.
     Lest say we have dataframe of 4 rows:
     [
         {'PID': 1, 'MOUNT': '/mnt', 'COMM': 'ls' ...
@@ -142,32 +594,52 @@ def group_stats(data: pd.DataFrame, group_fields: list):
         ls    1           0  ...  47fcdb40cfb7  1000    {}
         ls    2           0  ...  47fcdb40cfb7  1000    {}
     """
-    # Define aggregation functions for statistical fields
-    agg_funcs = {col: "sum" for col in STATKEYS.keys()}
-    # Define aggregation functions for non-statistical fields
-    agg_funcs.update(
-        {
-            col: "last"
-            for col in data.columns
-            if col not in STATKEYS and col not in group_fields
-        }
-    )
-    # Aggregate DataFrame
-    return data.groupby(group_fields).agg(agg_funcs).reset_index()
+    sums = [col for col in STATKEYS if col in data.columns]
+    # Latency histograms are summed bucket by bucket
+    hists = [col for col in HISTKEYS if col in data.columns]
+    lasts = [col for col in data.columns if col not in sums and col not in hists and col not in group_fields]
+    # rows with a missing key belong to no group, as with DataFrame.groupby
+    if data[group_fields].isna().to_numpy().any():
+        data = data.dropna(subset=group_fields)
+    if data.empty:
+        return data[group_fields + sums + hists + lasts].reset_index(drop=True)
+
+    # Every statistic is scattered into its group with one unbuffered add, in place of
+    # a sort of the rows. The other columns take the last row of the group.
+    groups = group_index(data, group_fields)
+    count = groups.max() + 1
+    last = numpy.full(count, -1)
+    numpy.maximum.at(last, groups, numpy.arange(len(groups)))
+
+    columns = {}
+    for col in sums:
+        values = data[col].to_numpy()
+        columns[col] = numpy.zeros(count, dtype=values.dtype)
+        numpy.add.at(columns[col], groups, values)
+    for col in hists:
+        values = numpy.stack(data[col].to_numpy())
+        reduced = numpy.zeros((count, values.shape[1]), dtype=values.dtype)
+        numpy.add.at(reduced, groups, values)
+        columns[col] = numpy.empty(count, dtype=object)
+        columns[col][:] = list(reduced)
+    # key and other columns are taken from the last row of every group, with their dtypes
+    return pd.concat([
+        data[group_fields].take(last).reset_index(drop=True),
+        pd.DataFrame({col: columns[col] for col in sums + hists}),
+        data[lasts].take(last).reset_index(drop=True),
+    ], axis=1)
 
 
-def filter_stats(data: pd.DataFrame, filter_tags: list, filter_condition: str):
+def match_tags(tags: dict, filter_tags: list, filter_condition: str) -> bool:
     """
-    Filter statistics based on tags.
+    Whether the tags pass the filter condition.
     """
     if filter_condition == "any":
         # Verifies if any of the filter tags are present in the TAGS dictionary
-        # and filters the DataFrame accordingly.
-        return data[data["TAGS"].apply(lambda tags: any(filter_tag in tags for filter_tag in filter_tags))]
+        return any(filter_tag in tags for filter_tag in filter_tags)
     elif filter_condition == "all":
         # Verifies if all the filter tags are present in the TAGS dictionary
-        # and filters the DataFrame based on this condition.
-        return data[data["TAGS"].apply(lambda tags: all(filter_tag in tags for filter_tag in filter_tags))]
+        return all(filter_tag in tags for filter_tag in filter_tags)
     else:
         raise NotImplementedError(f"Filter condition {filter_condition} is not implemented.")
 
@@ -190,12 +662,9 @@ def anonymize_stats(data: pd.DataFrame, anon_fields: list):
 
     return data
 
-def get_pid_envs(pid, envs):
+def match_envs(environ, envs):
+    """Return {name: value} of the `environ` entries ("name=value") starting with any of the `envs` prefixes."""
     res = {}
-    try:
-        environ = open("/proc/%d/environ" % pid).read().split('\x00')[:-1]
-    except:
-        return res
 
     def match(envs, env):
         for e in envs:
@@ -209,18 +678,139 @@ def get_pid_envs(pid, envs):
         pass
     return res
 
+
+def get_pid_envs(pid, envs):
+    try:
+        environ = open("/proc/%d/environ" % pid).read().split('\x00')[:-1]
+    except:
+        return {}
+    return match_envs(environ, envs)
+
+# Bits of the minor number in the in-kernel dev_t (super_block.s_dev) encoding.
+MINORBITS = 20
+
+
+def kernel_devt(devt):
+    """Convert a "<major>:<minor>" device string to the in-kernel dev_t encoding."""
+    major, minor = map(int, devt.split(":"))
+    return major << MINORBITS | minor
+
+
 class MountInfo:
 
     def __init__(self, mountpoint, device):
         self.mountpoint = mountpoint
         self.device = device  # <ip>:/<path>
-
-    @property
-    def remote_path(self):
+        # parsed once, it is reported for every row of the mount
         match = re.search(r".*:(/.*)$", self.device)
+        self.remote_path = match.group(1) if match else ""
+
+    def matches(self, patterns):
+        """Whether the mountpoint, device or remote path matches any of the glob patterns."""
+        return any(
+            fnmatch(self.mountpoint, pattern) or fnmatch(self.device, pattern) or fnmatch(self.remote_path, pattern)
+            for pattern in patterns
+        )
+
+
+class CgroupInfo:
+
+    def __init__(self, path, pods=None):
+        self.path = path
+        self.pod_uid = ""
+        self.container = ""
+        # kubepods-burstable-pod<uid>.slice with the systemd cgroup driver (dashes of
+        # the uid turned into underscores), kubepods/burstable/pod<uid> with cgroupfs
+        match = re.search(r"pod([0-9a-f]{8}[-_][0-9a-f]{4}[-_][0-9a-f]{4}[-_][0-9a-f]{4}[-_][0-9a-f]{12})", path)
         if match:
-            return match.group(1)
-        return ""
+            self.pod_uid = match.group(1).replace("_", "-")
+        # cri-containerd-<id>.scope, crio-<id>.scope, docker-<id>.scope or just <id>
+        match = re.search(r"(?:^|/|-)([0-9a-f]{64})(?:\.scope)?$", path)
+        if match:
+            self.container = match.group(1)
+        self.namespace, self.pod = (pods or {}).get(self.pod_uid, ("", ""))
+
+
+def cgroup2_root():
+    """Mountpoint of the cgroup v2 hierarchy, whose ids bpf_get_current_cgroup_id() returns."""
+    if Path("/sys/fs/cgroup/cgroup.controllers").exists():
+        return "/sys/fs/cgroup"
+    # hybrid cgroup v1/v2 hosts
+    return "/sys/fs/cgroup/unified"
+
+
+class CgroupsMap:
+    """
+    Map of cgroup ids to their path and Kubernetes pod attribution.
+    The cgroup hierarchy is walked once and again only when an unknown id shows up,
+    ids of cgroups removed before they were seen are remembered as unknown.
+    """
+    def __init__(self, root=None, pods_dir=PODS_LOG_DIR):
+        self.root = root or cgroup2_root()
+        self.pods_dir = pods_dir
+        self.map = {}
+        self.unknown = set()
+        self.pods = {}
+        self.refresh_map()
+
+    def walk(self):
+        """Return {cgroup id: path} of the cgroup hierarchy, the id being the inode of the directory."""
+        try:
+            cgroups = {os.stat(self.root).st_ino: "/"}
+        except OSError as e:
+            logger.warning(f"Failed to read the cgroup hierarchy at {self.root}: {e}")
+            return {}
+        dirs = [(self.root, "")]
+        while dirs:
+            path, cgroup = dirs.pop()
+            try:
+                with os.scandir(path) as it:
+                    for entry in it:
+                        if entry.is_dir(follow_symlinks=False):
+                            cgroups[entry.inode()] = f"{cgroup}/{entry.name}"
+                            dirs.append((entry.path, f"{cgroup}/{entry.name}"))
+            except OSError:
+                # removed while walking
+                continue
+        return cgroups
+
+    def refresh_pods(self):
+        try:
+            names = os.listdir(self.pods_dir)
+        except OSError:
+            return
+        for name in names:
+            parts = name.split("_")
+            if len(parts) == 3:
+                self.pods[parts[2]] = (parts[0], parts[1])
+
+    def refresh_map(self):
+        cgroups = self.walk()
+        infos = {cgroup_id: CgroupInfo(path, self.pods) for cgroup_id, path in cgroups.items()}
+        if any(info.pod_uid and not info.pod for info in infos.values()):
+            self.refresh_pods()
+            infos = {cgroup_id: CgroupInfo(path, self.pods) for cgroup_id, path in cgroups.items()}
+        self.map = infos
+        self.unknown = set()
+        logger.debug(f"CgroupsMap: {len(self.map)} cgroups")
+
+    def get_cgroups(self, cgroup_ids):
+        """Return the CgroupInfo (None when unknown) of every id, walking the hierarchy once for new ids."""
+        new = [cgroup_id for cgroup_id in cgroup_ids if cgroup_id not in self.map and cgroup_id not in self.unknown]
+        if new:
+            unknown = self.unknown
+            self.refresh_map()
+            self.unknown = unknown.union(cgroup_id for cgroup_id in new if cgroup_id not in self.map)
+        return [self.map.get(cgroup_id) for cgroup_id in cgroup_ids]
+
+    def columns(self, cgroup_ids: numpy.ndarray) -> dict:
+        """Build the CGROUP_COLUMNS columns for the cgroup ids, resolving every distinct id once."""
+        ids, inverse = numpy.unique(cgroup_ids, return_inverse=True)
+        infos = self.get_cgroups(ids.tolist())
+        return {
+            column: numpy.array([getattr(info, attr) if info else "" for info in infos], dtype=object)[inverse]
+            for column, attr in zip(CGROUP_COLUMNS, ["path", "namespace", "pod", "container"])
+        }
 
 
 class MutableEnvsMixin:
@@ -238,24 +828,64 @@ class MutableEnvsMixin:
         self._args.envs = value
 
 
+class MountNamespace:
+    """NFS mounts of another mount namespace, read through the mountinfo of one of its processes."""
+
+    def __init__(self, mountinfo, mounts):
+        # kept open to be told about mount table changes, it holds the namespace
+        self.mountinfo = mountinfo
+        self.mounts = mounts
+        self.seen = time.monotonic()
+
+
+def mount_ns(pid="self"):
+    """Inode of the mount namespace of pid, as `task->nsproxy->mnt_ns->ns.inum`."""
+    return os.stat(f"/proc/{pid}/ns/mnt").st_ino
+
+
 class MountsMap:
-    def __init__(self, vaccum_interval=600):
-        self.map = {}
+    """
+    Index of the NFS mounts by devt. The index is rebuilt from our mountinfo only when
+    the kernel flags a mount table change, mounts of other mount namespaces are added
+    from the mountinfo of their processes as they show up. Devts no mount is found for
+    are remembered for `negative_ttl` seconds, so they are not looked up over and over.
+    With the mount namespace of the caller known (see KEY_MNTNS), every other namespace
+    has its own index, read once through one of its processes and rebuilt on change.
+    """
+    def __init__(self, vaccum_interval=600, negative_ttl=60):
         self.vaccum_interval = vaccum_interval
-        self.start = datetime.now()
-        self.refresh_map_mountinfo()
+        self.negative_ttl = negative_ttl
+        self.lock = Lock()
+        # the kernel flags mount table changes with POLLPRI on any open mountinfo file
+        self.mountinfo = open(self.get_mountinfo("self"))
+        self.poller = select.poll()
+        self.poller.register(self.mountinfo, select.POLLPRI)
+        self.rebuild()
+        self.mntns = mount_ns()
+        # mount namespace inode -> MountNamespace, their mountinfo fds are polled together
+        self.namespaces = {}
+        self.ns_fds = {}
+        self.ns_poller = select.poll()
+        # mount namespace inode -> time.monotonic() a process of it is looked for again at
+        self.unresolved_ns = {}
 
     def get_mountinfo(self, pid):
         return f"/proc/{pid}/mountinfo"
 
-    def refresh_map_mountinfo(self, pid="self"):
+    def parse_mountinfo(self, pid="self"):
+        """Return the NFS mounts in the mountinfo of pid, as a {devt: MountInfo} dict."""
         try:
             mounts = open(self.get_mountinfo(pid)).readlines()
         except:
             # pid is gone... open our mountinfo proc file
             logger.debug(f"MountsMap: pid: {pid} is gone...")
             mounts = open(self.get_mountinfo("self")).readlines()
+        return self.nfs_mounts(mounts)
 
+    @staticmethod
+    def nfs_mounts(mounts):
+        """Return the NFS mounts of mountinfo lines, as a {devt: MountInfo} dict."""
+        nfs_mounts = {}
         for mount in mounts:
             parts = mount.split()
             devt = parts[2]
@@ -264,36 +894,266 @@ class MountsMap:
             device = parts[parts.index("-") + 2]
             if 'nfs' not in fstype:
                 continue
-            self.map[devt] = MountInfo(mountpoint, device)
+            nfs_mounts[devt] = MountInfo(mountpoint, device)
+        return nfs_mounts
 
-    def refresh_map(self):
-        for p in psutil.disk_partitions(all=True):
-            if 'nfs' not in p.fstype:
-                continue
-            devt = self.devt_to_str(os.stat(p.mountpoint).st_dev)
-            self.map[devt] = MountInfo(p.mountpoint, p.device)
+    def rebuild(self):
+        """Rebuild the index from our mountinfo, dropping the mounts of other namespaces and unresolved devts."""
+        # our NFS mounts
+        self.mounts = self.parse_mountinfo()
+        self.map = dict(self.mounts)
+        # devt -> time.monotonic() the devt is looked up again at
+        self.unresolved = {}
+        self.start = datetime.now()
+        logger.debug(f"MountsMap: rebuilt with {len(self.mounts)} NFS mounts")
+
+    def refresh(self):
+        """Rebuild the index if the mount table changed since, return our NFS mounts."""
+        with self.lock:
+            if self.poller.poll(0):
+                self.rebuild()
+            return self.mounts
 
     def devt_to_str(self, st_dev):
-        MINORBITS = 20
         return "{}:{}".format(st_dev >> MINORBITS, st_dev & 2**MINORBITS-1)
 
     def get_mountpoint(self, st_dev, pid="self"):
         dev = self.devt_to_str(st_dev)
-        try:
-            return self.map[dev]
-        except KeyError:
+        self.refresh()
+        with self.lock:
+            mount_info = self.map.get(dev)
+            if mount_info or time.monotonic() < self.unresolved.get(dev, 0):
+                return mount_info
             if (datetime.now() - self.start).total_seconds() > self.vaccum_interval:
-                self.map = {}
-                self.start = datetime.now()
-            # refresh our view on the mountinfo map
-            self.refresh_map_mountinfo(pid)
-            if dev in self.map.keys():
-                return self.map[dev]
-            self.refresh_map()
-            if dev in self.map.keys():
+                # mounts of other namespaces may have been replaced since
+                self.rebuild()
+            if pid != "self":
+                # mounted in the mount namespace of the process only
+                self.map.update(self.parse_mountinfo(pid))
+            if dev in self.map:
                 return self.map[dev]
+            self.unresolved[dev] = time.monotonic() + self.negative_ttl
         logger.warning("No mountpoint found for devt {}".format(dev))
 
+    def ns_pids(self, mntns, pid=None):
+        """Yield the pids in the mount namespace, pid first if it is still in it."""
+        pids = psutil.pids()
+        if pid is not None:
+            pids = [pid] + [p for p in pids if p != pid]
+        for pid in pids:
+            try:
+                if mount_ns(pid) == mntns:
+                    yield pid
+            except OSError:
+                continue
+
+    def open_namespace(self, mntns, pid=None):
+        """Read the mounts of the namespace through pid, or any other process of it."""
+        for pid in self.ns_pids(mntns, pid):
+            try:
+                mountinfo = open(self.get_mountinfo(pid))
+                mounts = self.nfs_mounts(mountinfo.readlines())
+            except OSError:
+                # the process exited since, try the next one of the namespace
+                continue
+            namespace = MountNamespace(mountinfo, mounts)
+            self.namespaces[mntns] = namespace
+            self.ns_fds[mountinfo.fileno()] = mntns
+            self.ns_poller.register(mountinfo, select.POLLPRI)
+            logger.debug(f"MountsMap: mount namespace {mntns} read through pid {pid}")
+            return namespace
+        return None
+
+    def close_namespace(self, mntns):
+        namespace = self.namespaces.pop(mntns)
+        self.ns_poller.unregister(namespace.mountinfo)
+        del self.ns_fds[namespace.mountinfo.fileno()]
+        namespace.mountinfo.close()
+
+    def refresh_namespaces(self):
+        """
+        Re-read the mounts of the namespaces whose mount table changed and close the
+        namespaces not looked up for `vaccum_interval`, which lets the kernel free them.
+        """
+        with self.lock:
+            for fd, _ in self.ns_poller.poll(0):
+                namespace = self.namespaces[self.ns_fds[fd]]
+                namespace.mountinfo.seek(0)
+                namespace.mounts = self.nfs_mounts(namespace.mountinfo.readlines())
+            now = time.monotonic()
+            for mntns in [mntns for mntns, ns in self.namespaces.items() if now - ns.seen > self.vaccum_interval]:
+                self.close_namespace(mntns)
+
+    def get_ns_mountpoint(self, st_dev, mntns, pid=None):
+        """Return the mount of devt in the mount namespace, pid is a process in it if known."""
+        if mntns == self.mntns:
+            return self.get_mountpoint(st_dev)
+        with self.lock:
+            namespace = self.namespaces.get(mntns)
+            if namespace is None:
+                if time.monotonic() < self.unresolved_ns.get(mntns, 0):
+                    return None
+                namespace = self.open_namespace(mntns, pid)
+                if namespace is None:
+                    self.unresolved_ns[mntns] = time.monotonic() + self.negative_ttl
+                    logger.warning(f"No process found in mount namespace {mntns}")
+                    return None
+            namespace.seen = time.monotonic()
+            return namespace.mounts.get(self.devt_to_str(st_dev))
+
+class MountWatcher:
+    """
+    Watcher of the mount table, keeping the collector probes attached only while
+    NFS mounts exist.
+    """
+    def __init__(self, collector, mounts_map, poll_timeout=10):
+        self.collector = collector
+        self.mounts_map = mounts_map
+        self.poll_timeout = poll_timeout
+
+    def start(self):
+        self.t = Thread(target=self.watch)
+        self.t.daemon = True
+        self.t.start()
+
+    def check(self):
+        """Attach or detach the probes by whether NFS mounts exist."""
+        mounts = self.mounts_map.refresh()
+        action = None
+        try:
+            if mounts and not self.collector.active:
+                action = "Attaching StatsCollector"
+                self.collector.attach()
+                logger.info(f"{len(mounts)} NFS mounts found, StatsCollector has been attached.")
+            elif not mounts and self.collector.active:
+                action = "Detaching StatsCollector"
+                self.collector.detach()
+                logger.info("No NFS mounts left, StatsCollector has been detached.")
+            elif mounts and self.collector.mount_filter:
+                action = "Updating the mount filter"
+                self.collector.update_mount_filter()
+        except Exception as e:
+            # retried on the next mount table change or poll timeout
+            logger.error(f"{action} failed: {e}")
+
+    def watch(self):
+        # the kernel flags mount table changes with POLLPRI on any open mountinfo file
+        with open(self.mounts_map.get_mountinfo("self")) as f:
+            poller = select.poll()
+            poller.register(f, select.POLLPRI)
+            while True:
+                if poller.poll(self.poll_timeout * 1000):
+                    # reading the file acknowledges the change
+                    f.seek(0)
+                    f.read()
+                self.check()
+
+
+class RingBuffers:
+    """
+    Consumer of the BPF ring buffers. BCC polls all the ring buffers of a BPF program
+    together, so a single thread consumes them and runs the batch callbacks of their
+    tracers after every poll.
+    """
+    def __init__(self, bpf, timeout=1000):
+        self.b = bpf
+        self.timeout = timeout
+        self.batch_callbacks = []
+        self.t = None
+
+    def open(self, name, callback, batch_callback=None):
+        self.b[name].open_ring_buffer(callback)
+        if batch_callback:
+            self.batch_callbacks.append(batch_callback)
+
+    def start(self):
+        if self.t:
+            return
+        self.t = Thread(target=self.poll)
+        self.t.daemon = True
+        self.t.start()
+
+    def poll(self):
+        while True:
+            try:
+                self.b.ring_buffer_poll(self.timeout)
+                for batch_callback in self.batch_callbacks:
+                    batch_callback()
+            except Exception as e:
+                # a failing callback must not stop the event processing
+                logger.error(f"Handling ring buffer events failed: {e}")
+
+
+class SlowOpsTracer:
+    """
+    Consumer of the `slow_ops` ring buffer: NFS calls slower than the --slow-ops
+    latency threshold of their operation, batched until drained every interval.
+    """
+    def __init__(self, _args, bpf, mounts_map, ring_buffers):
+        self.b = bpf
+        self.mounts_map = mounts_map
+        self.ring_buffers = ring_buffers
+        self.thresholds = _args.slow_ops
+        self.hostname = os.getenv("HOSTNAME", socket.gethostname())
+        self.lock = Lock()
+        self.events = bytearray()
+        self.drops_total = 0
+        # self-metrics of the last interval, see SELFKEYS
+        self.metrics = {}
+
+    def start(self):
+        self.update_thresholds()
+        self.ring_buffers.open("slow_ops", self.handle_event)
+        self.ring_buffers.start()
+
+    def update_thresholds(self):
+        """Set the in-kernel latency threshold of every operation given in --slow-ops."""
+        table = self.b.get_table("slow_op_thresholds")
+        for op, msecs in self.thresholds.items():
+            table[OPS.index(op)] = table.Leaf(int(msecs * 1000000))
+
+    def handle_event(self, ctx, data, size):
+        with self.lock:
+            self.events += ctypes.string_at(data, SLOW_OP_T_DTYPE.itemsize)
+
+    def drain(self, anon_fields=None) -> pd.DataFrame:
+        """Return the slow calls reported since the last call, one row per call."""
+        with self.lock:
+            raw, self.events = bytes(self.events), bytearray()
+        events = numpy.frombuffer(raw, dtype=SLOW_OP_T_DTYPE)
+
+        total = self.b.get_table("drops").sum(SLOW_OPS_DROP).value
+        dropped, self.drops_total = total - self.drops_total, total
+        self.metrics = {"SLOW_OPS_EVENTS": len(events), "SLOW_OPS_DROPS": dropped}
+        if dropped:
+            logger.warning(f"{dropped} slow NFS calls not reported, --slow-ops-rate exceeded.")
+        if not len(events):
+            return pd.DataFrame()
+
+        # event times are CLOCK_MONOTONIC, as bpf_ktime_get_ns()
+        boot = time.time_ns() - time.monotonic_ns()
+        df = pd.DataFrame({
+            "TIMESTAMP": pd.to_datetime(events["ts"].astype(numpy.int64) + boot, utc=True),
+            "HOSTNAME": self.hostname,
+            "PID": events["tgid"].astype(numpy.int64),
+            "COMM": [c.split(b"\0", 1)[0].decode("utf-8", "replace") for c in events["comm"]],
+            "OP": [OPS[op].upper() if op < len(OPS) else "" for op in events["op"].tolist()],
+            "LATENCY": events["latency"] / 1e9,
+            "INODE": events["ino"].astype(numpy.int64),
+        })
+        # every mount is resolved once
+        sbdevs = events["sbdev"].tolist()
+        mounts = {}
+        for sbdev, tgid in zip(sbdevs, events["tgid"].tolist()):
+            if sbdev not in mounts:
+                mounts[sbdev] = self.mounts_map.get_mountpoint(sbdev, tgid)
+        df["MOUNT"] = [mounts[sbdev].mountpoint if mounts[sbdev] else "" for sbdev in sbdevs]
+        df["REMOTE_PATH"] = [mounts[sbdev].remote_path if mounts[sbdev] else "" for sbdev in sbdevs]
+        if anon_fields:
+            df = anonymize_stats(df, [field for field in anon_fields if field in df.columns])
+        return df
+
+
 class PidEnvMap:
     """
     Map interface of pid and the dictionary of the tracked environment
@@ -303,11 +1163,16 @@ class PidEnvMap:
         self.pidmap = {}
         self.vaccum_interval = vaccum_interval
         self.start = datetime.now()
+        # pids of the exited processes, evicted once their last stats are collected
+        self.exited = set()
+        self.lock = Lock()
 
     def vaccum(self):
-        for pid in list(self.pidmap):
-            if not Path("/proc/%s/environ" % pid).exists():
-                del self.pidmap[pid]
+        # exited pids are evicted by the sampler thread as well
+        with self.lock:
+            for pid in list(self.pidmap):
+                if not Path("/proc/%s/environ" % pid).exists():
+                    self.pidmap.pop(pid, None)
         self.start = datetime.now()
         logger.debug("PidEnvMap: vaccumed...")
         logger.debug(self.pidmap)
@@ -315,12 +1180,39 @@ class PidEnvMap:
     def vaccum_if_needed(self):
         if (datetime.now() - self.start).total_seconds() > self.vaccum_interval:
             self.vaccum()
+            return True
+        return False
 
     def insert(self, pid, envs):
-        self.pidmap[str(pid)] = envs
+        with self.lock:
+            self.pidmap[str(pid)] = envs
+            # the pid was reused
+            self.exited.discard(str(pid))
         logger.debug("PidEnvMap: insert pid[%d]" % pid)
         logger.debug(self.pidmap)
 
+    def fork(self, pid, ppid):
+        """The forked child inherits the tracked envs of its parent until it execs."""
+        envs = self.pidmap.get(str(ppid))
+        if envs is not None:
+            self.insert(pid, envs)
+
+    def exit(self, pid):
+        with self.lock:
+            if str(pid) in self.pidmap:
+                self.exited.add(str(pid))
+
+    def exited_pids(self):
+        with self.lock:
+            return set(self.exited)
+
+    def evict(self, pids):
+        """Evict the given exited pids, unless they were reused since."""
+        with self.lock:
+            for pid in pids & self.exited:
+                self.exited.discard(pid)
+                self.pidmap.pop(pid, None)
+
     def get(self, pid, envs=None):
         try:
             return self.pidmap[str(pid)]
@@ -339,31 +1231,171 @@ class EnvTracer(MutableEnvsMixin):
     Tracer traps pid execution and collects the existance of the tracked
     environment variables.
     """
-    def __init__(self, _args, bpf, pid_env_map):
+    def __init__(self, _args, bpf, pid_env_map, ring_buffers=None):
         super().__init__(_args)
         self.b = bpf
         self.pid_env_map = pid_env_map
+        self.tag_filter = _args.tag_filter
+        # exec events come through a ring buffer when the kernel has them (see EXEC_RINGBUF)
+        self.ring_buffers = ring_buffers if ring_buffers and ringbuf_supported() else None
+        # tracked envs are captured by the kernel at exec time (see EXEC_ENVS)
+        self.exec_envs = _args.exec_envs
+        self.env_prefixes = None
+        # fork and exit events keep pid_env_map exact, it is vaccumed otherwise
+        self.track_tasks = False
+        self.vaccumed_lost = 0
+        # (event type, tgid, parent tgid, captured envs when complete) since the last batch
+        self.pending = []
+        self.execs_total = 0
+        self.lost_total = 0
+        self.proc_reads_total = 0
+        self.reported = {"execs": 0, "lost": 0, "proc_reads": 0}
+        # self-metrics of the last interval, see SELFKEYS
+        self.metrics = {}
 
     def start(self):
-        self.b["events"].open_perf_buffer(self.get_process_envs)
+        if self.tag_filter:
+            self.seed_pid_filter()
+        if self.exec_envs:
+            self.update_env_prefixes()
+        if self.ring_buffers:
+            self.ring_buffers.open("events", self.queue_event, self.process_events)
+            self.ring_buffers.start()
+            return
+        self.b["events"].open_perf_buffer(self.queue_event, lost_cb=self.lost_events)
         self.t = Thread(target=self.trace_pid_exec)
         self.t.daemon = True
         self.t.start()
 
     def attach(self):
-        if self.envs:
-            self.b.attach_kprobe(event=self.b.get_syscall_fnname("execve"), fn_name="trace_execve")
+        if not self.envs:
+            return
+        self.b.attach_kprobe(event=self.b.get_syscall_fnname("execve"), fn_name="syscall__execve")
+        if not BPF.support_raw_tracepoint():
+            logger.info("Raw tracepoints are not supported, pids are vaccumed every %ds." % self.pid_env_map.vaccum_interval)
+            return
+        try:
+            self.b.attach_raw_tracepoint(tp="sched_process_fork", fn_name="trace_task_fork")
+            self.b.attach_raw_tracepoint(tp="sched_process_exit", fn_name="trace_task_exit")
+        except Exception as e:
+            logger.warning(f"Failed to attach the fork/exit tracepoints, pids are vaccumed instead: {e}")
+            return
+        self.track_tasks = True
 
     def trace_pid_exec(self):
         while True:
             self.b.perf_buffer_poll()
-            self.pid_env_map.vaccum_if_needed()
+            self.process_events()
+
+    def update_pid_filter(self, pid, envs):
+        """Add or remove pid from the in-kernel `pid_filter` map, by whether its envs pass the tag filter."""
+        pid_filter = self.b.get_table("pid_filter")
+        if match_tags(envs, self.envs, self.tag_filter):
+            pid_filter[pid_filter.Key(pid)] = pid_filter.Leaf(1)
+        else:
+            # the process may have been tracked before it exec'ed
+            pid_filter.pop(pid_filter.Key(pid), None)
+
+    def seed_pid_filter(self):
+        """Track the processes started before the collector."""
+        for pid in psutil.pids():
+            envs = get_pid_envs(pid, self.envs)
+            if envs:
+                self.pid_env_map.insert(pid, envs)
+            self.update_pid_filter(pid, envs)
 
-    def get_process_envs(self, cpu, data, size):
-        data = self.b["events"].event(data)
-        envs = get_pid_envs(data.pid, self.envs)
+    def vaccum_pid_filter(self):
+        pid_filter = self.b.get_table("pid_filter")
+        for key in pid_filter.keys():
+            if not Path("/proc/%d" % key.value).exists():
+                pid_filter.pop(key, None)
+
+    def update_env_prefixes(self):
+        """Load the tracked env prefixes into the in-kernel `env_prefixes` map."""
+        prefixes = sorted({env.encode()[:ENV_PREFIX_LEN] for env in self.envs or []})
+        table = self.b.get_table("env_prefixes")
+        table.clear()
+        lens = 0
+        for idx, prefix in enumerate(prefixes):
+            key = table.Key()
+            key.len = len(prefix)
+            key.prefix = prefix
+            table[key] = table.Leaf(idx)
+            lens |= 1 << (len(prefix) - 1)
+        lens_table = self.b.get_table("env_prefix_lens")
+        lens_table[0] = lens_table.Leaf(lens)
+        # the kernel stops scanning envp once all of them are found, up to 32 prefixes
+        all_table = self.b.get_table("env_prefix_all")
+        all_table[0] = all_table.Leaf((1 << len(prefixes)) - 1 if len(prefixes) <= 32 else 0)
+        self.env_prefixes = list(self.envs or [])
+
+    def queue_event(self, cpu_or_ctx, data, size):
+        # struct task_event_t header, read without building a ctypes struct per event
+        pid, event_type, ppid = (ctypes.c_uint32 * 3).from_address(data)
+        envs = None
+        if event_type == TASK_EXEC and self.exec_envs:
+            event = numpy.frombuffer(ctypes.string_at(data, PIDINFO_T_DTYPE.itemsize), dtype=PIDINFO_T_DTYPE)[0]
+            if event["complete"]:
+                envs = [env.decode("utf-8", "replace") for env in event["envs"][:event["nenvs"]]]
+        self.pending.append((event_type, pid, ppid, envs))
+
+    def lost_events(self, lost):
+        self.lost_total += lost
+
+    def process_events(self):
+        """
+        Track the environment of the processes exec'ed since the last batch, once per tgid.
+        The envs captured by the kernel are used when complete, /proc is read otherwise.
+        Forked children inherit the envs of their parent and exited processes are evicted.
+        """
+        events, self.pending = self.pending, []
+        self.execs_total += len(events)
+        if self.exec_envs and self.env_prefixes != list(self.envs or []):
+            # envs learned from the VDB schema changed
+            self.update_env_prefixes()
+        # Perf buffer events are not ordered across CPUs, so the batch is applied by
+        # event type: the last exec of a tgid wins over the envs inherited on fork.
+        execs = {pid: environ for event_type, pid, _, environ in events if event_type == TASK_EXEC}
+        for pid, environ in execs.items():
+            self.get_process_envs(pid, environ)
+        for event_type, pid, ppid, _ in events:
+            if event_type == TASK_FORK and pid not in execs:
+                self.pid_env_map.fork(pid, ppid)
+        for event_type, pid, _, _ in events:
+            if event_type == TASK_EXIT:
+                self.pid_env_map.exit(pid)
+        if self.track_tasks and self.lost_total == self.vaccumed_lost:
+            return
+        # exit events were lost or are not traced
+        if self.pid_env_map.vaccum_if_needed():
+            self.vaccumed_lost = self.lost_total
+            if self.tag_filter:
+                self.vaccum_pid_filter()
+
+    def get_process_envs(self, pid, environ=None):
+        if environ is None:
+            self.proc_reads_total += 1
+            envs = get_pid_envs(pid, self.envs)
+        else:
+            envs = match_envs(environ, self.envs)
         if envs:
-            self.pid_env_map.insert(data.pid, envs)
+            self.pid_env_map.insert(pid, envs)
+        if self.tag_filter:
+            self.update_pid_filter(pid, envs)
+
+    def update_metrics(self):
+        """Update the exec event self-metrics of the interval."""
+        if self.ring_buffers:
+            self.lost_total = self.b.get_table("drops").sum(EXECS_DROP).value
+        totals = {"execs": self.execs_total, "lost": self.lost_total, "proc_reads": self.proc_reads_total}
+        self.metrics = {
+            "EXEC_EVENTS": totals["execs"] - self.reported["execs"],
+            "EXEC_DROPS": totals["lost"] - self.reported["lost"],
+            "EXEC_PROC_READS": totals["proc_reads"] - self.reported["proc_reads"],
+        }
+        self.reported = totals
+        if self.metrics["EXEC_DROPS"]:
+            logger.warning(f"{self.metrics['EXEC_DROPS']} process exec events lost, their environment is not tracked.")
 
 
 class StatsCollector(MutableEnvsMixin):
@@ -371,12 +1403,42 @@ class StatsCollector(MutableEnvsMixin):
     Tracer traps pid execution and collects the existance of the tracked
     environment variables.
     """
-    def __init__(self, _args, bpf, pid_env_map, mounts_map):
+    def __init__(self, _args, bpf, pid_env_map, mounts_map, probe_mode="kprobe", cgroups_map=None):
         super().__init__(_args)
         self.b = bpf
         self.pid_env_map = pid_env_map
         self.mounts_map = mounts_map
+        self.cgroups_map = cgroups_map
+        self.probe_mode = probe_mode
         self.hostname = os.getenv("HOSTNAME", socket.gethostname())
+        self.latency_hist = _args.latency_hist
+        self.percpu_counts = _args.percpu_counts
+        self.double_buffer = _args.double_buffer
+        self.mount_filter = _args.mount_filter
+        # the mount filter is synced by both the MountWatcher and the StatsSampler threads
+        self.mount_filter_lock = Lock()
+        self.ops = _args.ops or OPS
+        self.tag_registry = TagRegistry()
+        self.info_t_dtype = info_t_dtype(key_fields(_args))
+        self.hist_key_t_dtype = hist_key_t_dtype(self.info_t_dtype)
+        self.map_sizes = {name: getattr(_args, f"{name}_map_size") for name in DROP_MAPS}
+        self.map_autosize = _args.map_autosize
+        self.map_autosize_threshold = _args.map_autosize_threshold
+        self.state_dir = _args.state_dir
+        self.starts_max_age = _args.starts_max_age
+        self.drops_total = dict.fromkeys(DROP_MAPS, 0)
+        # starts inserted and taken, and the entries of the `starts` map, at the last check_maps()
+        self.starts_totals = {"inserted": 0, "taken": 0, "entries": 0}
+        self.full_intervals = dict.fromkeys(DROP_MAPS, 0)
+        self.grown = set()
+        # collector self-metrics of the last interval, see SELFKEYS
+        self.metrics = {}
+        # traced NFS functions with kprobes attached
+        self.attached = set()
+        # whether the probe set is attached, see MountWatcher
+        self.active = False
+        # startup timings in seconds
+        self.timings = {}
         # check whether hash table batch ops is supported
         try:
             self.batch_ops = True if BPF.kernel_struct_has_field(b'bpf_map_ops',
@@ -384,179 +1446,448 @@ class StatsCollector(MutableEnvsMixin):
         except:
             self.batch_ops = False
 
+    def update_mount_filter(self):
+        """
+        Sync the in-kernel `mount_filter` map with the superblock devices of the
+        NFS mounts matching the --mount-filter patterns.
+        """
+        table = self.b.get_table("mount_filter")
+        with self.mount_filter_lock:
+            allowed = {
+                kernel_devt(devt) for devt, mount_info in self.mounts_map.refresh().items()
+                if mount_info.matches(self.mount_filter)
+            }
+            current = {key.value for key in table.keys()}
+            for devt in allowed - current:
+                table[table.Key(devt)] = table.Leaf(1)
+            for devt in current - allowed:
+                try:
+                    del table[table.Key(devt)]
+                except KeyError:
+                    pass
+            if allowed != current:
+                logger.info(f"Tracing {len(allowed)} mounts matching {self.mount_filter}")
+
     def attach(self):
-        # file attachments
-        self.b.attach_kprobe(event="nfs_file_read", fn_name="trace_nfs_file_read")               # updates read count,rbytes
-        self.b.attach_kretprobe(event="nfs_file_read", fn_name="trace_nfs_file_read_ret")        # updates read errors,duration
-        self.b.attach_kprobe(event="nfs_file_write", fn_name="trace_nfs_file_write")             # updates write count,bytes
-        self.b.attach_kretprobe(event="nfs_file_write", fn_name="trace_nfs_file_write_ret")      # updates write errors,duration
-        self.b.attach_kprobe(event="nfs_file_open", fn_name="trace_nfs_file_open")               # updates open count
-        self.b.attach_kretprobe(event="nfs_file_open", fn_name="trace_nfs_file_open_ret")        # updates open errors,duration
-        self.b.attach_kprobe(event="nfs_getattr", fn_name="trace_nfs_getattr")                   # updates getattr count
-        self.b.attach_kretprobe(event="nfs_getattr", fn_name="trace_nfs_getattr")                # updates getattr errors,duration
-        self.b.attach_kprobe(event="nfs_setattr", fn_name="trace_nfs_setattr")                   # updates setattr count
-        self.b.attach_kretprobe(event="nfs_setattr", fn_name="trace_nfs_setattr_ret")            # updates setattr errors,duration
-        self.b.attach_kprobe(event="nfs_file_flush", fn_name="trace_nfs_file_flush")             # updates flush count
-        self.b.attach_kretprobe(event="nfs_file_flush", fn_name="trace_nfs_file_flush_ret")      # updates flush errors,duration
-        self.b.attach_kprobe(event="nfs_file_fsync", fn_name="trace_nfs_file_fsync")             # updates fsync count
-        self.b.attach_kretprobe(event="nfs_file_fsync", fn_name="trace_nfs_file_fsync_ret")      # updates fsync errors,duration
-        # (XXX: should we track unlocks as well)
-        self.b.attach_kprobe(event="nfs_lock", fn_name="trace_nfs_lock")                         # updates lock count
-        self.b.attach_kretprobe(event="nfs_lock", fn_name="trace_nfs_lock_ret")                  # updates lock errors,duration
-        self.b.attach_kprobe(event="nfs_flock", fn_name="trace_nfs_lock")                        # updates lock count
-        self.b.attach_kretprobe(event="nfs_flock", fn_name="trace_nfs_lock_ret")                 # updates lock errors,duration
-        # check if kprobe exists (4.18.x)
-        if BPF.get_kprobe_functions(b'nfs_file_splice_read'):
-            self.b.attach_kprobe(event="nfs_file_splice_read", fn_name="trace_nfs_file_splice_read") # updates reads,rbytes
-
-        self.b.attach_kprobe(event="nfs_file_mmap", fn_name="trace_nfs_file_mmap")               # updates mmap count
-        self.b.attach_kretprobe(event="nfs_file_mmap", fn_name="trace_nfs_file_mmap_ret")        # updates mmap errors,duration
-        self.b.attach_kprobe(event="nfs_file_release", fn_name="trace_nfs_file_release")         # updates close count
-        self.b.attach_kretprobe(event="nfs_file_release", fn_name="trace_nfs_file_release_ret")  # updates close errors,duration
-        # directory attachments
-        self.b.attach_kprobe(event="nfs_readdir", fn_name="trace_nfs_readdir")                   # updates readdir count
-        self.b.attach_kretprobe(event="nfs_readdir", fn_name="trace_nfs_readdir_ret")            # updates readdir errors,duration
-        self.b.attach_kprobe(event="nfs_create", fn_name="trace_nfs_create")                     # updates create count
-        self.b.attach_kretprobe(event="nfs_create", fn_name="trace_nfs_create_ret")              # updates create errors,duration
-        self.b.attach_kprobe(event="nfs_link", fn_name="trace_nfs_link")                         # updates link count
-        self.b.attach_kretprobe(event="nfs_link", fn_name="trace_nfs_link_ret")                  # updates link errors,duration
-        self.b.attach_kprobe(event="nfs_unlink", fn_name="trace_nfs_unlink")                     # updates unlink count
-        self.b.attach_kretprobe(event="nfs_unlink", fn_name="trace_nfs_unlink_ret")              # updates unlink errors,duration
-        self.b.attach_kprobe(event="nfs_symlink", fn_name="trace_nfs_symlink")                   # updates symlink count
-        self.b.attach_kretprobe(event="nfs_symlink", fn_name="trace_nfs_symlink_ret")            # updates symlink errors,duration
-        self.b.attach_kprobe(event="nfs_lookup", fn_name="trace_nfs_lookup")                     # updates lookup count
-        self.b.attach_kretprobe(event="nfs_lookup", fn_name="trace_nfs_lookup_ret")              # updates lookup errors,duration
-        self.b.attach_kprobe(event="nfs_rename", fn_name="trace_nfs_rename")                     # updates rename count
-        self.b.attach_kretprobe(event="nfs_rename", fn_name="trace_nfs_rename_ret")              # updates rename errors,duration
-        self.b.attach_kprobe(event="nfs_do_access", fn_name="trace_nfs_do_access")               # updates access
-        self.b.attach_kretprobe(event="nfs_do_access", fn_name="trace_nfs_do_access_ret")        # updates access errors,duration
-        self.b.attach_kprobe(event="nfs_mkdir", fn_name="trace_nfs_mkdir")                       # updates mkdir count
-        self.b.attach_kretprobe(event="nfs_mkdir", fn_name="trace_nfs_mkdir_ret")                # updates mkdir errors,duration
-        self.b.attach_kprobe(event="nfs_rmdir", fn_name="trace_nfs_rmdir")                       # updates rmdir count
-        self.b.attach_kretprobe(event="nfs_rmdir", fn_name="trace_nfs_rmdir_ret")                # updates rmdir errors,duration
-        # nfs4 attachments
-        if BPF.get_kprobe_functions(b'nfs4_file_open'):
-            self.b.attach_kprobe(event="nfs4_file_open", fn_name="trace_nfs_file_open")         # updates open count
-            self.b.attach_kretprobe(event="nfs4_file_open", fn_name="trace_nfs_file_open_ret")  # updates open errors,duration
-            self.b.attach_kprobe(event="nfs4_file_flush", fn_name="trace_nfs_file_flush")       # updates flush count
-            self.b.attach_kretprobe(event="nfs4_file_flush", fn_name="trace_nfs_file_flush_ret")# updates flush errors,duration
-        if BPF.get_kprobe_functions(b'nfs4_listxattr'):
-            self.b.attach_kprobe(event="nfs4_listxattr", fn_name="trace_nfs_listxattrs")        # updates listxattr count
-            self.b.attach_kretprobe(event="nfs4_listxattr", fn_name="trace_nfs_listxattrs_ret") # updates listxattr errors,duration
-        if BPF.get_kprobe_functions(b'nfs3_listxattr'):
-            self.b.attach_kprobe(event="nfs3_listxattr", fn_name="trace_nfs_listxattrs")        # updates listxattr count
-            self.b.attach_kretprobe(event="nfs3_listxattr", fn_name="trace_nfs_listxattrs_ret") # updates listxattr errors,duration
+        """
+        Load the kprobe handlers and attach them to the traced NFS functions.
+        Probes attached by a previous, partially failed call are kept, so the call
+        can be retried until the NFS functions show up. Load and attach times
+        are recorded in `timings`.
+        """
+        if self.mount_filter:
+            self.update_mount_filter()
+        if self.probe_mode == "fentry":
+            # fentry/fexit programs are attached when the BPF program is loaded
+            self.active = True
+            return
+        start = time.monotonic()
+        # a single kallsyms read for the whole probe set, optional functions
+        # exist on some kernels and NFS versions only
+        symbols = nfs_symbols()
+        plan = [
+            (event, fn_name, ret_fn_name) for event, op, fn_name, ret_fn_name, required in NFS_PROBES
+            if (required or event in symbols) and op in self.ops and event not in self.attached
+        ]
+        for fn_name in {fn for _, entry, ret in plan for fn in (entry, ret)}:
+            self.b.load_func(fn_name, BPF.KPROBE)
+        loaded = time.monotonic()
+        for event, fn_name, ret_fn_name in plan:
+            self.b.attach_kprobe(event=event, fn_name=fn_name)
+            try:
+                self.b.attach_kretprobe(event=event, fn_name=ret_fn_name)
+            except Exception:
+                self.b.detach_kprobe(event=event)
+                raise
+            self.attached.add(event)
+        self.timings["load"] = loaded - start
+        self.timings["attach"] = time.monotonic() - loaded
+        self.active = True
+
+    def detach(self):
+        """
+        Detach the kprobes attached by attach(). fentry/fexit programs stay attached,
+        they cost nothing while the NFS functions aren't called.
+        """
+        for event in list(self.attached):
+            self.b.detach_kprobe(event=event)
+            self.b.detach_kretprobe(event=event)
+            self.attached.discard(event)
+        self.active = False
+
+    def startup_timings(self, compile_time):
+        """Format the BPF program compile time and the recorded load and attach times."""
+        if self.probe_mode == "fentry":
+            # fentry/fexit programs are loaded and attached along with the compilation
+            return f"compile+load+attach {compile_time:.2f}s"
+        return (
+            f"compile {compile_time:.2f}s, load {self.timings.get('load', 0):.2f}s,"
+            f" attach {self.timings.get('attach', 0):.2f}s"
+        )
+
+    def drain_table(self, name, key_dtype, value_dtype):
+        """
+        Drain the `name` map and return its raw keys and values as arrays
+        of key_dtype and value_dtype.
+        """
+        table = self.b.get_table(name)
+        keys, values = bytearray(), bytearray()
+        for k, v in (table.items_lookup_and_delete_batch() if self.batch_ops else table.items()):
+            keys += k
+            values += v
+
+        if not self.batch_ops:
+            table.clear()
+
+        return (
+            numpy.frombuffer(bytes(keys), dtype=key_dtype),
+            numpy.frombuffer(bytes(values), dtype=value_dtype),
+        )
+
+    def swap_buffers(self):
+        """
+        Flip the active set of maps the probes update and return the index of
+        the previously active one, which is no longer updated and can be drained.
+        """
+        active = self.b.get_table("counts_active")
+        idx = active[0].value
+        active[0] = active.Leaf(1 - idx)
+        # let the probes which read the old index before the flip complete their update.
+        time.sleep(SWAP_GRACE_PERIOD)
+        return idx
+
+    def read_counts(self, idx=0):
+        """
+        Drain the `counts` map (`counts_alt` for idx 1) and return its raw keys
+        and values as structured arrays of the `info_t` dtype and STATS_T_DTYPE.
+        Per-CPU values are summed into a single value per key.
+        """
+        keys, values = self.drain_table(COUNTS_TABLES[idx], self.info_t_dtype, STATS_T_DTYPE)
+        if self.percpu_counts and len(keys):
+            # every per-CPU value holds one stats_t per possible CPU
+            values = reduce_percpu(values.reshape(len(keys), -1))
+        return keys, values
+
+    def read_hists(self, idx=0):
+        """
+        Drain the `hists` map (`hists_alt` for idx 1) and return its raw keys
+        and bucket counters as arrays of the `hist_key_t` dtype and u64.
+        """
+        return self.drain_table(HISTS_TABLES[idx], self.hist_key_t_dtype, numpy.uint64)
+
+    def sweep_starts(self):
+        """
+        Evict `starts` entries older than --starts-max-age, i.e. calls whose kretprobe
+        was missed. Returns the number of remaining and evicted entries.
+        """
+        starts = self.b.get_table("starts")
+        if not self.starts_max_age:
+            return len(starts), 0
+        # start times are bpf_ktime_get_ns() timestamps, i.e. CLOCK_MONOTONIC
+        deadline = time.monotonic_ns() - self.starts_max_age * 1000000000
+        entries, evicted = 0, 0
+        for k, v in starts.items():
+            # a zero start belongs to an entry being initialized right now
+            if 0 < v.start < deadline:
+                starts.pop(k, None)
+                evicted += 1
+            else:
+                entries += 1
+        if evicted:
+            logger.debug(f"Evicted {evicted} starts older than {self.starts_max_age}s.")
+        return entries, evicted
+
+    def lru_evicted_starts(self, entries, swept):
+        """
+        Number of starts evicted by the LRU `starts` map in the interval: an insert into
+        the full map never fails, the least recently used start is evicted instead. The
+        starts inserted and neither taken by a return probe, swept by sweep_starts() nor
+        still in the map were evicted. The counters and the entries are not read at once,
+        so the count is approximate.
+        """
+        events = self.b.get_table("start_events")
+        totals = {
+            "inserted": events.sum(STARTS_INSERTED).value,
+            "taken": events.sum(STARTS_TAKEN).value,
+            "entries": entries,
+        }
+        last, self.starts_totals = self.starts_totals, totals
+        evicted = (
+            (totals["inserted"] - last["inserted"]) - (totals["taken"] - last["taken"])
+            - swept - (totals["entries"] - last["entries"])
+        )
+        return max(evicted, 0)
+
+    def check_maps(self, counts_entries):
+        """
+        Update the map self-metrics: fill ratio and inserts dropped in the interval.
+        With --map-autosize the size of a map which keeps filling up is doubled
+        for the next start.
+        """
+        drops = self.b.get_table("drops")
+        starts_entries, self.metrics["STARTS_EVICTED"] = self.sweep_starts()
+        entries = {"counts": counts_entries, "starts": starts_entries}
+        evicted = {"counts": 0, "starts": self.lru_evicted_starts(starts_entries, self.metrics["STARTS_EVICTED"])}
+        for idx, name in enumerate(DROP_MAPS):
+            total = drops.sum(idx).value
+            dropped, self.drops_total[name] = total - self.drops_total[name] + evicted[name], total
+            fill = entries[name] / self.map_sizes[name]
+            self.metrics.update({
+                f"{name.upper()}_ENTRIES": entries[name],
+                f"{name.upper()}_FILL": fill,
+                f"{name.upper()}_DROPS": dropped,
+            })
+            if dropped:
+                logger.warning(f"{dropped} NFS calls dropped, the {name} map is full ({self.map_sizes[name]} entries).")
+            if dropped or fill > self.map_autosize_threshold:
+                self.full_intervals[name] += 1
+            else:
+                self.full_intervals[name] = 0
+            if self.map_autosize and self.full_intervals[name] >= AUTOSIZE_INTERVALS and name not in self.grown:
+                self.grow_map(name)
+
+    def grow_map(self, name):
+        """Persist the doubled size of the map, to be applied on the next start."""
+        state = Path(self.state_dir, MAP_SIZES_STATE)
+        try:
+            sizes = json.loads(state.read_text())
+        except (OSError, ValueError):
+            sizes = {}
+        sizes[name] = self.map_sizes[name] * 2
+        try:
+            state.parent.mkdir(parents=True, exist_ok=True)
+            state.write_text(json.dumps(sizes))
+        except OSError as e:
+            logger.error(f"Failed to save the {name} map size: {e}")
+            return
+        self.grown.add(name)
+        logger.warning(f"The {name} map keeps filling up, it will be grown to {sizes[name]} entries on the next start.")
 
     def collect_stats(self, interval, squash_pid=False, filter_tags=None, filter_condition=None, anon_fields=None):
         timestamp = pd.Timestamp.utcnow().astimezone(None).floor("s")
         logger.debug(f"######## collect sample ########")
+        # processes exited before the maps are read have all their stats in this sample
+        exited = self.pid_env_map.exited_pids()
+        # pick up matching mounts mounted since the last interval
+        if self.mount_filter:
+            self.update_mount_filter()
 
-        counts = self.b.get_table("counts")
-        statistics = []
-        for k, v in (counts.items_lookup_and_delete_batch() if self.batch_ops else counts.items()):
-            output = {
-                    "TIMEDELTA": interval,
-                    "TIMESTAMP":        timestamp,
-                    "HOSTNAME":         self.hostname,
-                    "PID":              k.tgid, # real pid is the thread-group id
-                    "UID":              k.uid,
-                    "COMM":             k.comm.decode('utf-8', 'replace'),
-                    "OPEN_COUNT":       v.open.count,
-                    "OPEN_ERRORS":      v.open.errors,
-                    "OPEN_DURATION":    nstosec(v.open.duration),
-                    "CLOSE_COUNT":      v.close.count,
-                    "CLOSE_ERRORS":     v.close.errors,
-                    "CLOSE_DURATION":   nstosec(v.close.duration),
-                    "READ_COUNT":       v.read.count,
-                    "READ_ERRORS":      v.read.errors,
-                    "READ_DURATION":    nstosec(v.read.duration),
-                    "READ_BYTES":       v.rbytes,
-                    "WRITE_COUNT":      v.write.count,
-                    "WRITE_ERRORS":     v.write.errors,
-                    "WRITE_DURATION":   nstosec(v.write.duration),
-                    "WRITE_BYTES":      v.wbytes,
-                    "GETATTR_COUNT":    v.getattr.count,
-                    "GETATTR_ERRORS":   v.getattr.errors,
-                    "GETATTR_DURATION": nstosec(v.getattr.duration),
-                    "SETATTR_COUNT":    v.setattr.count,
-                    "SETATTR_ERRORS":   v.setattr.errors,
-                    "SETATTR_DURATION": nstosec(v.setattr.duration),
-                    "FLUSH_COUNT":      v.flush.count,
-                    "FLUSH_ERRORS":     v.flush.errors,
-                    "FLUSH_DURATION":   nstosec(v.flush.duration),
-                    "FSYNC_COUNT":      v.fsync.count,
-                    "FSYNC_ERRORS":     v.fsync.errors,
-                    "FSYNC_DURATION":   nstosec(v.fsync.duration),
-                    "LOCK_COUNT":       v.lock.count,
-                    "LOCK_ERRORS":      v.lock.errors,
-                    "LOCK_DURATION":    nstosec(v.lock.duration),
-                    "MMAP_COUNT":       v.mmap.count,
-                    "MMAP_ERRORS":      v.mmap.errors,
-                    "MMAP_DURATION":    nstosec(v.mmap.duration),
-                    "READDIR_COUNT":    v.readdir.count,
-                    "READDIR_ERRORS":   v.readdir.errors,
-                    "READDIR_DURATION": nstosec(v.readdir.duration),
-                    "CREATE_COUNT":     v.create.count,
-                    "CREATE_ERRORS":    v.create.errors,
-                    "CREATE_DURATION":  nstosec(v.create.duration),
-                    "LINK_COUNT":       v.link.count,
-                    "LINK_ERRORS":      v.link.errors,
-                    "LINK_DURATION":    nstosec(v.link.duration),
-                    "UNLINK_COUNT":     v.unlink.count,
-                    "UNLINK_ERRORS":    v.unlink.errors,
-                    "UNLINK_DURATION":  nstosec(v.unlink.duration),
-                    "SYMLINK_COUNT":    v.symlink.count,
-                    "SYMLINK_ERRORS":   v.symlink.errors,
-                    "SYMLINK_DURATION": nstosec(v.symlink.duration),
-                    "LOOKUP_COUNT":     v.lookup.count,
-                    "LOOKUP_ERRORS":    v.lookup.errors,
-                    "LOOKUP_DURATION":  nstosec(v.lookup.duration),
-                    "RENAME_COUNT":     v.rename.count,
-                    "RENAME_ERRORS":    v.rename.errors,
-                    "RENAME_DURATION":  nstosec(v.rename.duration),
-                    "ACCESS_COUNT":     v.access.count,
-                    "ACCESS_ERRORS":    v.access.errors,
-                    "ACCESS_DURATION":  nstosec(v.access.duration),
-                    "MKDIR_COUNT":     v.mkdir.count,
-                    "MKDIR_ERRORS":    v.mkdir.errors,
-                    "MKDIR_DURATION":  nstosec(v.mkdir.duration),
-                    "RMDIR_COUNT":     v.rmdir.count,
-                    "RMDIR_ERRORS":    v.rmdir.errors,
-                    "RMDIR_DURATION":  nstosec(v.rmdir.duration),
-                    "LISTXATTR_COUNT":  v.listxattr.count,
-                    "LISTXATTR_ERRORS": v.listxattr.errors,
-                    "LISTXATTR_DURATION":nstosec(v.listxattr.duration),
-                    "TAGS":         hashabledict(self.pid_env_map.get(k.tgid, self.envs)),
-            }
-            mount_info = self.mounts_map.get_mountpoint(k.sbdev, k.tgid)
-            if mount_info:
-                output["MOUNT"] = mount_info.mountpoint
-                output["REMOTE_PATH"] = mount_info.remote_path
-            else:
-                output["MOUNT"] = output["REMOTE_PATH"] = ""
+        # With double buffering the probes move on to the other set of maps and
+        # the previously active one is drained while nothing updates it.
+        idx = self.swap_buffers() if self.double_buffer else 0
+        # Histograms are drained first, so every sample they hold has its `counts` entry.
+        if self.latency_hist:
+            hist_keys, hist_values = self.read_hists(idx)
+        keys, values = self.read_counts(idx)
+        self.check_maps(len(keys))
+        statistics = {
+            "TIMEDELTA": interval,
+            "TIMESTAMP": timestamp,
+            "HOSTNAME": self.hostname,
+        }
+        statistics.update(decode_counts(keys, values, self.ops))
+        if self.latency_hist:
+            statistics.update(decode_hists(keys, hist_keys, hist_values, self.ops))
 
-            statistics.append(output)
+        # Tags and mounts are resolved once per distinct tgid/devt rather than per map entry.
+        # Tag sets are interned, rows carry their TAG_ID until they are handed to the drivers.
+        self.tag_registry.reset_if_full()
+        if "tgid" in keys.dtype.names:
+            tgids = keys["tgid"].tolist()
+            statistics["TAG_ID"] = self.tag_registry.tag_ids(
+                keys["tgid"], lambda tgid: self.pid_env_map.get(tgid, self.envs)
+            )
+            self.pid_env_map.evict(exited)
+        else:
+            # no envs are tracked when tgid is left out of the key
+            tgids = ["self"] * len(keys)
+            statistics["TAG_ID"] = numpy.zeros(len(keys), dtype=numpy.int64)
 
-        if not self.batch_ops:
-            counts.clear()
+        if "mntns" in keys.dtype.names:
+            # resolved once per mount namespace and devt
+            self.mounts_map.refresh_namespaces()
+            mount_keys = keys["mntns"].astype(numpy.uint64) << 32 | keys["sbdev"]
+        else:
+            mount_keys = keys["sbdev"]
+        _, first, inverse = numpy.unique(mount_keys, return_index=True, return_inverse=True)
+        mounts, remote_paths = [], []
+        for row in first.tolist():
+            sbdev = int(keys["sbdev"][row])
+            if "mntns" in keys.dtype.names:
+                pid = None if tgids[row] == "self" else tgids[row]
+                mount_info = self.mounts_map.get_ns_mountpoint(sbdev, int(keys["mntns"][row]), pid)
+            else:
+                mount_info = self.mounts_map.get_mountpoint(sbdev, tgids[row])
+            mounts.append(mount_info.mountpoint if mount_info else "")
+            remote_paths.append(mount_info.remote_path if mount_info else "")
+        statistics["MOUNT"] = numpy.array(mounts, dtype=object)[inverse]
+        statistics["REMOTE_PATH"] = numpy.array(remote_paths, dtype=object)[inverse]
+        if "cgroup" in keys.dtype.names:
+            statistics.update(self.cgroups_map.columns(keys["cgroup"]))
 
-        df = pd.DataFrame(statistics)
+        df = pd.DataFrame(statistics) if len(keys) else pd.DataFrame()
         if not df.empty:
             if filter_condition:
-                df = filter_stats(data=df, filter_tags=filter_tags, filter_condition=filter_condition)
+                df = df[df["TAG_ID"].isin(self.tag_registry.matching(filter_tags, filter_condition))]
+            # with cgroups the stats of every cgroup are kept apart
+            cgroup = ["CGROUP"] if "CGROUP" in df.columns else []
             if squash_pid:
                 # aggregation by command, tags and mount.
                 # Pid will be squashed eg, if we have the same command but different pids
                 #   COMM TAGS MOUNT  OPEN_COUNT  OPEN_ERRORS  OPEN_DURATION  CLOSE_COUNT ...
                 #   ls   {}   /mnt            0            0            0.0            0 ...
-                df = group_stats(df, ["MOUNT", "COMM", "TAGS"])
+                df = group_stats(df, ["MOUNT", "COMM", "TAG_ID"] + cgroup)
             else:
                 # Statistics is aggregated by mount pig and tags. Eg if we have 4 ls commands.
                 # 2 with PID=2811828 and 2 with PID=2811867
                 #   COMM TAGS MOUNT      PID  OPEN_COUNT  OPEN_ERRORS  OPEN_DURATION  CLOSE_COUNT ...
                 #   ls   {}        2811828           0            0            0.0            0 ...
                 #   ls   {}        2811867           0            0            0.0            0 ...
-                df = group_stats(df, ["MOUNT", "PID", "TAGS"])
+                df = group_stats(df, ["MOUNT", "PID", "TAG_ID"] + cgroup)
+            df.insert(df.columns.get_loc("TAG_ID"), "TAGS", self.tag_registry.lookup(df.pop("TAG_ID")))
             if anon_fields:
-                df = anonymize_stats(df, anon_fields)
+                # the cgroup columns are only there with --cgroup
+                df = anonymize_stats(df, [field for field in anon_fields if field in df.columns])
         return df
+
+
+# Stats, self-metrics and slow NFS calls of one interval of `interval` seconds, see StatsSampler.
+Sample = namedtuple("Sample", ["data", "metrics", "events", "interval"])
+
+
+class StatsSampler:
+    """
+    Worker thread collecting the stats every interval, off the asyncio event loop.
+    Draining the maps, resolving mounts and aggregating can take long with large maps,
+    finished samples are handed to the loop through an asyncio queue so the drivers
+    are never blocked by a collection.
+    """
+    def __init__(self, _args, collector, loop, env_tracer=None, slow_ops_tracer=None):
+        self.args = _args
+        self.collector = collector
+        self.env_tracer = env_tracer
+        self.slow_ops_tracer = slow_ops_tracer
+        self.loop = loop
+        self.samples = asyncio.Queue()
+        self.stopped = Event()
+
+    def start(self):
+        self.t = Thread(target=self.run)
+        self.t.daemon = True
+        self.t.start()
+
+    def stop(self):
+        self.stopped.set()
+
+    def sample(self) -> Sample:
+        """Collect the stats, self-metrics and slow NFS calls of the interval."""
+        start = time.monotonic()
+        data = self.collector.collect_stats(
+            interval=self.args.interval,
+            squash_pid=self.args.squash_pid,
+            filter_tags=self.args.envs,
+            filter_condition=self.args.tag_filter,
+            anon_fields=self.args.anon_fields,
+        )
+        metrics = dict(self.collector.metrics)
+        if self.env_tracer:
+            self.env_tracer.update_metrics()
+            metrics = {**metrics, **self.env_tracer.metrics}
+        events = pd.DataFrame()
+        if self.slow_ops_tracer:
+            events = self.slow_ops_tracer.drain(anon_fields=self.args.anon_fields)
+            metrics = {**metrics, **self.slow_ops_tracer.metrics}
+        metrics["COLLECT_SECONDS"] = time.monotonic() - start
+        return Sample(data, metrics, events, self.args.interval)
+
+    def run(self):
+        # intervals are kept on a fixed schedule, a collection overrunning its interval skips the missed ones
+        deadline = time.monotonic() + self.args.interval
+        while not self.stopped.wait(max(deadline - time.monotonic(), 0)):
+            try:
+                self.loop.call_soon_threadsafe(self.samples.put_nowait, self.sample())
+            except Exception as e:
+                # a transient failure, eg a map read error, only costs the interval
+                logger.error(f"Collecting stats failed, the interval is skipped: {e}")
+            now = time.monotonic()
+            deadline += self.args.interval * ((now - deadline) // self.args.interval + 1)
+
+
+def coalesce_samples(old: Sample, new: Sample, squash_pid: bool) -> Sample:
+    """
+    One sample of the intervals of two samples: statistics of the same key are summed
+    (see collect_stats for the keys) over a TIMEDELTA of both intervals, starting at the
+    TIMESTAMP of the older sample. Slow calls are concatenated, counting self-metrics
+    are summed and the other self-metrics are the newer ones.
+    """
+    interval = old.interval + new.interval
+    if old.data.empty or new.data.empty:
+        data = new.data if old.data.empty else old.data
+    else:
+        group_fields = ["MOUNT", "COMM" if squash_pid else "PID", "TAGS"]
+        group_fields += ["CGROUP"] if "CGROUP" in new.data.columns else []
+        data = group_stats(pd.concat([old.data, new.data], ignore_index=True), group_fields)
+    if not data.empty:
+        # samples are shared by the queues of all drivers, the columns are replaced rather than updated
+        data = data.assign(TIMEDELTA=interval)
+        if not old.data.empty:
+            data = data.assign(TIMESTAMP=old.data["TIMESTAMP"].iloc[0])
+
+    if old.events.empty or new.events.empty:
+        events = new.events if old.events.empty else old.events
+    else:
+        events = pd.concat([old.events, new.events], ignore_index=True)
+
+    metrics = dict(new.metrics)
+    for key in DELTA_SELFKEYS.intersection(old.metrics, new.metrics):
+        if isinstance(new.metrics[key], dict):
+            metrics[key] = {k: old.metrics[key].get(k, 0) + v for k, v in new.metrics[key].items()}
+        else:
+            metrics[key] = old.metrics[key] + new.metrics[key]
+    return Sample(data, metrics, events, interval)
+
+
+class SampleQueue:
+    """
+    Bounded queue of the samples of one driver, consumed by its own task so a slow
+    driver doesn't hold up the others. When the queue is full a new sample is handled
+    by the overflow policy:
+    - `drop-oldest`: the oldest queued sample is dropped.
+    - `drop-newest`: the new sample is dropped.
+    - `coalesce`: the new sample is summed into the newest queued one.
+    """
+    def __init__(self, maxsize, policy, squash_pid=False):
+        if policy not in QUEUE_POLICIES:
+            raise ValueError(f"Invalid queue policy: {policy}")
+        self.maxsize = max(maxsize, 1)
+        self.policy = policy
+        self.squash_pid = squash_pid
+        self.samples = deque()
+        self.ready = asyncio.Event()
+        # samples dropped or coalesced since the last take_drops()
+        self.drops = 0
+
+    def __len__(self):
+        return len(self.samples)
+
+    def put(self, sample: Sample):
+        if len(self.samples) >= self.maxsize:
+            self.drops += 1
+            if self.policy == "drop-newest":
+                return
+            if self.policy == "coalesce":
+                self.samples[-1] = coalesce_samples(self.samples[-1], sample, self.squash_pid)
+                return
+            self.samples.popleft()
+        self.samples.append(sample)
+        self.ready.set()
+
+    async def get(self) -> Sample:
+        while not self.samples:
+            self.ready.clear()
+            await self.ready.wait()
+        return self.samples.popleft()
+
+    def take_drops(self) -> int:
+        drops, self.drops = self.drops, 0
+        return drops
@@ -6,6 +6,7 @@ import signal
 import argparse
 import inspect
 
+import numpy as np
 import pandas as pd
 
 
@@ -19,6 +20,8 @@ def iso_serializer(obj):
         return obj.isoformat()
     if isinstance(obj, bytes):
         return obj.decode('utf-8')
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
     raise TypeError(f"Type {type(obj)} not serializable")
 
 
@@ -29,6 +32,8 @@ def unix_serializer(obj):
         return int(obj.timestamp())
     if isinstance(obj, bytes):
         return obj.decode('utf-8')
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
     raise TypeError(f"Type {type(obj)} not serializable")
 
 
@@ -58,6 +63,26 @@ async def await_until_event_or_timeout(timeout: int, stop_event: asyncio.Event)
     return cancel_task in done
 
 
+async def await_until_event_or_get(queue: asyncio.Queue, stop_event: asyncio.Event):
+    """
+    Waits for either an item of the queue or an external event, whichever comes first.
+    Args:
+        queue (asyncio.Queue): The queue to get the item from.
+        stop_event (asyncio.Event): An asyncio Event object to wait for.
+
+    Returns:
+        The item of the queue, or None if the event was set first.
+    """
+    get_task = asyncio.ensure_future(queue.get())
+    cancel_task = asyncio.ensure_future(stop_event.wait())
+    done, pending = await asyncio.wait({get_task, cancel_task}, return_when=asyncio.FIRST_COMPLETED)
+
+    for task in pending:
+        task.cancel()
+
+    return get_task.result() if get_task in done else None
+
+
 def parse_args_options_from_namespace(namespace, parser):
     """
     Parse the arguments and options from the namespace object.